@@ -10,6 +10,10 @@ CREATE TABLE IF NOT EXISTS public.detections (
   inference_speed FLOAT NOT NULL
 );
 
+-- Time-range queries (dashboard history, /analytics recent detections)
+CREATE INDEX IF NOT EXISTS idx_detections_timestamp ON public.detections (timestamp);
+CREATE INDEX IF NOT EXISTS idx_detections_type_timestamp ON public.detections (waste_type, timestamp);
+
 -- Enable Row Level Security (RLS)
 ALTER TABLE public.detections ENABLE ROW LEVEL SECURITY;
 
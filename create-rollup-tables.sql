@@ -0,0 +1,57 @@
+-- Rollup tables for historical analytics
+-- Run this in the Supabase SQL Editor
+--
+-- The detection API aggregates events into minute/hour/day buckets and pushes
+-- them here through upsert_detection_rollups(), so history queries never have
+-- to scan the raw detections table.
+
+CREATE TABLE IF NOT EXISTS public.detection_rollups (
+  bucket TEXT NOT NULL CHECK (bucket IN ('minute', 'hour', 'day')),
+  bucket_start TIMESTAMP NOT NULL,
+  waste_type TEXT NOT NULL,
+  is_correct BOOLEAN NOT NULL,
+  zone TEXT NOT NULL,
+  count BIGINT NOT NULL,
+  speed_sum DOUBLE PRECISION NOT NULL,
+  speed_min DOUBLE PRECISION NOT NULL,
+  speed_max DOUBLE PRECISION NOT NULL,
+  PRIMARY KEY (bucket, bucket_start, waste_type, is_correct, zone)
+);
+
+-- Range scans by bucket size and time
+CREATE INDEX IF NOT EXISTS idx_detection_rollups_range ON public.detection_rollups (bucket, bucket_start);
+
+-- Increment rollups in place; called by the API with a JSON array of rows
+CREATE OR REPLACE FUNCTION upsert_detection_rollups(rows jsonb)
+RETURNS void AS $$
+BEGIN
+  INSERT INTO public.detection_rollups AS r
+    (bucket, bucket_start, waste_type, is_correct, zone, count, speed_sum, speed_min, speed_max)
+  SELECT
+    x->>'bucket',
+    (x->>'bucket_start')::timestamp,
+    x->>'waste_type',
+    (x->>'is_correct')::boolean,
+    x->>'zone',
+    (x->>'count')::bigint,
+    (x->>'speed_sum')::double precision,
+    (x->>'speed_min')::double precision,
+    (x->>'speed_max')::double precision
+  FROM jsonb_array_elements(rows) AS x
+  ON CONFLICT (bucket, bucket_start, waste_type, is_correct, zone) DO UPDATE SET
+    count = r.count + EXCLUDED.count,
+    speed_sum = r.speed_sum + EXCLUDED.speed_sum,
+    speed_min = LEAST(r.speed_min, EXCLUDED.speed_min),
+    speed_max = GREATEST(r.speed_max, EXCLUDED.speed_max);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Enable Row Level Security (RLS)
+ALTER TABLE public.detection_rollups ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow all operations for now"
+  ON public.detection_rollups
+  FOR ALL
+  TO authenticated, anon
+  USING (true)
+  WITH CHECK (true);
@@ -0,0 +1,126 @@
+"""
+Throughput benchmark for the multi-worker launcher.
+
+Starts serve.py with 1..N workers, drives /detect with concurrent clients for
+a fixed duration at each worker count, and prints how requests/s scales.
+
+Usage:
+    python bench_workers.py --image sample.jpg --max-workers 4 --duration 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import requests
+
+parser = argparse.ArgumentParser(description="Benchmark /detect throughput vs. worker count")
+parser.add_argument('--image', help='Image to send (default: synthetic 1280x720 frame)', default=None)
+parser.add_argument('--max-workers', type=int, default=os.cpu_count() // 2 or 1)
+parser.add_argument('--duration', type=float, default=20.0, help='Seconds of load per worker count')
+parser.add_argument('--clients-per-worker', type=int, default=2)
+parser.add_argument('--port', type=int, default=8091)
+
+
+def load_payload(path):
+    if path:
+        with open(path, 'rb') as f:
+            return f.read()
+    frame = np.random.default_rng(0).integers(0, 255, (720, 1280, 3), dtype=np.uint8)
+    _, buffer = cv2.imencode('.jpg', frame)
+    return buffer.tobytes()
+
+
+def wait_until_ready(url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).ok:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def drive_load(url, payload, clients, duration):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        nonlocal errors
+        session = requests.Session()
+        while time.perf_counter() < stop_at:
+            t0 = time.perf_counter()
+            try:
+                r = session.post(url, files={'file': ('frame.jpg', payload, 'image/jpeg')}, timeout=60)
+                ok = r.ok
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - t0
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors, time.perf_counter() - started
+
+
+def main():
+    args = parser.parse_args()
+    payload = load_payload(args.image)
+    here = os.path.dirname(os.path.abspath(__file__))
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    rows = []
+    for workers in range(1, args.max_workers + 1):
+        print(f"\n--- {workers} worker(s) ---")
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(here, 'serve.py'),
+             '--workers', str(workers), '--host', '127.0.0.1', '--port', str(args.port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            if not wait_until_ready(base_url + '/'):
+                print("Server did not start; skipping")
+                continue
+            # Warm every worker before measuring
+            drive_load(base_url + '/detect', payload, workers * args.clients_per_worker, 3)
+            latencies, errors, wall = drive_load(
+                base_url + '/detect', payload, workers * args.clients_per_worker, args.duration
+            )
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+        throughput = len(latencies) / wall if wall > 0 else 0
+        p50 = np.percentile(latencies, 50) * 1000 if latencies else 0
+        p95 = np.percentile(latencies, 95) * 1000 if latencies else 0
+        rows.append((workers, throughput, p50, p95, errors))
+        print(f"{throughput:.2f} req/s, p50 {p50:.1f} ms, p95 {p95:.1f} ms, errors {errors}")
+
+    if not rows:
+        return
+    baseline = rows[0][1] or 1
+    print("\n===== WORKER SCALING RESULTS =====")
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7}")
+    for workers, throughput, p50, p95, errors in rows:
+        print(f"{workers:>8} {throughput:>10.2f} {throughput / baseline:>7.2f}x {p50:>9.1f} {p95:>9.1f} {errors:>7}")
+    print("==================================\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Per-session latest-frame-wins coalescing for the detection API.
+
+Each camera session gets one running slot and one pending slot. When a new
+frame arrives while an older frame is still waiting for the running one to
+finish, the older frame is superseded and answered straight away, so only
+the newest frame for a camera ever reaches the model.
+"""
+import asyncio
+from typing import Dict, Optional
+
+
+class _SessionSlot:
+    __slots__ = ("busy", "pending")
+
+    def __init__(self):
+        self.busy = False
+        self.pending: Optional[asyncio.Future] = None
+
+
+class LatestFrameCoalescer:
+    """Tracks the in-flight and pending frame of every session."""
+
+    def __init__(self):
+        self._slots: Dict[str, _SessionSlot] = {}
+        self.superseded_count = 0
+
+    async def acquire(self, session_id: str) -> bool:
+        """
+        Wait for the session's turn to run detection.
+
+        Returns:
+            True if the caller should process its frame, False if a newer
+            frame from the same session replaced it while it was waiting.
+        """
+        slot = self._slots.get(session_id)
+        if slot is None:
+            slot = self._slots[session_id] = _SessionSlot()
+
+        if not slot.busy:
+            slot.busy = True
+            return True
+
+        # Replace the queued frame (if any) with this one
+        if slot.pending is not None and not slot.pending.done():
+            slot.pending.set_result(False)
+            self.superseded_count += 1
+
+        waiter = asyncio.get_running_loop().create_future()
+        slot.pending = waiter
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            # Client went away; hand the slot on if we had already been given it
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release(session_id)
+            raise
+
+    def release(self, session_id: str):
+        """Finish the session's running frame and wake the pending one, if any."""
+        slot = self._slots.get(session_id)
+        if slot is None:
+            return
+
+        waiter = slot.pending
+        slot.pending = None
+        if waiter is not None and not waiter.done():
+            # Slot stays busy and passes straight to the newest frame
+            waiter.set_result(True)
+            return
+
+        slot.busy = False
+        del self._slots[session_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active_sessions": len(self._slots),
+            "pending_frames": sum(
+                1 for slot in self._slots.values()
+                if slot.pending is not None and not slot.pending.done()
+            ),
+            "superseded_frames": self.superseded_count,
+        }
@@ -0,0 +1,145 @@
+"""
+Response encodings for /detect, chosen by the request's Accept header.
+
+The default is the existing JSON schema (one object per detection), encoded
+with orjson when it is installed. Clients can instead ask for a compact
+columnar payload, where detections are parallel arrays and class names and
+waste types appear once in a class table:
+
+    "detections": {"class_id": [0, 2], "confidence": [0.91, 0.62],
+                   "bbox": [x1, y1, x2, y2, x1, y1, x2, y2]},
+    "classes": {"class_id": [0, 2], "class_name": ["plastic", "paper"],
+                "waste_type": ["plastic", "paper"]}
+
+All other fields are unchanged. The columnar payload is served as
+MessagePack (application/msgpack, needs the msgpack package; the annotated
+image is sent as raw JPEG bytes instead of a base64 data URL) or as JSON
+(application/vnd.recognise.columnar+json).
+
+Streamed responses send one message per result: JSON lines
+(application/x-ndjson) or back-to-back MessagePack objects.
+"""
+import base64
+import json
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi.responses import Response, StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK = "application/msgpack"
+COLUMNAR_JSON = "application/vnd.recognise.columnar+json"
+_MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """
+    Pick the response encoding from an Accept header.
+
+    Returns:
+        MSGPACK, COLUMNAR_JSON, or None for the default JSON schema. Types are
+        tried in the client's q-value order; MessagePack is skipped if msgpack
+        isn't installed.
+    """
+    if not accept:
+        return None
+    ranked = []
+    for position, item in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        ranked.append((-q, position, media_type.lower()))
+    for neg_q, _, media_type in sorted(ranked):
+        if neg_q == 0:
+            break
+        if media_type in _MSGPACK_TYPES and msgpack is not None:
+            return MSGPACK
+        if media_type == COLUMNAR_JSON:
+            return COLUMNAR_JSON
+        if media_type in ("application/json", "*/*", "application/*"):
+            return None
+    return None
+
+
+def to_columnar(response: Dict) -> Dict:
+    """Convert a /detect response dict to the columnar layout (other fields are shared, not copied)."""
+    detections = response.get("detections")
+    if detections is None:
+        return response
+    columnar = dict(response)
+    class_ids, confidences, boxes = [], [], []
+    table = {}
+    for det in detections:
+        class_ids.append(det["class_id"])
+        confidences.append(det["confidence"])
+        boxes.extend(det["bbox"])
+        if det["class_id"] not in table:
+            table[det["class_id"]] = (det["class_name"], det["waste_type"])
+    columnar["detections"] = {"class_id": class_ids, "confidence": confidences, "bbox": boxes}
+    columnar["classes"] = {
+        "class_id": list(table),
+        "class_name": [name for name, _ in table.values()],
+        "waste_type": [waste_type for _, waste_type in table.values()],
+    }
+    return columnar
+
+
+def dumps_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_body(content: Dict, encoding: Optional[str] = None) -> Tuple[bytes, str]:
+    """
+    Encode a response dict.
+
+    Args:
+        encoding: Result of negotiate(); None for the default JSON schema
+
+    Returns:
+        (body, media type)
+    """
+    if encoding == MSGPACK:
+        return msgpack.packb(to_columnar(content), use_bin_type=True), MSGPACK
+    if encoding == COLUMNAR_JSON:
+        return dumps_json(_text_image(to_columnar(content))), COLUMNAR_JSON
+    return dumps_json(_text_image(content)), "application/json"
+
+
+def encode_response(content: Dict, encoding: Optional[str] = None, status_code: int = 200) -> Response:
+    body, media_type = encode_body(content, encoding)
+    return Response(content=body, status_code=status_code, media_type=media_type, headers={"Vary": "Accept"})
+
+
+def encode_stream(contents: Iterable[Dict], encoding: Optional[str] = None) -> StreamingResponse:
+    """Stream response dicts as they are produced (a blocking iterable runs in a worker thread)."""
+    def messages():
+        for content in contents:
+            body, _ = encode_body(content, encoding)
+            yield body if encoding == MSGPACK else body + b"\n"
+
+    media_type = MSGPACK if encoding == MSGPACK else "application/x-ndjson"
+    return StreamingResponse(messages(), media_type=media_type, headers={"Vary": "Accept"})
+
+
+def _text_image(content: Dict) -> Dict:
+    """JSON can't carry bytes: turn a raw JPEG result_image back into a base64 data URL."""
+    image = content.get("result_image")
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        content = dict(content)
+        content["result_image"] = "data:image/jpeg;base64," + base64.b64encode(image).decode("ascii")
+    return content
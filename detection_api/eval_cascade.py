@@ -0,0 +1,168 @@
+"""
+Offline evaluation of cascade mode against the main model alone.
+
+Runs every image in a folder through (a) the main model and (b) the cascade,
+and reports mean wall/CPU time per frame, stage-1 hit rates and detection
+quality. With --labels (YOLO-format .txt files named like the images) quality
+is precision/recall against ground truth; without labels the main model's
+detections are used as the reference, so the numbers measure agreement.
+
+Usage:
+    python eval_cascade.py --images ../data/frames --labels ../data/labels \
+        --model ../model/my_model.pt --fast-model ../model/my_model_n.pt
+"""
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+import main as api
+from cascade import ModelCascade
+
+parser = argparse.ArgumentParser(description="Compare cascade mode with the main model alone")
+parser.add_argument('--images', required=True, help='Folder of evaluation images')
+parser.add_argument('--labels', default=None, help='Folder of YOLO-format label files (optional)')
+parser.add_argument('--model', default=api.MODEL_PATH, help='Main (stage-2) model')
+parser.add_argument('--fast-model', default=api.CASCADE_MODEL_PATH, required=api.CASCADE_MODEL_PATH is None,
+                    help='Stage-1 model, trained on the same classes as the main model')
+parser.add_argument('--thresh', type=float, default=api.CONFIDENCE_THRESHOLD)
+parser.add_argument('--band', type=float, default=api.CASCADE_BAND)
+parser.add_argument('--min-conf', type=float, default=api.CASCADE_MIN_CONF)
+parser.add_argument('--iou', type=float, default=0.5, help='IoU needed for a detection to match')
+
+IMG_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def to_detections(result, names, thresh):
+    """(waste_type, xyxy) for every box at or above the threshold."""
+    mapping = api.get_waste_class_mapping(names)
+    boxes = result.boxes
+    if not len(boxes):
+        return []
+    confs = boxes.conf.cpu().numpy()
+    classes = boxes.cls.cpu().numpy().astype(int)
+    xyxy = boxes.xyxy.cpu().numpy()
+    return [
+        (mapping.get(c, names[c].lower()), xyxy[i])
+        for i, c in enumerate(classes) if confs[i] >= thresh
+    ]
+
+
+def load_labels(path, width, height, names):
+    """Read a YOLO label file into (waste_type, xyxy) pairs."""
+    if not os.path.exists(path):
+        return []
+    mapping = api.get_waste_class_mapping(names)
+    labels = []
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            cls = int(parts[0])
+            cx, cy, w, h = [float(v) for v in parts[1:5]]
+            box = np.array([(cx - w / 2) * width, (cy - h / 2) * height,
+                            (cx + w / 2) * width, (cy + h / 2) * height])
+            labels.append((mapping.get(cls, names.get(cls, str(cls)).lower()), box))
+    return labels
+
+
+def iou(a, b):
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match(predictions, references, iou_thresh):
+    """Greedy same-class matching. Returns (true positives, #predictions, #references)."""
+    used = set()
+    tp = 0
+    for waste_type, box in predictions:
+        for j, (ref_type, ref_box) in enumerate(references):
+            if j not in used and ref_type == waste_type and iou(box, ref_box) >= iou_thresh:
+                used.add(j)
+                tp += 1
+                break
+    return tp, len(predictions), len(references)
+
+
+def summarize(name, times, cpu_times, tp, n_pred, n_ref):
+    precision = tp / n_pred if n_pred else 1.0
+    recall = tp / n_ref if n_ref else 1.0
+    print(f"{name:<12} wall {np.mean(times)*1000:8.2f} ms  cpu {np.mean(cpu_times)*1000:8.2f} ms  "
+          f"precision {precision:.3f}  recall {recall:.3f}")
+
+
+def main():
+    args = parser.parse_args()
+    images = sorted(p for p in glob.glob(os.path.join(args.images, '*')) if p.lower().endswith(IMG_EXTS))
+    if not images:
+        print(f"No images found in {args.images}")
+        return
+
+    heavy = YOLO(args.model)
+    cascade = ModelCascade(YOLO(args.fast_model), heavy,
+                           threshold=args.thresh, band=args.band, min_conf=args.min_conf)
+    if not cascade.compatible(heavy):
+        print(f"{args.fast_model} and {args.model} have different classes; "
+              f"stage-1 results would be mislabeled")
+        return
+
+    # Warm both models so one-off setup isn't counted
+    warm = cv2.imread(images[0])
+    heavy(warm, verbose=False)
+    cascade.fast_model(warm, verbose=False)
+
+    totals = {"main": [0, 0, 0], "cascade": [0, 0, 0]}
+    times = {"main": [], "cascade": []}
+    cpu_times = {"main": [], "cascade": []}
+
+    for path in images:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        height, width = img.shape[:2]
+        site = api.sites.get()
+        conflict_check = api.zone_conflict_check(site.layout(width, height)[0], site)
+
+        t0, c0 = time.perf_counter(), time.process_time()
+        heavy_result = heavy(img, verbose=False)[0]
+        times["main"].append(time.perf_counter() - t0)
+        cpu_times["main"].append(time.process_time() - c0)
+
+        t0, c0 = time.perf_counter(), time.process_time()
+        cascade_result, used_model, _ = cascade.predict(img, conflict_check=conflict_check)
+        times["cascade"].append(time.perf_counter() - t0)
+        cpu_times["cascade"].append(time.process_time() - c0)
+
+        heavy_dets = to_detections(heavy_result, heavy.names, args.thresh)
+        cascade_dets = to_detections(cascade_result, used_model.names, args.thresh)
+        if args.labels:
+            stem = os.path.splitext(os.path.basename(path))[0]
+            references = load_labels(os.path.join(args.labels, stem + '.txt'), width, height, heavy.names)
+        else:
+            references = heavy_dets
+
+        for name, dets in (("main", heavy_dets), ("cascade", cascade_dets)):
+            for i, value in enumerate(match(dets, references, args.iou)):
+                totals[name][i] += value
+
+    print(f"\n===== CASCADE EVALUATION ({len(times['main'])} images) =====")
+    print("Reference: " + ("ground-truth labels" if args.labels else "main model detections (agreement)"))
+    for name in ("main", "cascade"):
+        summarize(name, times[name], cpu_times[name], *totals[name])
+    stats = cascade.stats()
+    print(f"Stage-1 hit rate: {stats['stage1_hit_rate']*100:.1f}%  counts: {stats['counts']}")
+    saving = 1 - np.mean(cpu_times["cascade"]) / np.mean(cpu_times["main"])
+    print(f"Mean CPU per frame saved by cascade: {saving*100:.1f}%")
+    print("==========================================\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Background processing of recorded video files.
+
+A job samples frames from a video (every Nth frame, or one frame per time
+interval), runs them through the same detection pipeline as /detect, streams
+one JSON line per sampled frame to `<job_dir>/<job_id>.jsonl` and folds each
+disposal event into the analytics rollups. Lines are written in frame order:
+a chunk that finishes early is held back until the chunks before it are done.
+
+Long videos are split into chunks of frame ranges. Each chunk is processed by
+a separate worker process that seeks straight to its first frame, so one
+video is spread across all workers. Workers are spawned (not forked from the
+running server) and load their own copy of the model once.
+
+Job state is also written to `<job_dir>/<job_id>.json`, so any API worker
+process can answer progress polls for jobs started by another.
+"""
+import json
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import cv2
+
+from scheduler import wait_for_live_work
+
+# Set in each worker process by _init_worker
+_api = None
+_live_requests = None
+_max_pause = 0.0
+
+
+def _init_worker(threads: int, live_requests, max_pause: float):
+    """Load the detection pipeline once per worker process."""
+    global _api, _live_requests, _max_pause
+    _live_requests = live_requests
+    _max_pause = max_pause
+    import torch
+    torch.set_num_threads(threads)
+    import main as api
+    api.load_model()
+    _api = api
+
+
+def video_info(path: str) -> Dict:
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video: {path}")
+    info = {
+        "frames": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        "fps": cap.get(cv2.CAP_PROP_FPS) or 30.0,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    }
+    cap.release()
+    return info
+
+
+def process_chunk(path: str, start: int, end: int, fps: float, stride: int,
+                  sample_interval: Optional[float], detection_zone: Optional[str],
+                  site_id: Optional[str] = None) -> Dict:
+    """
+    Detect sampled frames in [start, end) of a video. Runs in a worker process.
+
+    Frames are sampled every `stride` frames, or, when `sample_interval` (seconds)
+    is set, at the first frame at or after each multiple of the interval.
+    Skipped frames are only grabbed, never converted. Before each sampled
+    frame the worker yields to live requests in the API process.
+
+    Returns:
+        {"records": [...], "frames_read": int, "seconds": float, "paused_seconds": float}
+    """
+    t0 = time.perf_counter()
+    cap = cv2.VideoCapture(path)
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    site = _api.sites.get(site_id)
+    records = []
+    frames_read = 0
+    paused = 0.0
+    next_sample = None
+    for index in range(start, end):
+        if not cap.grab():
+            break
+        frames_read += 1
+        video_time = index / fps
+        if sample_interval:
+            if next_sample is None:
+                # Align to the global sampling grid so chunk boundaries don't shift samples
+                next_sample = math.ceil(video_time / sample_interval - 1e-9) * sample_interval
+            if video_time + 1e-9 < next_sample:
+                continue
+            next_sample = (math.floor(video_time / sample_interval + 1e-9) + 1) * sample_interval
+        elif index % stride:
+            continue
+
+        ok, frame = cap.retrieve()
+        if not ok:
+            break
+        paused += wait_for_live_work(_live_requests, _max_pause)
+        result = _api.detect_frame(frame, detection_zone, render=False, priority="bulk", client=path, site=site)
+        records.append({
+            "frame": index,
+            "video_time": round(video_time, 3),
+            "detections": result["detections"],
+            "waste_type": result["waste_detection"]["waste_type"],
+            "is_correct": result["waste_detection"]["is_correct"],
+            "zone": result["waste_detection"].get("zone"),
+            "inference_fps": result["performance"]["inference_fps"],
+        })
+    cap.release()
+    return {"records": records, "frames_read": frames_read, "seconds": time.perf_counter() - t0,
+            "paused_seconds": paused}
+
+
+class VideoJob:
+    def __init__(self, job_id: str, source: str, params: Dict, info: Dict, chunks: List[tuple], results_path: str,
+                 delete_source: bool = False):
+        self.id = job_id
+        self.source = source
+        self.delete_source = delete_source  # Uploaded copy, removed when the job finishes
+        self.params = params
+        self.info = info
+        self.chunks = chunks
+        self.results_path = results_path
+        self.status = "queued"
+        self.error = None
+        self.created = datetime.now().isoformat()
+        self.started = None
+        self.finished = None
+        self.chunks_done = 0
+        self.frames_read = 0
+        self.frames_sampled = 0
+        self.events = 0
+        self.busy_seconds = 0.0
+        self.paused_seconds = 0.0
+        self._ready = {}  # Finished chunks' records by chunk index, until the chunks before them are written
+        self._next_chunk = 0
+        self._t0 = None
+        self._elapsed = 0.0
+
+    def to_dict(self) -> Dict:
+        elapsed = (time.time() - self._t0) if (self._t0 and not self.finished) else self._elapsed
+        return {
+            "job_id": self.id,
+            "source": self.source,
+            "status": self.status,
+            "error": self.error,
+            "params": self.params,
+            "video": self.info,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": {
+                "chunks_done": self.chunks_done,
+                "chunks_total": len(self.chunks),
+                "frames_read": self.frames_read,
+                "frames_total": self.info["frames"],
+                "frames_sampled": self.frames_sampled,
+                "events": self.events,
+                "percent": 100.0 * self.chunks_done / len(self.chunks) if self.chunks else 100.0,
+            },
+            "throughput": {
+                "elapsed_seconds": elapsed,
+                # Video frames decoded (or skipped over) and frames run through the model, per wall second
+                "frames_per_second": self.frames_read / elapsed if elapsed else 0.0,
+                "sampled_frames_per_second": self.frames_sampled / elapsed if elapsed else 0.0,
+                # Summed time workers spent on this job's chunks
+                "worker_seconds": self.busy_seconds,
+                # Part of that spent waiting for live requests to finish
+                "paused_seconds": self.paused_seconds,
+            },
+            "results_path": self.results_path,
+        }
+
+
+class JobManager:
+    def __init__(self, job_dir: str, workers: int = 2, threads: int = 0, rollups=None,
+                 live_requests=None, max_pause: float = 2.0):
+        """
+        Args:
+            job_dir: Folder for uploaded videos, job state and JSONL results
+            workers: Worker processes (each loads its own model)
+            threads: torch threads per worker (default: cores / workers)
+            rollups: Optional RollupStore that disposal events are recorded in
+            live_requests: Shared counter of live requests (InferenceScheduler.live_requests);
+                workers pause between frames while it is non-zero
+            max_pause: Longest a worker pauses before processing a frame anyway
+        """
+        self.job_dir = job_dir
+        self.workers = max(1, workers)
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.rollups = rollups
+        self.live_requests = live_requests
+        self.max_pause = max_pause
+        self._jobs: Dict[str, VideoJob] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._executor = None
+        os.makedirs(job_dir, exist_ok=True)
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Started on first use so API workers that never see a job don't spawn processes
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.threads, self.live_requests, self.max_pause)
+            )
+        return self._executor
+
+    def submit(self, source: str, stride: int = 1, sample_fps: Optional[float] = None,
+               detection_zone: Optional[str] = None, chunk_seconds: float = 60.0,
+               recorded_at: Optional[str] = None, site_id: Optional[str] = None,
+               delete_source: bool = False) -> VideoJob:
+        """
+        Start processing a video file.
+
+        Args:
+            source: Path of a video file readable by the server
+            stride: Process every Nth frame (ignored when sample_fps is set)
+            sample_fps: Process this many frames per second of video instead of a fixed stride
+            detection_zone: Optional JSON string with detection zone coordinates [x1,y1,x2,y2]
+            chunk_seconds: Length of the frame ranges the video is split into across workers
+            recorded_at: ISO time the recording started; events are timestamped at
+                recorded_at + video time (default: when they are processed)
+            site_id: Site whose bins, threshold and model apply (default site if None)
+            delete_source: Remove the video file once the job has finished (for uploads)
+        """
+        if stride < 1:
+            raise ValueError("stride must be at least 1")
+        if sample_fps is not None and sample_fps <= 0:
+            raise ValueError("sample_fps must be positive")
+        if recorded_at:
+            datetime.fromisoformat(recorded_at)
+        info = video_info(source)
+        if info["frames"] <= 0:
+            raise ValueError(f"Video has no frames: {source}")
+
+        chunk_frames = max(1, int(chunk_seconds * info["fps"]))
+        chunks = [(s, min(s + chunk_frames, info["frames"])) for s in range(0, info["frames"], chunk_frames)]
+        job_id = uuid.uuid4().hex[:12]
+        params = {
+            "stride": stride, "sample_fps": sample_fps, "detection_zone": detection_zone,
+            "chunk_seconds": chunk_seconds, "recorded_at": recorded_at, "site_id": site_id,
+        }
+        job = VideoJob(job_id, source, params, info, chunks, os.path.join(self.job_dir, f"{job_id}.jsonl"),
+                       delete_source=delete_source)
+        with self._lock:
+            self._jobs[job_id] = job
+        self._save(job)
+
+        with self._lock:
+            job.status = "running"
+            job.started = datetime.now().isoformat()
+            job._t0 = time.time()
+        sample_interval = 1.0 / sample_fps if sample_fps else None
+        pool = self._pool()
+        for index, (start, end) in enumerate(chunks):
+            future = pool.submit(process_chunk, source, start, end, info["fps"],
+                                 stride, sample_interval, detection_zone, site_id)
+            future.add_done_callback(lambda f, job=job, index=index: self._chunk_done(job, index, f))
+        return job
+
+    def _chunk_done(self, job: VideoJob, index: int, future):
+        """Record a finished chunk and write out every chunk that is now next in frame order."""
+        try:
+            chunk = future.result()
+        except Exception as e:
+            print(f"Job {job.id}: chunk failed: {e}")
+            with self._lock:
+                job.status = "failed"
+                job.error = str(e)
+                job.chunks_done += 1
+                # Nothing to write for it, but the chunks after it must not wait forever
+                job._ready[index] = []
+                self._write_ready(job)
+                self._finish_if_done(job)
+            self._save(job)
+            return
+
+        with self._lock:
+            job._ready[index] = chunk["records"]
+            self._write_ready(job)
+            job.chunks_done += 1
+            job.frames_read += chunk["frames_read"]
+            job.frames_sampled += len(chunk["records"])
+            job.busy_seconds += chunk["seconds"]
+            job.paused_seconds += chunk["paused_seconds"]
+            self._finish_if_done(job)
+        self._save(job)
+
+    def _write_ready(self, job: VideoJob):
+        """Append the records of the finished chunks that follow the last written one to the JSONL and rollups."""
+        if job._next_chunk not in job._ready:
+            return
+        base = datetime.fromisoformat(job.params["recorded_at"]) if job.params["recorded_at"] else None
+        with open(job.results_path, "a") as f:
+            while job._next_chunk in job._ready:
+                for record in job._ready.pop(job._next_chunk):
+                    event_time = base + timedelta(seconds=record["video_time"]) if base else datetime.now()
+                    record["timestamp"] = event_time.isoformat()
+                    f.write(json.dumps(record) + "\n")
+                    if self.rollups is not None and record["waste_type"]:
+                        try:
+                            self.rollups.record(record["timestamp"], record["waste_type"], record["is_correct"],
+                                                record["zone"], record["inference_fps"])
+                            job.events += 1
+                        except Exception as e:
+                            print(f"Job {job.id}: error updating rollups: {e}")
+                job._next_chunk += 1
+
+    def _finish_if_done(self, job: VideoJob):
+        if job.chunks_done < len(job.chunks):
+            return
+        job._elapsed = time.time() - job._t0
+        job.finished = datetime.now().isoformat()
+        if job.status == "running":
+            job.status = "completed"
+        print(f"Job {job.id} {job.status}: {job.frames_sampled} frames sampled from {job.frames_read} "
+              f"in {job._elapsed:.1f}s ({job.frames_read / job._elapsed if job._elapsed else 0:.1f} frames/s)")
+        if job.delete_source:
+            try:
+                os.remove(job.source)
+            except OSError as e:
+                print(f"Job {job.id}: could not remove uploaded video: {e}")
+
+    def _save(self, job: VideoJob):
+        # One save at a time, so an older state never replaces a newer one; the
+        # state is read under _lock so it is never caught mid-update
+        with self._save_lock:
+            with self._lock:
+                state = job.to_dict()
+            fd, tmp_path = tempfile.mkstemp(dir=self.job_dir, prefix=f"{job.id}.", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, os.path.join(self.job_dir, f"{job.id}.json"))
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Job state, from memory or, for jobs owned by another API process, from its state file."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.to_dict()
+        state_path = os.path.join(self.job_dir, f"{os.path.basename(job_id)}.json")
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                return json.load(f)
+        return None
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,6 +1,7 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse, Response
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 import numpy as np
 import cv2
@@ -12,10 +13,35 @@ from PIL import Image
 import time
 import json
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 import sys
 import subprocess
 import tempfile
+import threading
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from coalescing import LatestFrameCoalescer
+from jobs import JobManager
+from rollups import RollupStore
+from scheduler import InferenceScheduler, PRIORITIES, parse_weights
+from registry import ModelRegistry
+from sites import SiteRegistry
+from traffic import TrafficCapture, default_capture_path
+from encoding import MSGPACK, encode_response, encode_stream, negotiate, to_columnar
+
+# Components shared with the detection scripts live in ../model
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model"))
+from telemetry import PerfMeter
+from overlay import OverlayRenderer
+from adaptive import AdaptiveController, parse_sizes
+from cascade import ModelCascade
+from tiling import TiledDetector
+from torch_cpu import FastTorchPredictor
+from memory import MemoryMonitor, gauges as memory_gauges
+from quantize import check_gate
+from shm_transport import SharedFrameRing, WriterGoneError
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
@@ -44,28 +70,157 @@ CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.5"))
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 USE_WASTE_YOLO_DETECT = False  # Set to False to use our direct model implementation
+# Adaptive inference: step the input size (and optionally the model) to stay within a latency budget
+LATENCY_BUDGET_MS = float(os.getenv("LATENCY_BUDGET_MS", "0"))  # 0 disables adaptation
+ADAPTIVE_IMGSZ = parse_sizes(os.getenv("ADAPTIVE_IMGSZ", "640,480,320"))
+FALLBACK_MODEL_PATH = os.getenv("FALLBACK_MODEL_PATH")  # Smaller variant used once the main model can't keep up
+# Cascade mode: a small model runs on every frame and the main model only when the
+# small one is unsure (confidence within CASCADE_BAND of the threshold) or disagrees with the zone
+CASCADE_MODE = os.getenv("CASCADE_MODE", "off").lower()  # "off" or "cascade"
+CASCADE_MODEL_PATH = os.getenv("CASCADE_MODEL_PATH")  # Required for cascade mode; must have the main model's classes
+CASCADE_BAND = float(os.getenv("CASCADE_BAND", "0.15"))
+CASCADE_MIN_CONF = float(os.getenv("CASCADE_MIN_CONF", "0.25"))
+# Tiling: large frames are cut into overlapping model-sized tiles run as one batch; tiles outside the zones are skipped
+TILE_MODE = os.getenv("TILE_MODE", "off").lower()  # "off" or "on"
+TILE_SIZE = int(os.getenv("TILE_SIZE", "640"))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+TILE_MIN_SIZE = int(os.getenv("TILE_MIN_SIZE", "1600"))  # Frames whose longer side is smaller are run whole
+TILE_FULL_FRAME = os.getenv("TILE_FULL_FRAME", "1") == "1"  # Also run the whole frame, for items larger than a tile
+ROLLUP_DB_PATH = os.getenv("ROLLUP_DB_PATH", "rollups.db")  # Local SQLite store for /analytics/history
+METRICS_LOG = os.getenv("METRICS_LOG")  # Optional JSONL file for periodic performance snapshots
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "60"))
+SHM_FRAME_SOURCE = os.getenv("SHM_FRAME_SOURCE")  # Shared-memory ring written by `yolo_detect.py --shm_publish`
+SHM_DETECTION_ZONE = os.getenv("SHM_DETECTION_ZONE")  # Optional [x1,y1,x2,y2] JSON for shared-memory frames
+JOB_DIR = os.getenv("JOB_DIR", "jobs")  # Uploaded videos, job state and JSONL results for /jobs
+VIDEO_DIR = os.getenv("VIDEO_DIR")  # Folder /jobs video_path may read from (unset: uploads only)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # Worker processes for video jobs
+JOB_THREADS = int(os.getenv("JOB_THREADS", "0"))  # torch threads per job worker (0: cores / workers)
+JOB_MAX_PAUSE = float(os.getenv("JOB_MAX_PAUSE", "2.0"))  # Longest a job worker waits between frames for live requests
+SCHEDULER_WEIGHTS = parse_weights(os.getenv("SCHEDULER_WEIGHTS"))  # e.g. "cam1=2,cam2=1"; fair-share weight per client
+MODEL_REGISTRY = os.getenv("MODEL_REGISTRY")  # Optional JSON file of named/versioned models (see registry.py)
+MODEL_CACHE_MB = float(os.getenv("MODEL_CACHE_MB", "1024"))  # Memory budget for loaded registry models (0: unbounded)
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.dirname(MODEL_PATH) or ".")  # New versions can only be registered from here
+TORCH_FAST_PATH = os.getenv("TORCH_FAST_PATH", "off").lower()  # "off", "on" or "compile" (see model/torch_cpu.py)
+QUANTIZED_MODEL_PATH = os.getenv("QUANTIZED_MODEL_PATH")  # INT8 artifact of MODEL_PATH from model/quantize.py
+MEMORY_TRACKING = os.getenv("MEMORY_TRACKING", "0") == "1"  # tracemalloc per-request peaks and snapshot diffs
+MEMORY_SNAPSHOT_INTERVAL = float(os.getenv("MEMORY_SNAPSHOT_INTERVAL", "300"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # When set, /admin endpoints require a matching X-Admin-Token header
+CAPTURE_DIR = os.getenv("CAPTURE_DIR")  # Record sampled /detect requests here for replay.py (off when unset)
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "0.1"))  # Fraction of requests/sessions captured
+CAPTURE_MAX_MB = float(os.getenv("CAPTURE_MAX_MB", "1024"))  # Capture stops once an archive reaches this size
+DETECT_BATCH_MAX = int(os.getenv("DETECT_BATCH_MAX", "32"))  # Most images accepted by one /detect/batch request
+BATCH_DECODE_THREADS = int(os.getenv("BATCH_DECODE_THREADS", str(min(8, os.cpu_count() or 1))))
+SITES_CONFIG = os.getenv("SITES_CONFIG")  # Optional JSON file of per-site bins, thresholds and models (see sites.py)
+SITES_RELOAD_INTERVAL = float(os.getenv("SITES_RELOAD_INTERVAL", "5"))  # Seconds between checks for a changed SITES_CONFIG
 
 # Define default preset zones (left and right sides of the frame)
-# These will be used if no detection zone is provided
-DEFAULT_ZONES = {
-    "left": {
-        "coordinates": [(0, 0), (426, 720)],  # Left third of 1280x720 frame
-        "correct_types": ["paper", "cardboard"]
-    },
-    "right": {
-        "coordinates": [(854, 0), (1280, 720)],  # Right third of 1280x720 frame
-        "correct_types": ["plastic", "metal", "glass"]
+# These are the "default" site, used if a request names no site and no detection zone is provided
+DEFAULT_SITE = {
+    "resolution": [1280, 720],
+    "bins": {
+        "left": {
+            "box": [0, 0, 426, 720],  # Left third of 1280x720 frame
+            "accepts": ["paper", "cardboard"],
+            "label": "Paper/Cardboard",
+            "color": [0, 0, 255]
+        },
+        "right": {
+            "box": [854, 0, 1280, 720],  # Right third of 1280x720 frame
+            "accepts": ["plastic", "metal", "glass"],
+            "label": "Plastic/Metal/Glass",
+            "color": [255, 0, 0]
+        }
     }
 }
 
 # Initialize the YOLO model (lazy loading on first request)
 model = None
+fallback_model = None
+cascade = None  # ModelCascade when CASCADE_MODE == "cascade"
+main_model_path = None  # Path the startup model was loaded from (registered as "main")
 supabase = None
+rollups = None  # RollupStore, created at startup
+job_manager = None  # JobManager for /jobs, created at startup
+traffic_capture = None  # TrafficCapture when CAPTURE_DIR is set
 
-@app.on_event("startup")
-async def startup_event():
-    global model, supabase
-    print("\n=== Starting up the Waste Detection API ===")
+# The model is not thread-safe; detection runs in worker threads, which take turns
+# by priority class (interactive > realtime > bulk) and weighted fair share per client
+scheduler = InferenceScheduler(SCHEDULER_WEIGHTS)
+
+tiler = TiledDetector(TILE_SIZE, TILE_OVERLAP, min_size=TILE_MIN_SIZE, full_frame=TILE_FULL_FRAME) \
+    if TILE_MODE == "on" else None
+
+# One running + one pending frame per camera session (see /detect session_id)
+frame_coalescer = LatestFrameCoalescer()
+
+def optimize_model(m):
+    """Wrap a .pt model in the tuned torch CPU path when TORCH_FAST_PATH is enabled."""
+    if TORCH_FAST_PATH not in ("on", "compile") or isinstance(m, FastTorchPredictor) \
+            or not FastTorchPredictor.supported(m):
+        return m
+    try:
+        return FastTorchPredictor(m, compile=TORCH_FAST_PATH == "compile")
+    except Exception as e:
+        print(f"Tuned torch CPU path unavailable, using the standard predictor: {e}")
+        return m
+
+def warm_model(m):
+    """First inference on a freshly loaded model, so the first real request isn't slow."""
+    m(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+
+# Named/versioned models selectable per request; the startup model is registered as "main"
+registry = ModelRegistry(loader=lambda path: optimize_model(YOLO(path)), warmup=warm_model, max_bytes=int(MODEL_CACHE_MB * 1e6))
+
+# Bin layouts, thresholds and models per site, selected per request by site_id; reloaded when SITES_CONFIG changes
+sites = SiteRegistry(DEFAULT_SITE, SITES_CONFIG, check_interval=SITES_RELOAD_INTERVAL,
+                     default_threshold=CONFIDENCE_THRESHOLD,
+                     base_mapping=lambda names: get_waste_class_mapping(names), validate_model=registry.resolve)
+
+# RSS/torch gauges, plus allocation tracking when MEMORY_TRACKING=1 (see /admin/memory)
+memory_monitor = MemoryMonitor(enabled=MEMORY_TRACKING, snapshot_interval=MEMORY_SNAPSHOT_INTERVAL)
+
+# Decodes /detect/batch images in parallel (cv2.imdecode releases the GIL)
+batch_decoder = ThreadPoolExecutor(max_workers=BATCH_DECODE_THREADS, thread_name_prefix="batch-decode")
+
+# Rolling per-stage timings for /detect, served by /metrics
+perf = PerfMeter(window=200)
+
+adaptive = AdaptiveController(
+    LATENCY_BUDGET_MS,
+    sizes=ADAPTIVE_IMGSZ,
+    models=("main", "fallback") if FALLBACK_MODEL_PATH else ("main",)
+)
+
+# Caches label layouts across requests
+overlay_renderer = OverlayRenderer(style="text", font_scale=0.5, thickness=2)
+
+# Shared-memory ingestion (SHM_FRAME_SOURCE): latest result and counters for /shm/latest
+shm_stop = threading.Event()
+shm_thread = None
+shm_latest = None
+shm_stats = {"frames_detected": 0, "frames_skipped": 0, "frames_torn": 0, "attached": False}
+
+def serving_model_path() -> str:
+    """MODEL_PATH, or its INT8 artifact (QUANTIZED_MODEL_PATH) if that passed the accuracy gate."""
+    if not QUANTIZED_MODEL_PATH:
+        return MODEL_PATH
+    ok, reason = check_gate(QUANTIZED_MODEL_PATH, MODEL_PATH)
+    if ok:
+        print(f"Using INT8 model {QUANTIZED_MODEL_PATH}: {reason}")
+        return QUANTIZED_MODEL_PATH
+    print(f"Not using INT8 model {QUANTIZED_MODEL_PATH} ({reason}); using {MODEL_PATH}")
+    return MODEL_PATH
+
+def load_model(optimize=True):
+    """
+    Load the YOLO model (and the optional fallback variant) into the module-level globals.
+
+    With optimize=False the TORCH_FAST_PATH wrapping is left to optimize_loaded_models(), so
+    a parent process that forks workers (serve.py) runs no parallel torch ops before the fork.
+    """
+    global model, fallback_model, cascade, main_model_path
+    prepare = optimize_model if optimize else (lambda m: m)
+    model_path = MODEL_PATH
     
     # Create model directory if it doesn't exist
     os.makedirs("model", exist_ok=True)
@@ -99,14 +254,140 @@ async def startup_event():
                 print("No model found. Downloading default YOLOv8n...")
                 model = YOLO("yolov8n")  # This will download the model if not present
         else:
-            model = YOLO(MODEL_PATH)
+            model_path = serving_model_path()
+            model = YOLO(model_path)
             
-        print(f"Model loaded successfully")
+        model = prepare(model)
+        print(f"Model loaded successfully{' (tuned torch CPU path)' if isinstance(model, FastTorchPredictor) else ''}")
         print(f"Model classes: {list(model.names.values())}")
     except Exception as e:
         print(f"Error loading model: {e}")
         model = None
     
+    if FALLBACK_MODEL_PATH:
+        try:
+            fallback_model = prepare(YOLO(FALLBACK_MODEL_PATH))
+            print(f"Fallback model loaded: {FALLBACK_MODEL_PATH}")
+        except Exception as e:
+            print(f"Error loading fallback model: {e}")
+            fallback_model = None
+    
+    if CASCADE_MODE == "cascade" and model is not None:
+        if not CASCADE_MODEL_PATH:
+            print("CASCADE_MODE=cascade needs CASCADE_MODEL_PATH (a small model with the main model's classes); "
+                  "cascade disabled")
+        else:
+            try:
+                cascade = ModelCascade(
+                    prepare(YOLO(CASCADE_MODEL_PATH)), model,
+                    threshold=CONFIDENCE_THRESHOLD, band=CASCADE_BAND, min_conf=CASCADE_MIN_CONF
+                )
+                # Stage-1 results are served as-is, so its class ids must mean the same as the main model's
+                if not cascade.compatible(model):
+                    print(f"Cascade model {CASCADE_MODEL_PATH} has different classes than the main model "
+                          f"({list(cascade.fast_model.names.values())}); cascade disabled")
+                    cascade = None
+                else:
+                    print(f"Cascade mode enabled with stage-1 model: {CASCADE_MODEL_PATH}")
+                    if tiler is not None:
+                        print("TILE_MODE is ignored while the cascade is enabled")
+            except Exception as e:
+                print(f"Error loading cascade model, cascade disabled: {e}")
+                cascade = None
+    
+    # Registered first so "main" stays the default model unless MODEL_REGISTRY sets "default"
+    main_model_path = model_path
+    if model is not None:
+        registry.register("main", "startup", model_path, model=model)
+    if MODEL_REGISTRY:
+        try:
+            registry.load_file(MODEL_REGISTRY)
+            print(f"Model registry loaded: {MODEL_REGISTRY}")
+        except Exception as e:
+            print(f"Error loading model registry: {e}")
+    
+    # After the registry, so site models can be checked against it
+    if SITES_CONFIG:
+        try:
+            sites.load()
+        except ValueError as e:
+            print(f"Error loading site config, using the default site only: {e}")
+    return model
+
+def optimize_loaded_models():
+    """Apply TORCH_FAST_PATH to models preloaded with load_model(optimize=False), e.g. after a fork."""
+    global model, fallback_model
+    if model is None:
+        return
+    model = optimize_model(model)
+    registry.register("main", "startup", main_model_path, model=model)
+    if fallback_model is not None:
+        fallback_model = optimize_model(fallback_model)
+    if cascade is not None:
+        cascade.fast_model = optimize_model(cascade.fast_model)
+        cascade.heavy_model = model
+    if isinstance(model, FastTorchPredictor):
+        print(f"Preloaded models moved to the tuned torch CPU path (pid {os.getpid()})")
+
+def get_waste_class_mapping(names: Dict[int, str]) -> Dict[int, str]:
+    """Map a model's class ids to our waste types."""
+    mapping = {
+        0: "glass",
+        1: "metal", 
+        2: "paper",
+        3: "plastic"
+    }
+    
+    # Default fallback classes if model uses different classes
+    if not any(cls_id in names for cls_id in mapping):
+        mapping = {}
+        for idx, class_name in names.items():
+            if 'paper' in class_name.lower() or 'cardboard' in class_name.lower():
+                mapping[idx] = 'paper'
+            elif 'glass' in class_name.lower():
+                mapping[idx] = 'glass'
+            elif 'metal' in class_name.lower() or 'can' in class_name.lower():
+                mapping[idx] = 'metal'
+            elif 'plastic' in class_name.lower() or 'bottle' in class_name.lower():
+                mapping[idx] = 'plastic'
+            else:
+                mapping[idx] = class_name.lower()
+    return mapping
+
+def zone_conflict_check(zones: Dict, site):
+    """
+    Build a cascade conflict check for a site's zones: True when the most
+    confident detection overlaps a zone its waste type doesn't belong in.
+    """
+    def check(result, names) -> bool:
+        confs = result.boxes.conf.cpu().numpy()
+        top = int(confs.argmax())
+        cls_id = int(result.boxes.cls[top].item())
+        waste_type = site.class_mapping(names).get(cls_id, names[cls_id].lower())
+        xmin, ymin, xmax, ymax = result.boxes.xyxy[top].cpu().numpy().astype(int).tolist()
+        for zone in zones.values():
+            (zx1, zy1), (zx2, zy2) = zone["coordinates"]
+            if xmin < zx2 and xmax > zx1 and ymin < zy2 and ymax > zy1:
+                if waste_type not in zone["correct_types"]:
+                    return True
+        return False
+    return check
+
+@app.on_event("startup")
+async def startup_event():
+    global model, supabase, rollups, shm_thread, job_manager, traffic_capture
+    print("\n=== Starting up the Waste Detection API ===")
+    memory_monitor.start()
+    
+    # The multi-worker launcher (serve.py) loads the model once in the parent
+    # process and forks workers that share its weights copy-on-write; the
+    # TORCH_FAST_PATH wrapping runs here, after the fork
+    if model is None:
+        load_model()
+    else:
+        print(f"Using preloaded model (pid {os.getpid()})")
+        optimize_loaded_models()
+    
     # Initialize Supabase client if credentials are available
     if SUPABASE_URL and SUPABASE_KEY:
         try:
@@ -115,8 +396,50 @@ async def startup_event():
         except Exception as e:
             print(f"Error initializing Supabase client: {e}")
             supabase = None
+    
+    # Minute/hour/day rollups, maintained as events arrive (see rollups.py)
+    try:
+        rollups = RollupStore(ROLLUP_DB_PATH, remote=supabase)
+        print(f"Rollup store: {ROLLUP_DB_PATH}")
+    except Exception as e:
+        print(f"Error opening rollup store: {e}")
+        rollups = None
+    
+    # Video-file jobs run in their own worker processes, started on the first job
+    job_manager = JobManager(JOB_DIR, workers=JOB_WORKERS, threads=JOB_THREADS, rollups=rollups,
+                             live_requests=scheduler.live_requests, max_pause=JOB_MAX_PAUSE)
+    
+    # Detect frames published by a capture process on the same machine, without HTTP or JPEG
+    if SHM_FRAME_SOURCE:
+        shm_thread = threading.Thread(target=shm_ingest_loop, name="shm-ingest", daemon=True)
+        shm_thread.start()
+        print(f"Reading frames from shared memory: {SHM_FRAME_SOURCE}")
+    
+    # Sampled /detect inputs for replay.py; one archive per worker process
+    if CAPTURE_DIR:
+        try:
+            traffic_capture = TrafficCapture(default_capture_path(CAPTURE_DIR), sample_rate=CAPTURE_SAMPLE_RATE,
+                                             max_bytes=int(CAPTURE_MAX_MB * 1e6))
+            print(f"Capturing {CAPTURE_SAMPLE_RATE:.0%} of /detect traffic to {traffic_capture.path}")
+        except OSError as e:
+            print(f"Error starting traffic capture: {e}")
+            traffic_capture = None
     print("=== Startup complete ===\n")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    shm_stop.set()
+    if shm_thread is not None:
+        shm_thread.join(timeout=5)
+    if job_manager is not None:
+        job_manager.shutdown()
+    if rollups is not None:
+        rollups.close()
+    if traffic_capture is not None:
+        traffic_capture.close()
+    batch_decoder.shutdown(wait=False)
+    memory_monitor.stop()
+
 @app.get("/")
 async def root():
     return {"message": "Waste Detection API. Use /detect endpoint to detect waste in images."}
@@ -142,10 +465,22 @@ async def test():
     except Exception as e:
         return {"error": str(e)}
 
+def request_site(site_id: Optional[str]):
+    """The site a request names (the default site if none), or a 400 for an unknown one."""
+    try:
+        return sites.get(site_id)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/detect")
 async def detect_waste(
+    request: Request,
     file: UploadFile = File(...),
-    detection_zone: Optional[str] = Form(None)
+    detection_zone: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+    priority: Optional[str] = Form(None),
+    model_ref: Optional[str] = Form(None, alias="model"),
+    site_id: Optional[str] = Form(None)
 ):
     """
     Detect waste in the uploaded image.
@@ -153,237 +488,251 @@ async def detect_waste(
     Args:
         file: The image file to analyze
         detection_zone: Optional JSON string with detection zone coordinates [x1,y1,x2,y2]
+        session_id: Optional camera/session identifier. Frames sharing a session
+            are coalesced so that only the newest queued frame is processed; an
+            older queued frame is answered with status "superseded".
+        priority: Scheduling class: "interactive" (default without a session),
+            "realtime" (default with a session) or "bulk"
+        model: Registry model to use, as "name" or "name:version" (the site's model, or the
+            default model, if omitted)
+        site_id: Site whose bins, confidence threshold and model apply (default site if omitted)
     
     Returns:
-        JSON with detection results
+        Detection results: the JSON schema below by default, or the columnar layout as
+        MessagePack or JSON when the Accept header asks for it (see encoding.py)
     """
-    global model, supabase
+    priority = priority or ("realtime" if session_id else "interactive")
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    site = request_site(site_id)
+    requested_model = model_ref
+    model_ref = model_ref or site.model
+    if model_ref:
+        try:
+            registry.resolve(model_ref)
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    # Fair share is per camera session, or per client address without one
+    client = session_id or (request.client.host if request.client else None)
+    encoding = negotiate(request.headers.get("accept"))
+    # MessagePack carries the annotated image as raw JPEG bytes, without base64
+    image_bytes = encoding == MSGPACK
+    arrival = time.time()
+    contents = await file.read()
+    if traffic_capture is not None:
+        traffic_capture.offer(arrival, contents, detection_zone, session_id, priority, requested_model, site_id)
+    
+    if not session_id:
+        response = await run_in_threadpool(run_detection, contents, detection_zone, priority, client, model_ref,
+                                           image_bytes, site)
+        return encode_response(response, encoding)
+    
+    # Latest-frame-wins: wait for this session's previous frame to finish
+    if not await frame_coalescer.acquire(session_id):
+        print(f"Frame for session {session_id} superseded by a newer frame")
+        return encode_response({
+            "status": "superseded",
+            "session_id": session_id,
+            "timestamp": datetime.now().isoformat()
+        }, encoding)
     
     try:
+        response = await run_in_threadpool(run_detection, contents, detection_zone, priority, client, model_ref,
+                                           image_bytes, site)
+    finally:
+        frame_coalescer.release(session_id)
+    
+    response["session_id"] = session_id
+    return encode_response(response, encoding)
+
+def run_detection(
+    contents: bytes,
+    detection_zone: Optional[str],
+    priority: str = "interactive",
+    client: Optional[str] = None,
+    model_ref: Optional[str] = None,
+    image_bytes: bool = False,
+    site=None
+) -> Dict:
+    """
+    Run detection on an encoded image. Blocking; called from a worker thread.
+    
+    Args:
+        contents: Encoded image bytes
+        detection_zone: Optional JSON string with detection zone coordinates [x1,y1,x2,y2]
+        image_bytes: Return the annotated image as JPEG bytes instead of a base64 data URL
+    
+    Returns:
+        Response dictionary for /detect
+    """
+    with memory_monitor.track():
         # Measure start time for inference speed benchmarking
         start_time = time.time()
-        print(f"\n=== Starting detection request at {datetime.now().isoformat()} ===")
         
         # Read and process the image
-        contents = await file.read()
         nparr = np.frombuffer(contents, np.uint8)
         img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
         if img is None:
             raise HTTPException(status_code=400, detail="Invalid image file")
+        perf.record("decode", time.time() - start_time)
         
-        # Get image dimensions for zone calculations
-        img_height, img_width = img.shape[:2]
-        
-        # Scale default zones if necessary
-        scaled_zones = DEFAULT_ZONES
-        if img_width != 1280 or img_height != 720:
-            scale_x = img_width / 1280
-            scale_y = img_height / 720
-            scaled_zones = {
-                "left": {
-                    "coordinates": [
-                        (int(DEFAULT_ZONES["left"]["coordinates"][0][0] * scale_x),
-                         int(DEFAULT_ZONES["left"]["coordinates"][0][1] * scale_y)),
-                        (int(DEFAULT_ZONES["left"]["coordinates"][1][0] * scale_x),
-                         int(DEFAULT_ZONES["left"]["coordinates"][1][1] * scale_y))
-                    ],
-                    "correct_types": DEFAULT_ZONES["left"]["correct_types"]
-                },
-                "right": {
-                    "coordinates": [
-                        (int(DEFAULT_ZONES["right"]["coordinates"][0][0] * scale_x),
-                         int(DEFAULT_ZONES["right"]["coordinates"][0][1] * scale_y)),
-                        (int(DEFAULT_ZONES["right"]["coordinates"][1][0] * scale_x),
-                         int(DEFAULT_ZONES["right"]["coordinates"][1][1] * scale_y))
-                    ],
-                    "correct_types": DEFAULT_ZONES["right"]["correct_types"]
-                }
-            }
-        
-        # Process detection zone if provided
-        user_zone = None
-        if detection_zone:
-            try:
-                user_zone = json.loads(detection_zone)
-                print(f"Detection zone provided: {user_zone}")
-                
-                # Apply detection zone (crop image if needed)
-                if isinstance(user_zone, list) and len(user_zone) == 4:
-                    x1, y1, x2, y2 = [int(coord) for coord in user_zone]
-                    cropped_img = img[y1:y2, x1:x2].copy()
-                    print(f"Applied detection zone: [{x1}, {y1}, {x2}, {y2}]")
-                    # Create detection rectangle for visualization
-                    cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    
-                    # Use cropped image for detection
-                    detection_img = cropped_img
-                else:
-                    detection_img = img
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=400, detail="Invalid detection zone format")
-        else:
-            # No user zone provided, use the full image
-            detection_img = img
-            
-            # Draw preset zones for visualization
-            left_zone = scaled_zones["left"]["coordinates"]
-            right_zone = scaled_zones["right"]["coordinates"]
-            
-            # Draw left zone (paper/cardboard)
-            cv2.rectangle(
-                img, 
-                (left_zone[0][0], left_zone[0][1]), 
-                (left_zone[1][0], left_zone[1][1]), 
-                (0, 0, 255), 2
-            )
-            cv2.putText(
-                img, 
-                "Paper/Cardboard", 
-                (left_zone[0][0] + 10, left_zone[0][1] + 30), 
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2
-            )
+        return detect_frame(img, detection_zone, start_time, priority=priority, client=client, model_ref=model_ref,
+                            image_bytes=image_bytes, site=site)
+
+def prepare_frame(img: np.ndarray, detection_zone: Optional[str], render: bool = True, site=None):
+    """
+    Apply the request's detection zone to a frame.
+    
+    Args:
+        site: Site whose bins are the preset zones (default site if None)
+    
+    Returns:
+        (image to run the model on, user zone or None, site zones scaled to the frame)
+    """
+    # Get image dimensions for zone calculations
+    img_height, img_width = img.shape[:2]
+    
+    # The site's zones scaled to this frame size (cached per resolution)
+    site = site or sites.get()
+    scaled_zones, zone_overlay = site.layout(img_width, img_height)
+    
+    # Process detection zone if provided
+    user_zone = None
+    if detection_zone:
+        try:
+            user_zone = json.loads(detection_zone)
+            print(f"Detection zone provided: {user_zone}")
             
-            # Draw right zone (plastic/metal/glass)
-            cv2.rectangle(
-                img, 
-                (right_zone[0][0], right_zone[0][1]), 
-                (right_zone[1][0], right_zone[1][1]), 
-                (255, 0, 0), 2
-            )
-            cv2.putText(
-                img, 
-                "Plastic/Metal/Glass", 
-                (right_zone[0][0] + 10, right_zone[0][1] + 30), 
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2
-            )
+            # Apply detection zone (crop image if needed)
+            if isinstance(user_zone, list) and len(user_zone) == 4:
+                x1, y1, x2, y2 = [int(coord) for coord in user_zone]
+                cropped_img = img[y1:y2, x1:x2].copy()
+                print(f"Applied detection zone: [{x1}, {y1}, {x2}, {y2}]")
+                # Create detection rectangle for visualization
+                if render:
+                    cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                
+                # Use cropped image for detection
+                detection_img = cropped_img
+            else:
+                detection_img = img
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Invalid detection zone format")
+    else:
+        # No user zone provided, use the full image
+        detection_img = img
         
-        # Run actual YOLO detection on the image
-        if model is None:
-            raise HTTPException(status_code=500, detail="Model not loaded")
+        # Draw preset zones for visualization (rendered once per resolution and cached)
+        if render:
+            overlay_renderer.draw_zones(img, zone_overlay)
+    
+    return detection_img, user_zone, scaled_zones
+
+def zone_boxes(user_zone, scaled_zones: Dict) -> Optional[List[Tuple[int, int, int, int]]]:
+    """Regions of the detection image that tiles must cover: the preset zones, or all of a cropped user zone."""
+    if user_zone:
+        return None
+    return [(*zone["coordinates"][0], *zone["coordinates"][1]) for zone in scaled_zones.values()]
+
+def summarize_detections(
+    result,
+    names: Dict[int, str],
+    img: np.ndarray,
+    user_zone,
+    scaled_zones: Dict,
+    render: bool = True,
+    site=None
+) -> Tuple[List[Dict], str, bool, Optional[str]]:
+    """
+    Turn one model result into /detect detections and the disposal verdict, drawing them when rendering.
+    
+    Args:
+        site: Site whose confidence threshold and class mapping apply (default site if None)
+    
+    Returns:
+        (detections, waste type, is correct, zone)
+    """
+    detections = []
+    detected_waste_type = None
+    highest_conf = 0
+    
+    # Map YOLO classes to our waste types (with the site's overrides)
+    site = site or sites.get()
+    WASTE_CLASS_MAPPING = site.class_mapping(names)
+    threshold = site.confidence_threshold
+    
+    # Extract detections from the model results
+    all_waste_in_zones = []
+    
+    for box in result.boxes:
+        cls_id = int(box.cls.item())
+        conf = float(box.conf.item())
+        
+        # Skip if confidence is too low
+        if conf < threshold:
+            continue
             
-        # Start inference time measurement
-        inference_start = time.time()
-        results = model(detection_img)
-        inference_time = time.time() - inference_start
-        inference_fps = 1.0 / inference_time if inference_time > 0 else 0
+        # Get class name and mapped waste type
+        class_name = names[cls_id]
+        waste_type = WASTE_CLASS_MAPPING.get(cls_id, class_name.lower())
         
-        # Process YOLO results
-        detections = []
-        detected_waste_type = None
-        highest_conf = 0
+        # Track highest confidence detection
+        if conf > highest_conf:
+            highest_conf = conf
+            detected_waste_type = waste_type
         
-        result = results[0]  # Get first result
+        # Get bounding box coordinates
+        xyxy = box.xyxy.cpu().numpy().squeeze().astype(int).tolist()
         
-        # Map YOLO classes to our waste types
-        WASTE_CLASS_MAPPING = {
-            0: "glass",
-            1: "metal", 
-            2: "paper",
-            3: "plastic"
+        # Handle different result shapes
+        if not isinstance(xyxy, list):
+            continue
+        if len(xyxy) != 4:
+            continue
+            
+        # Create detection object
+        detection = {
+            "class_id": cls_id,
+            "class_name": class_name,
+            "waste_type": waste_type,
+            "confidence": float(conf),
+            "bbox": xyxy
         }
+        detections.append(detection)
         
-        # Default fallback classes if model uses different classes
-        if not any(cls_id in model.names for cls_id in WASTE_CLASS_MAPPING):
-            WASTE_CLASS_MAPPING = {}
-            for idx, class_name in model.names.items():
-                if 'paper' in class_name.lower() or 'cardboard' in class_name.lower():
-                    WASTE_CLASS_MAPPING[idx] = 'paper'
-                elif 'glass' in class_name.lower():
-                    WASTE_CLASS_MAPPING[idx] = 'glass'
-                elif 'metal' in class_name.lower() or 'can' in class_name.lower():
-                    WASTE_CLASS_MAPPING[idx] = 'metal'
-                elif 'plastic' in class_name.lower() or 'bottle' in class_name.lower():
-                    WASTE_CLASS_MAPPING[idx] = 'plastic'
-                else:
-                    WASTE_CLASS_MAPPING[idx] = class_name.lower()
-        
-        # Extract detections from the model results
-        all_waste_in_zones = []
-        
-        for box in result.boxes:
-            cls_id = int(box.cls.item())
-            conf = float(box.conf.item())
-            
-            # Skip if confidence is too low
-            if conf < CONFIDENCE_THRESHOLD:
-                continue
-                
-            # Get class name and mapped waste type
-            class_name = model.names[cls_id]
-            waste_type = WASTE_CLASS_MAPPING.get(cls_id, class_name.lower())
-            
-            # Track highest confidence detection
-            if conf > highest_conf:
-                highest_conf = conf
-                detected_waste_type = waste_type
-            
-            # Get bounding box coordinates
-            xyxy = box.xyxy.cpu().numpy().squeeze().astype(int).tolist()
-            
-            # Handle different result shapes
-            if not isinstance(xyxy, list):
-                continue
-            if len(xyxy) != 4:
-                continue
-                
-            # Create detection object
-            detection = {
-                "class_id": cls_id,
-                "class_name": class_name,
-                "waste_type": waste_type,
-                "confidence": float(conf),
-                "bbox": xyxy
-            }
-            detections.append(detection)
-            
-            # Check if detection is in any of the preset zones
-            # If we're using a user-defined detection zone, we'll use that instead
-            if user_zone:
-                # User zone is already applied in cropping, so all detections are "in zone"
-                is_in_zone = True
-                is_correct = True  # We assume user-defined zones are always "correct"
-            else:
-                # Check if detection is in left or right zone and if it's the correct waste type
-                xmin, ymin, xmax, ymax = xyxy
-                
-                # Check left zone (paper/cardboard)
-                left_zone = scaled_zones["left"]["coordinates"]
-                is_in_left = (
-                    xmin < left_zone[1][0] and xmax > left_zone[0][0] and
-                    ymin < left_zone[1][1] and ymax > left_zone[0][1]
-                )
-                
-                # Check right zone (plastic/metal/glass)
-                right_zone = scaled_zones["right"]["coordinates"]
-                is_in_right = (
-                    xmin < right_zone[1][0] and xmax > right_zone[0][0] and
-                    ymin < right_zone[1][1] and ymax > right_zone[0][1]
-                )
-                
-                is_in_zone = is_in_left or is_in_right
-                
-                # Determine if waste is correctly disposed
-                if is_in_left:
-                    is_correct = waste_type in scaled_zones["left"]["correct_types"]
-                    zone_name = "left"
-                elif is_in_right:
-                    is_correct = waste_type in scaled_zones["right"]["correct_types"]
-                    zone_name = "right"
-                else:
-                    is_correct = False
-                    zone_name = None
-                
-                # Add to tracking list if in a zone
-                if is_in_zone:
-                    all_waste_in_zones.append({
-                        "waste_type": waste_type,
-                        "is_correct": is_correct,
-                        "zone": zone_name,
-                        "confidence": conf
-                    })
+        # Check if detection is in any of the preset zones
+        # If we're using a user-defined detection zone, we'll use that instead
+        if user_zone:
+            # User zone is already applied in cropping, so all detections are "in zone"
+            is_in_zone = True
+            is_correct = True  # We assume user-defined zones are always "correct"
+        else:
+            # Check which of the site's zones (first match, in config order) the detection
+            # is in and if it's the correct waste type for that zone
+            xmin, ymin, xmax, ymax = xyxy
+            is_in_zone = False
+            is_correct = False
+            zone_name = None
+            for name, zone in scaled_zones.items():
+                (zx1, zy1), (zx2, zy2) = zone["coordinates"]
+                if xmin < zx2 and xmax > zx1 and ymin < zy2 and ymax > zy1:
+                    is_in_zone = True
+                    is_correct = waste_type in zone["correct_types"]
+                    zone_name = name
+                    break
             
-            # Draw detection on the image
+            # Add to tracking list if in a zone
+            if is_in_zone:
+                all_waste_in_zones.append({
+                    "waste_type": waste_type,
+                    "is_correct": is_correct,
+                    "zone": zone_name,
+                    "confidence": conf
+                })
+        
+        # Draw detection on the image
+        if render:
             color = (0, 255, 0) if (is_in_zone and is_correct) else (0, 0, 255)
             if user_zone:
                 # Adjust coordinates for cropped image to original
@@ -392,88 +741,687 @@ async def detect_waste(
                     xyxy[0] + x1, xyxy[1] + y1,
                     xyxy[2] + x1, xyxy[3] + y1
                 ]
-                cv2.rectangle(img, (adjusted_xyxy[0], adjusted_xyxy[1]), (adjusted_xyxy[2], adjusted_xyxy[3]), color, 2)
-                label = f"{waste_type}: {int(conf*100)}%"
-                cv2.putText(img, label, (adjusted_xyxy[0], adjusted_xyxy[1]-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+                overlay_renderer.draw_detection(img, adjusted_xyxy, waste_type, conf, color)
             else:
-                cv2.rectangle(img, (xyxy[0], xyxy[1]), (xyxy[2], xyxy[3]), color, 2)
-                label = f"{waste_type}: {int(conf*100)}%"
-                cv2.putText(img, label, (xyxy[0], xyxy[1]-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+                overlay_renderer.draw_detection(img, xyxy, waste_type, conf, color)
+    
+    # Determine overall detection result
+    # For user-defined zones, we keep previous logic
+    if user_zone:
+        # If no waste detected but we need a response, use the fallback
+        if not detected_waste_type and detections:
+            detected_waste_type = detections[0].get("waste_type", "unknown")
+        elif not detected_waste_type:
+            # No detection at all
+            detected_waste_type = "unknown"
+            
+        # Determine if waste is correctly disposed based on detection zone
+        # This would be application-specific logic based on your requirements
+        is_correct = user_zone is not None  # Simplified logic: waste is correctly disposed if in a zone
+        detected_zone = "custom"
+    else:
+        # For preset zones, use the most confident detection that's in a zone
+        if all_waste_in_zones:
+            # Sort by confidence
+            all_waste_in_zones.sort(key=lambda x: x["confidence"], reverse=True)
+            top_zone_detection = all_waste_in_zones[0]
+            detected_waste_type = top_zone_detection["waste_type"]
+            is_correct = top_zone_detection["is_correct"]
+            detected_zone = top_zone_detection["zone"]
+        else:
+            # No waste in any zone
+            detected_waste_type = detected_waste_type or "unknown"
+            is_correct = False
+            detected_zone = None
+    
+    return detections, detected_waste_type, is_correct, detected_zone
+
+def log_detections(events: List[Tuple[str, str, bool, Optional[str], float]]):
+    """
+    Store detection events in Supabase (one insert for all of them) and the rollups.
+    
+    Args:
+        events: (timestamp, waste_type, is_correct, zone, inference_fps) per detection
+    """
+    events = [event for event in events if event[1]]
+    if supabase and events:
+        try:
+            detection_logs = [
+                {
+                    "timestamp": timestamp,
+                    "waste_type": waste_type,
+                    "is_correct": is_correct,
+                    "inference_speed": inference_fps
+                }
+                for timestamp, waste_type, is_correct, _, inference_fps in events
+            ]
+            supabase.table("detections").insert(detection_logs).execute()
+            print(f"Detections logged: {len(detection_logs)}")
+        except Exception as e:
+            print(f"Error logging to database: {e}")
+    
+    # Fold the events into the local (and remote) time-bucketed rollups
+    if rollups is not None:
+        for timestamp, waste_type, is_correct, zone, inference_fps in events:
+            try:
+                rollups.record(timestamp, waste_type, is_correct, zone, inference_fps)
+            except Exception as e:
+                print(f"Error updating rollups: {e}")
+
+def encode_result_image(img: np.ndarray, image_bytes: bool = False):
+    """The annotated frame as a JPEG data URL, or as raw JPEG bytes for binary encodings."""
+    _, buffer = cv2.imencode('.jpg', img)
+    if image_bytes:
+        return buffer.tobytes()
+    img_str = base64.b64encode(buffer).decode('utf-8')
+    return f"data:image/jpeg;base64,{img_str}"
+
+def detect_frame(
+    img: np.ndarray,
+    detection_zone: Optional[str],
+    start_time: Optional[float] = None,
+    render: bool = True,
+    still_valid: Optional[Callable[[], bool]] = None,
+    priority: str = "interactive",
+    client: Optional[str] = None,
+    model_ref: Optional[str] = None,
+    image_bytes: bool = False,
+    site=None
+) -> Optional[Dict]:
+    """
+    Run detection on a decoded BGR frame. Blocking; called from a worker thread.
+    
+    Args:
+        img: BGR image; annotated in place when render is True
+        detection_zone: Optional JSON string with detection zone coordinates [x1,y1,x2,y2]
+        start_time: When processing of this frame started (defaults to now)
+        render: Draw zones/detections and include the annotated image in the response.
+            Frames read from shared memory are detected with render=False so the
+            writer's buffer is never modified.
+        still_valid: Optional check run after inference; if it returns False the
+            frame was overwritten while in use and None is returned instead
+        priority: Scheduling class for the model (see scheduler.py)
+        client: Client the request is accounted to for fair sharing
+        model_ref: Registry model ("name" or "name:version"); None uses the default model
+        image_bytes: Put the annotated image in the response as JPEG bytes rather than a
+            base64 data URL (for binary response encodings)
+        site: Site whose bins, threshold and class mapping apply (default site if None)
+    
+    Returns:
+        Response dictionary for /detect, or None if the frame was discarded
+    """
+    global model, supabase
+    
+    try:
+        start_time = start_time or time.time()
+        print(f"\n=== Starting detection request at {datetime.now().isoformat()} ===")
         
-        # Determine overall detection result
-        # For user-defined zones, we keep previous logic
-        if user_zone:
-            # If no waste detected but we need a response, use the fallback
-            if not detected_waste_type and detections:
-                detected_waste_type = detections[0].get("waste_type", "unknown")
-            elif not detected_waste_type:
-                # No detection at all
-                detected_waste_type = "unknown"
-                
-            # Determine if waste is correctly disposed based on detection zone
-            # This would be application-specific logic based on your requirements
-            is_correct = user_zone is not None  # Simplified logic: waste is correctly disposed if in a zone
+        site = site or sites.get()
+        model_ref = model_ref or site.model
+        detection_img, user_zone, scaled_zones = prepare_frame(img, detection_zone, render, site)
+        
+        # Run actual YOLO detection on the image
+        if model is None:
+            raise HTTPException(status_code=500, detail="Model not loaded")
+            
+        # Pick the operating point (model variant + input size) for this request
+        operating_point = adaptive.current
+            
+        cascade_info = None
+        # The lease keeps this model version loaded until inference finishes, even
+        # if a new version is activated meanwhile
+        with registry.lease(model_ref) as (active_model, model_name):
+            if operating_point.model == "fallback" and fallback_model is not None and model_ref is None:
+                active_model, model_name = fallback_model, "fallback"
+            with scheduler.slot(priority, client) as queue_time:
+                # Time only the model itself: waiting for the scheduler is not model cost,
+                # and counting it would make the adaptive controller step down under load
+                inference_start = time.time()
+                tiled = False
+                if cascade is not None and cascade.compatible(active_model):
+                    conflict_check = None if user_zone else zone_conflict_check(scaled_zones, site)
+                    result, active_model, cascade_info = cascade.predict(
+                        detection_img, operating_point.imgsz, heavy_model=active_model,
+                        conflict_check=conflict_check, threshold=site.confidence_threshold
+                    )
+                    results = [result]
+                elif tiler is not None and tiler.applies(detection_img):
+                    # Tiles run at their own size: the adaptive input size would shrink them
+                    # and lose the small items tiling is for
+                    results = [tiler.predict(active_model, detection_img, zone_boxes(user_zone, scaled_zones))]
+                    tiled = True
+                else:
+                    results = active_model(detection_img, imgsz=operating_point.imgsz)
+                inference_time = time.time() - inference_start
+        if still_valid is not None and not still_valid():
+            return None
+        inference_fps = 1.0 / inference_time if inference_time > 0 else 0
+        perf.record("queue", queue_time)
+        if tiled:
+            # Several tiles at TILE_SIZE, not one frame at the operating point's size,
+            # so it says nothing about whether that size fits the latency budget
+            perf.record("tiled_inference", inference_time)
         else:
-            # For preset zones, use the most confident detection that's in a zone
-            if all_waste_in_zones:
-                # Sort by confidence
-                all_waste_in_zones.sort(key=lambda x: x["confidence"], reverse=True)
-                top_zone_detection = all_waste_in_zones[0]
-                detected_waste_type = top_zone_detection["waste_type"]
-                is_correct = top_zone_detection["is_correct"]
-            else:
-                # No waste in any zone
-                detected_waste_type = detected_waste_type or "unknown"
-                is_correct = False
+            perf.record("inference", inference_time)
+            adaptive.observe(inference_time)
+        
+        # Process YOLO results
+        detections, detected_waste_type, is_correct, detected_zone = summarize_detections(
+            results[0], active_model.names, img, user_zone, scaled_zones, render, site
+        )
         
         print(f"Detected waste type: {detected_waste_type}, Is correct: {is_correct}")
         
         # Generate a base64 image of the result with annotations
-        _, buffer = cv2.imencode('.jpg', img)
-        img_str = base64.b64encode(buffer).decode('utf-8')
+        encode_start = time.time()
+        perf.record("postprocess", encode_start - inference_start - inference_time)
+        result_image = None
+        if render:
+            result_image = encode_result_image(img, image_bytes)
+            perf.record("encode", time.time() - encode_start)
         
         # Total processing time
         total_time = time.time() - start_time
+        perf.record("total", total_time)
+        perf.maybe_export(METRICS_LOG, METRICS_LOG_INTERVAL)
         
         # Create response
         timestamp = datetime.now().isoformat()
         response = {
             "timestamp": timestamp,
+            "site_id": site.site_id,
             "detections": detections,
             "detection_count": len(detections),
-            "result_image": f"data:image/jpeg;base64,{img_str}",
+            "result_image": result_image,
             "performance": {
+                "queue_time": float(queue_time),
                 "inference_time": float(inference_time),
                 "inference_fps": float(inference_fps),
-                "total_processing_time": float(total_time)
+                "avg_inference_fps": float(perf.rate("inference")),
+                "total_processing_time": float(total_time),
+                "operating_point": operating_point.to_dict(),
+                "model": model_name,
+                "cascade": cascade_info
             },
             "waste_detection": {
                 "waste_type": detected_waste_type,
-                "is_correct": is_correct
+                "is_correct": is_correct,
+                "zone": detected_zone
             }
         }
         
-        # Log to database if Supabase is configured
-        if supabase and detected_waste_type:
-            try:
-                detection_log = {
-                    "timestamp": timestamp,
-                    "waste_type": detected_waste_type,
-                    "is_correct": is_correct,
-                    "inference_speed": inference_fps
-                }
-                supabase.table("detections").insert(detection_log).execute()
-                print(f"Detection logged: {detected_waste_type}, correct: {is_correct}")
-            except Exception as e:
-                print(f"Error logging to database: {e}")
+        log_detections([(timestamp, detected_waste_type, is_correct, detected_zone, inference_fps)])
+        site.stats.record(len(detections), detected_waste_type, is_correct, detected_zone)
         
         print(f"=== Detection completed in {total_time:.2f}s ===\n")
-        return JSONResponse(content=response)
+        return response
     
     except Exception as e:
         print(f"ERROR in detect_waste: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Detection failed: {str(e)}")
 
+@app.post("/detect/batch")
+async def detect_waste_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    items: Optional[str] = Form(None),
+    stream: bool = Form(False),
+    include_image: bool = Form(False),
+    priority: Optional[str] = Form(None),
+    model_ref: Optional[str] = Form(None, alias="model"),
+    site_id: Optional[str] = Form(None)
+):
+    """
+    Detect waste in several images (e.g. frames buffered by an edge gateway) in one request.
+    
+    Args:
+        files: The images to analyze
+        items: Optional JSON list with one object per file, in the same order:
+            {"detection_zone": [x1,y1,x2,y2], "bin_id": "..."} (both optional)
+        stream: Send each image's result as soon as it is ready (JSON lines, or
+            MessagePack objects) instead of one response with all of them
+        include_image: Include the annotated image in each result
+        priority: Scheduling class (default "realtime")
+        model: Registry model to use, as "name" or "name:version"
+        site_id: Site the images come from (default site if omitted)
+    
+    Returns:
+        {"count", "results", "total_processing_time"}, results in upload order; each
+        result is a /detect response plus its "index" and "bin_id", or an "error"
+    """
+    if len(files) > DETECT_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {DETECT_BATCH_MAX} images per batch")
+    if model is None:
+        raise HTTPException(status_code=500, detail="Model not loaded")
+    priority = priority or "realtime"
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    site = request_site(site_id)
+    model_ref = model_ref or site.model
+    if model_ref:
+        try:
+            registry.resolve(model_ref)
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    try:
+        items = json.loads(items) if items else [{} for _ in files]
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid items format")
+    if not isinstance(items, list) or len(items) != len(files) or not all(isinstance(i, dict) for i in items):
+        raise HTTPException(status_code=400, detail="items must be a list with one object per file")
+    
+    client = request.client.host if request.client else None
+    encoding = negotiate(request.headers.get("accept"))
+    contents = [await f.read() for f in files]
+    results = detect_batch(contents, items, include_image, priority, client, model_ref,
+                           image_bytes=encoding == MSGPACK, site=site)
+    if stream:
+        return encode_stream(results, encoding)
+    
+    start_time = time.time()
+    try:
+        results = await run_in_threadpool(list, results)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"ERROR in detect_waste_batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Batch detection failed: {str(e)}")
+    if encoding is not None:
+        results = [to_columnar(r) for r in results]
+    return encode_response({
+        "count": len(results),
+        "results": results,
+        "total_processing_time": time.time() - start_time
+    }, encoding)
+
+def decode_image(contents: bytes) -> Optional[np.ndarray]:
+    return cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+
+def detect_batch(
+    contents: List[bytes],
+    items: List[Dict],
+    render: bool = False,
+    priority: str = "realtime",
+    client: Optional[str] = None,
+    model_ref: Optional[str] = None,
+    image_bytes: bool = False,
+    site=None
+) -> Iterator[Dict]:
+    """
+    Run detection on several encoded images with one batched inference. Blocking generator.
+    
+    Images are decoded in parallel and run through the model in a single call;
+    responses are then yielded in upload order as each is post-processed. An
+    image that can't be decoded or has an invalid zone yields an "error" entry
+    rather than failing the batch. Detection events are stored with one bulk
+    insert when the generator finishes (or the client disconnects).
+    
+    Args:
+        contents: Encoded image bytes
+        items: Per-image {"detection_zone", "bin_id"}
+        render: Draw zones/detections and include the annotated image in each response
+        site: Site whose bins, threshold and class mapping apply (default site if None)
+    """
+    start_time = time.time()
+    site = site or sites.get()
+    events = []
+    try:
+        with memory_monitor.track():
+            frames = list(batch_decoder.map(decode_image, contents))
+            decode_time = time.time() - start_time
+            perf.record("batch_decode", decode_time)
+            
+            errors = {}
+            prepared = []  # (index, frame, detection image, user zone, scaled zones)
+            for i, (img, item) in enumerate(zip(frames, items)):
+                if img is None:
+                    errors[i] = "Invalid image file"
+                    continue
+                zone = item.get("detection_zone")
+                if zone is not None and not isinstance(zone, str):
+                    zone = json.dumps(zone)
+                try:
+                    prepared.append((i, img) + prepare_frame(img, zone, render, site))
+                except HTTPException as e:
+                    errors[i] = e.detail
+                except (TypeError, ValueError):
+                    errors[i] = "Invalid detection zone format"
+            
+            if model is None:
+                raise HTTPException(status_code=500, detail="Model not loaded")
+            operating_point = adaptive.current
+            queue_time = inference_time = 0.0
+            results, models, cascade_infos, model_name = [], [], [], None
+            if prepared:
+                with registry.lease(model_ref) as (active_model, model_name):
+                    if operating_point.model == "fallback" and fallback_model is not None and model_ref is None:
+                        active_model, model_name = fallback_model, "fallback"
+                    # One turn at the model for the whole batch, accounted as one request per image
+                    with scheduler.slot(priority, client, cost=len(prepared)) as queue_time:
+                        inference_start = time.time()
+                        if cascade is not None and cascade.compatible(active_model):
+                            # The cascade decides per image whether the main model runs
+                            for _, _, detection_img, user_zone, scaled_zones in prepared:
+                                conflict_check = None if user_zone else zone_conflict_check(scaled_zones, site)
+                                result, used_model, info = cascade.predict(
+                                    detection_img, operating_point.imgsz, heavy_model=active_model,
+                                    conflict_check=conflict_check, threshold=site.confidence_threshold
+                                )
+                                results.append(result)
+                                models.append(used_model)
+                                cascade_infos.append(info)
+                        else:
+                            # Large frames are tiled one by one; the rest run as one batch
+                            tiled = {j for j, p in enumerate(prepared) if tiler is not None and tiler.applies(p[2])}
+                            whole = [p[2] for j, p in enumerate(prepared) if j not in tiled]
+                            whole_results = iter(active_model(whole, imgsz=operating_point.imgsz) if whole else [])
+                            for j, (_, _, detection_img, user_zone, scaled_zones) in enumerate(prepared):
+                                if j in tiled:
+                                    results.append(tiler.predict(active_model, detection_img,
+                                                                 zone_boxes(user_zone, scaled_zones)))
+                                else:
+                                    results.append(next(whole_results))
+                            models = [active_model] * len(prepared)
+                            cascade_infos = [None] * len(prepared)
+                        inference_time = time.time() - inference_start
+            # Not fed to the adaptive controller: a batch's time isn't a single frame's latency
+            perf.record("batch_queue", queue_time)
+            perf.record("batch_inference", inference_time)
+        
+        by_index = {p[0]: (p, result, used_model, info)
+                    for p, result, used_model, info in zip(prepared, results, models, cascade_infos)}
+        for i, item in enumerate(items):
+            entry = {"index": i, "bin_id": item.get("bin_id")}
+            if i in errors:
+                entry["error"] = errors[i]
+                yield entry
+                continue
+            (_, img, _, user_zone, scaled_zones), result, used_model, info = by_index[i]
+            detections, waste_type, is_correct, zone = summarize_detections(
+                result, used_model.names, img, user_zone, scaled_zones, render, site
+            )
+            timestamp = datetime.now().isoformat()
+            inference_fps = len(prepared) / inference_time if inference_time > 0 else 0
+            entry.update({
+                "timestamp": timestamp,
+                "site_id": site.site_id,
+                "detections": detections,
+                "detection_count": len(detections),
+                "result_image": encode_result_image(img, image_bytes) if render else None,
+                "performance": {
+                    "batch_size": len(prepared),
+                    "decode_time": float(decode_time),
+                    "queue_time": float(queue_time),
+                    "inference_time": float(inference_time),
+                    "inference_fps": float(inference_fps),
+                    "total_processing_time": float(time.time() - start_time),
+                    "operating_point": operating_point.to_dict(),
+                    "model": model_name,
+                    "cascade": info
+                },
+                "waste_detection": {
+                    "waste_type": waste_type,
+                    "is_correct": is_correct,
+                    "zone": zone
+                }
+            })
+            events.append((timestamp, waste_type, is_correct, zone, inference_fps))
+            site.stats.record(len(detections), waste_type, is_correct, zone)
+            yield entry
+        perf.record("batch_total", time.time() - start_time)
+    finally:
+        log_detections(events)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Rolling per-stage latency statistics (mean, EWMA, p50/p95/p99) for /detect"""
+    snapshot = perf.snapshot()
+    snapshot["sessions"] = frame_coalescer.stats()
+    snapshot["adaptive"] = adaptive.describe()
+    snapshot["cascade"] = cascade.stats() if cascade is not None else None
+    snapshot["tiling"] = tiler.stats() if tiler is not None else None
+    snapshot["shm"] = dict(shm_stats) if SHM_FRAME_SOURCE else None
+    snapshot["scheduler"] = scheduler.stats()
+    snapshot["memory"] = memory_gauges()
+    snapshot["capture"] = traffic_capture.stats() if traffic_capture is not None else None
+    return JSONResponse(content=snapshot)
+
+def shm_ingest_loop():
+    """
+    Detect the newest frame from the shared-memory ring until shutdown.
+    
+    Frames are read as views of the writer's buffer (no decode, no copy) and run
+    with render=False. Frames the capture process published while a detection
+    was running are skipped, and results for a slot that was overwritten
+    mid-inference are dropped.
+    """
+    global shm_latest
+    ring = None
+    last_seq = 0
+    while not shm_stop.is_set():
+        if ring is None:
+            try:
+                ring = SharedFrameRing.attach(SHM_FRAME_SOURCE)
+                last_seq = ring.latest_seq
+                shm_stats["attached"] = True
+                print(f"Attached to shared-memory ring {SHM_FRAME_SOURCE} "
+                      f"({ring.max_width}x{ring.max_height}, {ring.slots} slots)")
+            except (FileNotFoundError, ValueError):
+                # Capture process not started yet
+                shm_stop.wait(1.0)
+                continue
+        
+        try:
+            frame = ring.wait_for_frame(last_seq, timeout=0.5)
+        except WriterGoneError as e:
+            # A restarted writer creates a new block under the same name; reattach to it
+            print(f"Shared-memory writer {e}; waiting for it to restart")
+            ring.close()
+            ring = None
+            shm_stats["attached"] = False
+            shm_stop.wait(1.0)
+            continue
+        if frame is None:
+            continue
+        
+        seq, view, _ = frame
+        shm_stats["frames_skipped"] += max(0, seq - last_seq - 1)
+        last_seq = seq
+        try:
+            result = detect_frame(view, SHM_DETECTION_ZONE, render=False,
+                                  still_valid=lambda: ring.still_valid(seq),
+                                  priority="realtime", client=f"shm:{SHM_FRAME_SOURCE}")
+        except Exception as e:
+            print(f"Error detecting shared-memory frame {seq}: {e}")
+            continue
+        if result is None:
+            shm_stats["frames_torn"] += 1
+            continue
+        result["frame_seq"] = seq
+        shm_latest = result
+        shm_stats["frames_detected"] += 1
+    
+    if ring is not None:
+        ring.close()
+
+@app.get("/shm/latest")
+async def get_shm_latest(request: Request):
+    """Latest detection result for frames read from shared memory (SHM_FRAME_SOURCE)"""
+    if not SHM_FRAME_SOURCE:
+        raise HTTPException(status_code=404, detail="Shared-memory ingestion is not enabled")
+    encoding = negotiate(request.headers.get("accept"))
+    result = shm_latest
+    if result is not None and encoding is not None:
+        result = to_columnar(result)
+    return encode_response({
+        "source": SHM_FRAME_SOURCE,
+        "stats": dict(shm_stats),
+        "result": result
+    }, encoding)
+
+def check_admin(request: Request):
+    if ADMIN_TOKEN and request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/admin/memory")
+async def get_memory(request: Request):
+    """Memory gauges and, with MEMORY_TRACKING=1, per-request peaks and the latest snapshot diffs"""
+    check_admin(request)
+    return JSONResponse(content=await run_in_threadpool(memory_monitor.report))
+
+@app.post("/admin/memory/snapshot")
+async def take_memory_snapshot(request: Request):
+    """Take a tracemalloc snapshot now and return its diffs against the previous and first snapshots"""
+    check_admin(request)
+    if not memory_monitor.enabled:
+        raise HTTPException(status_code=409, detail="Memory tracking is disabled (set MEMORY_TRACKING=1)")
+    return JSONResponse(content=await run_in_threadpool(memory_monitor.snapshot))
+
+@app.get("/models")
+async def list_models():
+    """Registered models, their active versions, and per-version load/evict counts and memory"""
+    return JSONResponse(content=registry.stats())
+
+@app.post("/models/{name}/activate")
+async def activate_model(request: Request, name: str, version: str = Form(...), path: Optional[str] = Form(None)):
+    """
+    Hot-swap the active version of a model. The new version is loaded and warmed
+    before the swap; requests already running finish on the old version.
+    
+    Args:
+        version: Version to activate
+        path: Model file for the version, if it isn't registered yet; must be inside MODEL_DIR
+    """
+    global model
+    check_admin(request)
+    if path:
+        # Model files are pickles: only load them from the operator's model folder
+        model_dir = os.path.realpath(MODEL_DIR)
+        path = os.path.realpath(os.path.join(model_dir, path))
+        if os.path.commonpath([path, model_dir]) != model_dir:
+            raise HTTPException(status_code=400, detail="path must be inside MODEL_DIR")
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=400, detail=f"Model file not found: {path}")
+    try:
+        result = await run_in_threadpool(registry.activate, name, version, path)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Could not activate {name}:{version}: {e}")
+    if name == "main":
+        # Drop the module's reference to the old version so the registry can evict it
+        model = registry.active_model("main")
+        if cascade is not None:
+            cascade.heavy_model = model
+    return JSONResponse(content=result)
+
+@app.get("/sites")
+async def list_sites():
+    """Configured sites (bins, threshold, model) with per-site request and disposal counters"""
+    return JSONResponse(content=sites.describe())
+
+@app.post("/admin/sites/reload")
+async def reload_sites(request: Request):
+    """
+    Re-read SITES_CONFIG now instead of waiting for the change to be noticed.
+    Only this worker process reloads; others pick up the change within SITES_RELOAD_INTERVAL.
+    """
+    check_admin(request)
+    if not SITES_CONFIG:
+        raise HTTPException(status_code=409, detail="No site config (set SITES_CONFIG)")
+    try:
+        return JSONResponse(content=await run_in_threadpool(sites.load))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Site config rejected, keeping the current sites: {e}")
+
+@app.post("/jobs")
+async def create_job(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    video_path: Optional[str] = Form(None),
+    stride: int = Form(1),
+    sample_fps: Optional[float] = Form(None),
+    detection_zone: Optional[str] = Form(None),
+    chunk_seconds: float = Form(60.0),
+    recorded_at: Optional[str] = Form(None),
+    site_id: Optional[str] = Form(None)
+):
+    """
+    Process a recorded video in the background.
+    
+    Args:
+        file: Video upload (or use video_path); removed when the job finishes
+        video_path: Path of a video file on the server, relative to VIDEO_DIR
+        stride: Process every Nth frame
+        sample_fps: Process this many frames per second of video instead of a fixed stride
+        detection_zone: Optional JSON string with detection zone coordinates [x1,y1,x2,y2]
+        chunk_seconds: Seconds of video per chunk; chunks are spread across job workers
+        recorded_at: ISO time the recording started, used to timestamp events
+        site_id: Site the video was recorded at (default site if omitted)
+    """
+    check_admin(request)
+    if job_manager is None:
+        raise HTTPException(status_code=503, detail="Job manager not available")
+    if (file is None) == (video_path is None):
+        raise HTTPException(status_code=400, detail="Provide either file or video_path")
+    site_id = request_site(site_id).site_id
+    
+    uploaded = file is not None
+    if uploaded:
+        upload_dir = os.path.join(JOB_DIR, "uploads")
+        os.makedirs(upload_dir, exist_ok=True)
+        video_path = os.path.join(upload_dir, uuid.uuid4().hex + os.path.splitext(file.filename or "")[1])
+        def save_upload():
+            with open(video_path, "wb") as f:
+                shutil.copyfileobj(file.file, f)
+        await run_in_threadpool(save_upload)
+    else:
+        # Only read videos from the operator's video folder
+        if not VIDEO_DIR:
+            raise HTTPException(status_code=400, detail="video_path is disabled; set VIDEO_DIR or upload the file")
+        video_dir = os.path.realpath(VIDEO_DIR)
+        video_path = os.path.realpath(os.path.join(video_dir, video_path))
+        if os.path.commonpath([video_path, video_dir]) != video_dir:
+            raise HTTPException(status_code=400, detail="video_path must be inside VIDEO_DIR")
+        if not os.path.isfile(video_path):
+            raise HTTPException(status_code=400, detail="Video not found in VIDEO_DIR")
+    
+    try:
+        job = await run_in_threadpool(
+            job_manager.submit, video_path, stride, sample_fps,
+            detection_zone, chunk_seconds, recorded_at, site_id, uploaded
+        )
+    except ValueError as e:
+        if uploaded:
+            os.remove(video_path)
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content=job.to_dict(), status_code=202)
+
+@app.get("/jobs")
+async def list_jobs():
+    """Jobs started by this API process"""
+    if job_manager is None:
+        raise HTTPException(status_code=503, detail="Job manager not available")
+    return JSONResponse(content={"jobs": job_manager.list()})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status, progress and throughput (frames/s)"""
+    job = job_manager.get(job_id) if job_manager is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(content=job)
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str):
+    """Per-frame results so far, one JSON object per line"""
+    job = job_manager.get(job_id) if job_manager is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not os.path.exists(job["results_path"]):
+        return Response(status_code=204)
+    return FileResponse(job["results_path"], media_type="application/x-ndjson")
+
 @app.get("/analytics")
 async def get_analytics():
     """Get analytics data from the database"""
@@ -531,5 +1479,35 @@ async def get_analytics():
     }
     return JSONResponse(content=mock_data)
 
+@app.get("/analytics/history")
+async def get_analytics_history(
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    bucket: str = Query("hour")
+):
+    """
+    Historical detection counts from the rollup tables (never scans raw detections).
+    
+    Args:
+        from: ISO timestamp of the first bucket (inclusive)
+        to: ISO timestamp to stop at (exclusive)
+        bucket: "minute", "hour" or "day"
+    
+    Returns:
+        JSON with one row per bucket x waste_type x is_correct x zone
+    """
+    if rollups is None:
+        raise HTTPException(status_code=503, detail="Rollup store not available")
+    try:
+        rows = await run_in_threadpool(rollups.history, start, end, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content={
+        "bucket": bucket,
+        "from": start,
+        "to": end,
+        "rows": rows
+    })
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8008, reload=True) 
\ No newline at end of file
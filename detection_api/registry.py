@@ -0,0 +1,234 @@
+"""
+Registry of named, versioned models for the detection API.
+
+Models are referred to as "name" (its active version) or "name:version" and
+loaded on first use. Loaded models are kept in an LRU cache bounded by their
+total parameter memory; models that are in use or active are never evicted.
+
+Activating a new version loads and warms it first, then swaps the name's
+active version in one step. Requests that already leased the old version
+finish on it; the old version stays cached until the LRU evicts it.
+
+The registry file (MODEL_REGISTRY) is JSON:
+
+    {
+      "default": "waste",
+      "models": {
+        "waste": {"active": "v1", "versions": {"v1": "../model/my_model.pt",
+                                               "v2": "../model/my_model_v2.pt"}},
+        "coco": {"active": "n", "versions": {"n": "yolov8n.pt"}}
+      }
+    }
+"""
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+
+def model_memory(model) -> int:
+    """Bytes held by a YOLO model's parameters and buffers (0 if unknown)."""
+    try:
+        net = model.model
+        return sum(t.numel() * t.element_size() for t in itertools.chain(net.parameters(), net.buffers()))
+    except Exception:
+        return 0
+
+
+class _Entry:
+    __slots__ = ("name", "version", "model", "bytes", "leases", "last_used")
+
+    def __init__(self, name, version, model):
+        self.name = name
+        self.version = version
+        self.model = model
+        self.bytes = model_memory(model)
+        self.leases = 0
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    def __init__(self, loader: Callable[[str], object], warmup: Optional[Callable[[object], None]] = None,
+                 max_bytes: int = 0):
+        """
+        Args:
+            loader: Loads a model from a path
+            warmup: Runs a first inference on a freshly loaded model before it is used
+            max_bytes: Memory budget for loaded models (0 for unbounded)
+        """
+        self.loader = loader
+        self.warmup = warmup
+        self.max_bytes = max_bytes
+        self.default = None
+        self._paths: Dict[str, Dict[str, str]] = {}
+        self._active: Dict[str, str] = {}
+        self._loaded: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._stats: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def configure(self, config: Dict):
+        """Register the models and active versions from a registry config."""
+        with self._lock:
+            for name, spec in config.get("models", {}).items():
+                self._paths.setdefault(name, {}).update(spec.get("versions", {}))
+                if spec.get("active"):
+                    self._active[name] = spec["active"]
+                elif name not in self._active and self._paths[name]:
+                    self._active[name] = next(iter(self._paths[name]))
+            # An explicit "default" wins; otherwise keep the one already registered (the startup model)
+            self.default = config.get("default") or self.default or next(iter(self._paths), None)
+
+    def load_file(self, path: str):
+        with open(path) as f:
+            self.configure(json.load(f))
+
+    def register(self, name: str, version: str, path: Optional[str], model=None):
+        """Add a version; `model` adds it already loaded (e.g. the model loaded at startup)."""
+        with self._lock:
+            self._paths.setdefault(name, {})[version] = path
+            self._active.setdefault(name, version)
+            if self.default is None:
+                self.default = name
+            if model is not None:
+                key = (name, version)
+                self._loaded[key] = _Entry(name, version, model)
+                self._stat(key)["loads"] += 1
+
+    def resolve(self, ref: Optional[str]) -> Tuple[str, str]:
+        """Turn "name", "name:version" or None (the default model) into (name, version)."""
+        ref = ref or self.default
+        if not ref:
+            raise KeyError("No models registered")
+        name, _, version = ref.partition(":")
+        with self._lock:
+            if name not in self._paths:
+                raise KeyError(f"Unknown model: {name}")
+            version = version or self._active[name]
+            if version not in self._paths[name]:
+                raise KeyError(f"Unknown version {version} of model {name}")
+        return name, version
+
+    def _stat(self, key):
+        stat = self._stats.get(key)
+        if stat is None:
+            stat = self._stats[key] = {"loads": 0, "evictions": 0, "requests": 0}
+        return stat
+
+    def _load(self, key: Tuple[str, str]) -> _Entry:
+        """Load (and warm) a model unless it is already resident. Returns it leased."""
+        with self._lock:
+            entry = self._loaded.get(key)
+            if entry is not None:
+                entry.leases += 1
+                return entry
+        # Loads are rare; one at a time keeps two requests from loading the same model
+        with self._load_lock:
+            with self._lock:
+                entry = self._loaded.get(key)
+                if entry is not None:
+                    entry.leases += 1
+                    return entry
+                path = self._paths[key[0]][key[1]]
+            print(f"Loading model {key[0]}:{key[1]} from {path}")
+            model = self.loader(path)
+            if self.warmup is not None:
+                self.warmup(model)
+            entry = _Entry(key[0], key[1], model)
+            with self._lock:
+                entry.leases = 1
+                self._loaded[key] = entry
+                self._stat(key)["loads"] += 1
+                self._evict()
+        return entry
+
+    def _evict(self):
+        """Drop least recently used idle models until the budget is met. Called with the lock held."""
+        if not self.max_bytes:
+            return
+        total = sum(e.bytes for e in self._loaded.values())
+        for key in list(self._loaded):
+            if total <= self.max_bytes:
+                break
+            entry = self._loaded[key]
+            if entry.leases or self._active.get(entry.name) == entry.version:
+                continue
+            del self._loaded[key]
+            total -= entry.bytes
+            self._stat(key)["evictions"] += 1
+            print(f"Evicted model {entry.name}:{entry.version} ({entry.bytes / 1e6:.1f} MB)")
+
+    @contextmanager
+    def lease(self, ref: Optional[str] = None):
+        """
+        Use a model for one request; it can't be evicted while leased.
+
+        Yields:
+            (model, "name:version")
+        """
+        key = self.resolve(ref)
+        entry = self._load(key)
+        with self._lock:
+            self._loaded.move_to_end(key)
+            entry.last_used = time.time()
+            self._stat(key)["requests"] += 1
+        try:
+            yield entry.model, f"{key[0]}:{key[1]}"
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                self._evict()
+
+    def activate(self, name: str, version: str, path: Optional[str] = None) -> Dict:
+        """
+        Make `version` the active version of `name`, loading and warming it first.
+
+        Args:
+            path: Registers the version at this path if it isn't known yet
+        """
+        if path:
+            with self._lock:
+                self._paths.setdefault(name, {})[version] = path
+        key = self.resolve(f"{name}:{version}")
+        entry = self._load(key)
+        with self._lock:
+            previous = self._active.get(name)
+            self._active[name] = version
+            entry.leases -= 1
+            self._evict()
+        print(f"Model {name}: {previous} -> {version}")
+        return {"name": name, "active": version, "previous": previous}
+
+    def active_model(self, name: Optional[str] = None):
+        """The loaded active model of `name` (default model if None), or None if it isn't loaded."""
+        with self._lock:
+            name = name or self.default
+            entry = self._loaded.get((name, self._active.get(name)))
+            return entry.model if entry else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            models = {}
+            for name, versions in self._paths.items():
+                models[name] = {
+                    "active": self._active.get(name),
+                    "versions": {
+                        version: {
+                            "path": path,
+                            "loaded": (name, version) in self._loaded,
+                            "resident_bytes": self._loaded[(name, version)].bytes if (name, version) in self._loaded else 0,
+                            "in_use": self._loaded[(name, version)].leases if (name, version) in self._loaded else 0,
+                            **self._stats.get((name, version), {"loads": 0, "evictions": 0, "requests": 0}),
+                        }
+                        for version, path in versions.items()
+                    },
+                }
+            return {
+                "default": self.default,
+                "resident_bytes": sum(e.bytes for e in self._loaded.values()),
+                "max_bytes": self.max_bytes,
+                "models": models,
+            }
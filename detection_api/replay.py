@@ -0,0 +1,239 @@
+"""
+Replay captured /detect traffic against a server and compare two builds.
+
+Archives are recorded by the API with CAPTURE_DIR set (see traffic.py). A run
+sends every captured request with its original zone, session, priority and site, at
+the original arrival times (or --speed times faster), and writes one JSON line
+per request with its latency and detections. Replaying the same archive
+against two builds and comparing the runs shows latency changes and any
+change in what the model detects.
+
+Usage:
+    python replay.py run captures/capture-*.rcap --url http://localhost:8008 --out before.jsonl
+    python replay.py run captures/capture-*.rcap --url http://localhost:8009 --out after.jsonl --speed 2
+    python replay.py compare before.jsonl after.jsonl
+"""
+import argparse
+import heapq
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from traffic import read_capture
+
+parser = argparse.ArgumentParser(description="Replay captured /detect traffic and compare runs")
+commands = parser.add_subparsers(dest="command", required=True)
+
+run_parser = commands.add_parser("run", help="Replay archives against a server")
+run_parser.add_argument('archives', nargs='+', help='Capture archives (merged by arrival time)')
+run_parser.add_argument('--url', default='http://localhost:8008')
+run_parser.add_argument('--out', required=True, help='JSON lines file for the per-request results')
+run_parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay N times faster than recorded (0: back to back, as fast as possible)')
+run_parser.add_argument('--concurrency', type=int, default=32, help='Most requests in flight at once')
+run_parser.add_argument('--limit', type=int, default=0, help='Replay only the first N requests')
+
+compare_parser = commands.add_parser("compare", help="Compare two replay runs")
+compare_parser.add_argument('baseline', help='Results of the reference build')
+compare_parser.add_argument('candidate', help='Results of the build under test')
+compare_parser.add_argument('--iou', type=float, default=0.5, help='IoU for two boxes to count as the same detection')
+compare_parser.add_argument('--max-latency-regression', type=float, default=None,
+                            help='Fail if candidate p95 latency is more than this many percent above baseline')
+compare_parser.add_argument('--min-agreement', type=float, default=None,
+                            help='Fail if fewer than this fraction of requests have matching detections')
+
+
+def captured_requests(paths):
+    """All captured requests in arrival order, streamed from the archives."""
+    return heapq.merge(*(read_capture(p) for p in paths), key=lambda record: record[0])
+
+
+def summarize(response):
+    """The parts of a /detect response that a replay compares."""
+    if response.get("status") == "superseded":
+        return {"status": "superseded"}
+    performance = response.get("performance", {})
+    return {
+        "status": "ok",
+        "detections": [[d["class_id"], round(d["confidence"], 4), *d["bbox"]] for d in response.get("detections", [])],
+        "waste_type": response.get("waste_detection", {}).get("waste_type"),
+        "is_correct": response.get("waste_detection", {}).get("is_correct"),
+        "inference_time": performance.get("inference_time"),
+        "model": performance.get("model"),
+    }
+
+
+def run(args):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    lock = threading.Lock()
+    # Bounds the images held in memory when the server falls behind the schedule
+    in_flight = threading.BoundedSemaphore(args.concurrency * 2)
+    out = open(args.out, "w")
+
+    def send(index, offset, meta, data, scheduled):
+        sent = time.perf_counter()
+        form = {k: meta[k] for k in ("detection_zone", "session_id", "priority", "model", "site_id") if meta.get(k)}
+        record = {"index": index, "offset": round(offset, 4), "lag": round(sent - scheduled, 4)}
+        try:
+            response = session.post(f"{args.url}/detect", files={'file': ('frame.jpg', data, 'image/jpeg')},
+                                    data=form, timeout=120)
+            record["latency"] = round(time.perf_counter() - sent, 5)
+            record["http_status"] = response.status_code
+            record.update(summarize(response.json()) if response.ok else {"status": "error"})
+        except (requests.RequestException, ValueError) as e:
+            record.update({"latency": round(time.perf_counter() - sent, 5), "status": "error", "error": str(e)})
+        finally:
+            in_flight.release()
+        with lock:
+            out.write(json.dumps(record) + "\n")
+        return record
+
+    futures = []
+    first = None
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for index, (arrival, meta, data) in enumerate(captured_requests(args.archives)):
+            if args.limit and index >= args.limit:
+                break
+            first = arrival if first is None else first
+            offset = arrival - first
+            scheduled = started
+            if args.speed > 0:
+                scheduled = started + offset / args.speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            in_flight.acquire()
+            futures.append(pool.submit(send, index, offset, meta, data, scheduled))
+    out.close()
+    elapsed = time.perf_counter() - started
+
+    records = [f.result() for f in futures]
+    if not records:
+        print("No requests in the archives")
+        return
+    latencies = [r["latency"] for r in records if r["status"] == "ok"]
+    lags = [r["lag"] for r in records]
+    counts = {status: sum(r["status"] == status for r in records) for status in ("ok", "superseded", "error")}
+    print(f"\nReplayed {len(records)} requests in {elapsed:.1f}s ({len(records) / elapsed:.1f} req/s): "
+          f"{counts['ok']} ok, {counts['superseded']} superseded, {counts['error']} errors")
+    if latencies:
+        print(f"Latency p50 {np.percentile(latencies, 50)*1000:.1f} ms  p95 {np.percentile(latencies, 95)*1000:.1f} ms  "
+              f"p99 {np.percentile(latencies, 99)*1000:.1f} ms")
+    if args.speed > 0:
+        # Large send lag means the client, not the server, set the pace: raise --concurrency
+        print(f"Send lag behind the recorded schedule: p95 {np.percentile(lags, 95)*1000:.1f} ms")
+    print(f"Results written to {args.out}")
+
+
+def load_run(path):
+    with open(path) as f:
+        return {r["index"]: r for r in map(json.loads, f) if r}
+
+
+def box_iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match_detections(a, b, iou):
+    """Greedily pair same-class detections by IoU. Returns (matches, confidence differences)."""
+    used = set()
+    conf_diffs = []
+    for det in sorted(a, key=lambda d: -d[1]):
+        best, best_iou = None, iou
+        for j, other in enumerate(b):
+            if j in used or other[0] != det[0]:
+                continue
+            overlap = box_iou(det[2:], other[2:])
+            if overlap >= best_iou:
+                best, best_iou = j, overlap
+        if best is not None:
+            used.add(best)
+            conf_diffs.append(abs(det[1] - b[best][1]))
+    return len(used), conf_diffs
+
+
+def latency_line(name, records):
+    latencies = [r["latency"] for r in records]
+    return (f"{name:<10} p50 {np.percentile(latencies, 50)*1000:8.1f} ms  "
+            f"p95 {np.percentile(latencies, 95)*1000:8.1f} ms  p99 {np.percentile(latencies, 99)*1000:8.1f} ms")
+
+
+def compare(args):
+    baseline, candidate = load_run(args.baseline), load_run(args.candidate)
+    common = sorted(i for i in baseline if i in candidate
+                    and baseline[i]["status"] == "ok" and candidate[i]["status"] == "ok")
+    print(f"{len(baseline)} baseline / {len(candidate)} candidate requests, {len(common)} answered by both")
+    if not common:
+        return
+
+    base, cand = [baseline[i] for i in common], [candidate[i] for i in common]
+    print("\nLatency (requests answered by both)")
+    print(latency_line("baseline", base))
+    print(latency_line("candidate", cand))
+    deltas = [c["latency"] - b["latency"] for b, c in zip(base, cand)]
+    print(f"Per-request change: median {np.median(deltas)*1000:+.1f} ms, "
+          f"candidate faster on {sum(d < 0 for d in deltas) / len(deltas):.0%} of requests")
+    regression = (np.percentile([r["latency"] for r in cand], 95) /
+                  np.percentile([r["latency"] for r in base], 95) - 1) * 100
+
+    same_output = same_waste = matched = base_boxes = cand_boxes = 0
+    conf_diffs = []
+    worst = []
+    for i, b, c in zip(common, base, cand):
+        pairs, diffs = match_detections(b["detections"], c["detections"], args.iou)
+        matched += pairs
+        conf_diffs += diffs
+        base_boxes += len(b["detections"])
+        cand_boxes += len(c["detections"])
+        same_waste += b["waste_type"] == c["waste_type"] and b["is_correct"] == c["is_correct"]
+        unmatched = len(b["detections"]) + len(c["detections"]) - 2 * pairs
+        same_output += unmatched == 0
+        if unmatched:
+            worst.append((unmatched, i))
+    agreement = same_output / len(common)
+
+    print("\nOutput")
+    print(f"Same detections: {same_output}/{len(common)} requests ({agreement:.1%})")
+    print(f"Same waste type and verdict: {same_waste}/{len(common)} requests")
+    print(f"Boxes: {base_boxes} baseline, {cand_boxes} candidate, {matched} matched at IoU >= {args.iou}")
+    if conf_diffs:
+        print(f"Confidence change of matched boxes: mean {np.mean(conf_diffs):.4f}, max {np.max(conf_diffs):.4f}")
+    if worst:
+        worst.sort(reverse=True)
+        print("Most changed requests (index: unmatched boxes): " +
+              ", ".join(f"{i}: {n}" for n, i in worst[:10]))
+
+    failed = False
+    if args.max_latency_regression is not None and regression > args.max_latency_regression:
+        print(f"FAIL: p95 latency {regression:+.1f}% (limit {args.max_latency_regression:+.1f}%)")
+        failed = True
+    if args.min_agreement is not None and agreement < args.min_agreement:
+        print(f"FAIL: detections agree on {agreement:.1%} of requests (minimum {args.min_agreement:.1%})")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
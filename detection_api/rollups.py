@@ -0,0 +1,277 @@
+"""
+Time-bucketed rollups of detection events for historical analytics.
+
+Every detection event is folded into minute, hour and day buckets keyed by
+(waste_type, is_correct, zone), with a count and inference-speed summary.
+Events are aggregated in memory and flushed in one transaction per interval
+to a local SQLite file, and optionally pushed to the remote database through
+the `upsert_detection_rollups` function in create-rollup-tables.sql.
+
+Rows for the remote are queued in the same SQLite transaction and pushed by a
+background thread, so a slow or unreachable database never delays a request.
+Several processes (serve.py workers) share the SQLite file: a pusher first
+claims a batch of queued rows for its pid, sends them, and deletes only the
+rows it claimed once the call succeeds. A failed push releases its claim and
+is retried later (also after a restart); claims held by a dead process are
+released by the next pusher. History queries only ever read the rollup
+tables, never the raw detections.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+BUCKETS = {
+    "minute": "%Y-%m-%dT%H:%M:00",
+    "hour": "%Y-%m-%dT%H:00:00",
+    "day": "%Y-%m-%dT00:00:00",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_{bucket} (
+    bucket_start TEXT NOT NULL,
+    waste_type TEXT NOT NULL,
+    is_correct INTEGER NOT NULL,
+    zone TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    speed_sum REAL NOT NULL,
+    speed_min REAL NOT NULL,
+    speed_max REAL NOT NULL,
+    PRIMARY KEY (bucket_start, waste_type, is_correct, zone)
+)
+"""
+
+_UPSERT = """
+INSERT INTO rollup_{bucket} (bucket_start, waste_type, is_correct, zone, count, speed_sum, speed_min, speed_max)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (bucket_start, waste_type, is_correct, zone) DO UPDATE SET
+    count = count + excluded.count,
+    speed_sum = speed_sum + excluded.speed_sum,
+    speed_min = MIN(speed_min, excluded.speed_min),
+    speed_max = MAX(speed_max, excluded.speed_max)
+"""
+
+
+# Aggregates not yet accepted by the remote database, one row per key per flush.
+# claimed_by is the pid of the process currently sending the row.
+_REMOTE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS remote_pending (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bucket TEXT NOT NULL,
+    bucket_start TEXT NOT NULL,
+    waste_type TEXT NOT NULL,
+    is_correct INTEGER NOT NULL,
+    zone TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    speed_sum REAL NOT NULL,
+    speed_min REAL NOT NULL,
+    speed_max REAL NOT NULL,
+    claimed_by INTEGER
+)
+"""
+
+_QUEUE_REMOTE = """
+INSERT INTO remote_pending (bucket, bucket_start, waste_type, is_correct, zone, count, speed_sum, speed_min, speed_max)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_CLAIM_REMOTE = """
+UPDATE remote_pending SET claimed_by = ?
+WHERE id IN (SELECT id FROM remote_pending WHERE claimed_by IS NULL ORDER BY id LIMIT ?)
+"""
+
+
+def bucket_start(ts: datetime, bucket: str) -> str:
+    return ts.strftime(BUCKETS[bucket])
+
+
+def _merge(aggs: Dict[tuple, List[float]], key: tuple, count, speed_sum, speed_min, speed_max):
+    agg = aggs.get(key)
+    if agg is None:
+        aggs[key] = [count, speed_sum, speed_min, speed_max]
+    else:
+        agg[0] += count
+        agg[1] += speed_sum
+        agg[2] = min(agg[2], speed_min)
+        agg[3] = max(agg[3], speed_max)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RollupStore:
+    def __init__(self, path: str, flush_interval: float = 1.0, remote=None,
+                 push_interval: float = 5.0, push_batch: int = 500):
+        """
+        Args:
+            path: SQLite file for the local rollup tables
+            flush_interval: Seconds to aggregate in memory before writing
+            remote: Optional Supabase client; flushed rollups are also sent to
+                its `upsert_detection_rollups` function, from a background thread
+            push_interval: Seconds between pushes to the remote
+            push_batch: Most queued rows sent in one remote call
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.remote = remote
+        self.push_interval = push_interval
+        self.push_batch = push_batch
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._pending: Dict[tuple, List[float]] = {}
+        self._last_flush = time.time()
+        with self._conn:
+            for bucket in BUCKETS:
+                self._conn.execute(_SCHEMA.format(bucket=bucket))
+            self._conn.execute(_REMOTE_SCHEMA)
+        self._stop = threading.Event()
+        self._pusher = None
+        if remote is not None:
+            self._pusher = threading.Thread(target=self._push_loop, name="rollup-push", daemon=True)
+            self._pusher.start()
+
+    def record(self, timestamp: str, waste_type: str, is_correct: bool,
+               zone: Optional[str], inference_speed: float):
+        """Fold one detection event into the pending minute/hour/day buckets."""
+        ts = datetime.fromisoformat(timestamp)
+        speed = float(inference_speed)
+        with self._lock:
+            for bucket in BUCKETS:
+                key = (bucket, bucket_start(ts, bucket), waste_type, int(bool(is_correct)), zone or "none")
+                _merge(self._pending, key, 1, speed, speed, speed)
+            due = time.time() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the pending aggregates (and queue them for the remote) in one local transaction."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.time()
+            if not pending:
+                return
+            try:
+                with self._conn:
+                    for bucket in BUCKETS:
+                        rows = [key[1:] + tuple(agg) for key, agg in pending.items() if key[0] == bucket]
+                        if rows:
+                            self._conn.executemany(_UPSERT.format(bucket=bucket), rows)
+                    if self.remote is not None:
+                        self._conn.executemany(_QUEUE_REMOTE, [key + tuple(agg) for key, agg in pending.items()])
+            except sqlite3.Error:
+                # Rolled back; keep the aggregates for the next flush
+                for key, agg in pending.items():
+                    _merge(self._pending, key, *agg)
+                raise
+
+    def _push_loop(self):
+        while not self._stop.wait(self.push_interval):
+            try:
+                self.flush()
+                # Keep going while full batches are accepted, so a backlog drains
+                while self._push_remote() >= self.push_batch and not self._stop.is_set():
+                    pass
+            except Exception as e:
+                print(f"Error pushing rollups to database, retrying in {self.push_interval:g}s: {e}")
+
+    def _push_remote(self) -> int:
+        """
+        Claim up to push_batch queued rows, send them merged per key, and delete them if the call succeeds.
+
+        Returns:
+            Number of queued rows sent
+        """
+        pid = os.getpid()
+        with self._lock, self._conn:
+            # Serializes claims across the processes sharing the file
+            self._conn.execute("BEGIN IMMEDIATE")
+            # Claims left by a process that died mid-push, or by an earlier failed push of ours
+            owners = [r[0] for r in self._conn.execute(
+                "SELECT DISTINCT claimed_by FROM remote_pending WHERE claimed_by IS NOT NULL")]
+            for owner in owners:
+                if owner == pid or not _pid_alive(owner):
+                    self._conn.execute("UPDATE remote_pending SET claimed_by = NULL WHERE claimed_by = ?", (owner,))
+            self._conn.execute(_CLAIM_REMOTE, (pid, self.push_batch))
+            claimed = self._conn.execute(
+                "SELECT id, bucket, bucket_start, waste_type, is_correct, zone, count, speed_sum, speed_min, speed_max "
+                "FROM remote_pending WHERE claimed_by = ?", (pid,)).fetchall()
+        if not claimed:
+            return 0
+
+        merged: Dict[tuple, List[float]] = {}
+        for row in claimed:
+            _merge(merged, row[1:6], *row[6:])
+        rows = [
+            {
+                "bucket": key[0], "bucket_start": key[1], "waste_type": key[2],
+                "is_correct": bool(key[3]), "zone": key[4], "count": agg[0],
+                "speed_sum": agg[1], "speed_min": agg[2], "speed_max": agg[3]
+            }
+            for key, agg in merged.items()
+        ]
+        ids = [(row[0],) for row in claimed]
+        try:
+            self.remote.rpc("upsert_detection_rollups", {"rows": rows}).execute()
+        except Exception:
+            with self._lock, self._conn:
+                self._conn.executemany("UPDATE remote_pending SET claimed_by = NULL WHERE id = ?", ids)
+            raise
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM remote_pending WHERE id = ?", ids)
+        return len(claimed)
+
+    def history(self, start: Optional[str], end: Optional[str], bucket: str = "hour") -> List[Dict]:
+        """
+        Read rollups for buckets starting in [start, end).
+
+        Args:
+            start: ISO timestamp (inclusive), or None for the beginning
+            end: ISO timestamp (exclusive), or None for now
+            bucket: "minute", "hour" or "day"
+        """
+        if bucket not in BUCKETS:
+            raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+        # Include events that are still aggregating in memory
+        self.flush()
+        query = (f"SELECT bucket_start, waste_type, is_correct, zone, count, speed_sum, speed_min, speed_max "
+                 f"FROM rollup_{bucket} WHERE 1=1")
+        params = []
+        if start:
+            query += " AND bucket_start >= ?"
+            params.append(bucket_start(datetime.fromisoformat(start), bucket))
+        if end:
+            query += " AND bucket_start < ?"
+            params.append(datetime.fromisoformat(end).strftime("%Y-%m-%dT%H:%M:%S"))
+        query += " ORDER BY bucket_start"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {
+                "bucket_start": r[0],
+                "waste_type": r[1],
+                "is_correct": bool(r[2]),
+                "zone": r[3],
+                "count": r[4],
+                "avg_inference_speed": r[5] / r[4] if r[4] else 0.0,
+                "min_inference_speed": r[6],
+                "max_inference_speed": r[7],
+            }
+            for r in rows
+        ]
+
+    def close(self):
+        self._stop.set()
+        if self._pusher is not None:
+            self._pusher.join(timeout=10)
+        # Whatever was not pushed stays queued in the file for the next start
+        self.flush()
+        self._conn.close()
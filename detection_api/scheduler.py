@@ -0,0 +1,156 @@
+"""
+Priority scheduling of access to the model.
+
+All inference in the API process goes through one InferenceScheduler instead
+of a plain lock. Waiting requests are served strictly by priority class
+(interactive > realtime > bulk). Within a class, clients share the model by
+weighted fair queuing: each request gets a virtual finish tag of
+max(class virtual time, client's last tag) + cost / client weight, and the
+smallest tag goes next, so one busy client can't starve the others.
+
+Bulk work acquires the model one batch at a time, which makes every batch
+boundary a preemption point: a waiting live frame always gets the next turn.
+Video jobs run in their own processes, so the scheduler also publishes a
+shared counter of live (interactive + realtime) requests in flight; job
+workers pause between frames while it is non-zero. The counter belongs to one
+API process: under serve.py it only counts that worker's requests.
+"""
+import heapq
+import itertools
+import multiprocessing
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from telemetry import StageMeter
+
+PRIORITIES = ("interactive", "realtime", "bulk")
+_RANK = {name: rank for rank, name in enumerate(PRIORITIES)}
+
+
+def parse_weights(value: Optional[str]) -> Dict[str, float]:
+    """Parse "cam1=2,cam2=0.5" into client weights."""
+    weights = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            client, weight = item.split("=", 1)
+            weights[client.strip()] = float(weight)
+    return weights
+
+
+class _Ticket:
+    __slots__ = ("priority", "start", "finish", "event", "enqueued")
+
+    def __init__(self, priority, start, finish):
+        self.priority = priority
+        self.start = start
+        self.finish = finish
+        self.event = threading.Event()
+        self.enqueued = time.time()
+
+
+class InferenceScheduler:
+    def __init__(self, weights: Optional[Dict[str, float]] = None, window: int = 200):
+        """
+        Args:
+            weights: Per-client fair-share weights (default 1.0)
+            window: Samples in the rolling queue-time statistics
+        """
+        self.weights = weights or {}
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._busy = False
+        self._virtual = {name: 0.0 for name in PRIORITIES}
+        self._client_finish: Dict[tuple, float] = {}
+        self._waiting = {name: 0 for name in PRIORITIES}
+        self._served = {name: 0 for name in PRIORITIES}
+        self._queue_time = {name: StageMeter(window) for name in PRIORITIES}
+        # Live requests waiting or running, visible to job worker processes
+        self.live_requests = multiprocessing.get_context("spawn").Value("i", 0)
+
+    def acquire(self, priority: str = "interactive", client: Optional[str] = None, cost: float = 1.0):
+        """Block until the caller may use the model. Returns the time spent queued (seconds)."""
+        if priority not in _RANK:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        if priority != "bulk":
+            with self.live_requests.get_lock():
+                self.live_requests.value += 1
+
+        with self._cond:
+            key = (priority, client)
+            start = max(self._virtual[priority], self._client_finish.get(key, 0.0))
+            finish = start + cost / self.weights.get(client, 1.0)
+            self._client_finish[key] = finish
+            ticket = _Ticket(priority, start, finish)
+            if not self._busy and not self._heap:
+                self._grant(ticket)
+            else:
+                heapq.heappush(self._heap, (_RANK[priority], finish, next(self._seq), ticket))
+                self._waiting[priority] += 1
+        ticket.event.wait()
+        return time.time() - ticket.enqueued
+
+    def _grant(self, ticket: _Ticket):
+        # Called with the condition held
+        self._busy = True
+        self._virtual[ticket.priority] = ticket.start
+        self._served[ticket.priority] += 1
+        self._queue_time[ticket.priority].add(time.time() - ticket.enqueued)
+        ticket.event.set()
+
+    def release(self, priority: str = "interactive"):
+        """Hand the model to the next waiting request, if any."""
+        with self._cond:
+            if self._heap:
+                ticket = heapq.heappop(self._heap)[3]
+                self._waiting[ticket.priority] -= 1
+                self._grant(ticket)
+            else:
+                self._busy = False
+                # Forget finish tags once idle so they can't grow without bound
+                self._client_finish.clear()
+        if priority != "bulk":
+            with self.live_requests.get_lock():
+                self.live_requests.value -= 1
+
+    @contextmanager
+    def slot(self, priority: str = "interactive", client: Optional[str] = None, cost: float = 1.0):
+        """Hold the model for a block. Yields the time spent queued (seconds)."""
+        queue_time = self.acquire(priority, client, cost)
+        try:
+            yield queue_time
+        finally:
+            self.release(priority)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "busy": self._busy,
+                "live_requests": self.live_requests.value,
+                "classes": {
+                    name: {
+                        "waiting": self._waiting[name],
+                        "served": self._served[name],
+                        "queue_time": self._queue_time[name].snapshot(),
+                    }
+                    for name in PRIORITIES
+                },
+            }
+
+
+def wait_for_live_work(live_requests, max_pause: float, poll: float = 0.005) -> float:
+    """
+    Pause a bulk worker process while live requests are in flight.
+
+    Returns:
+        Seconds spent paused (at most `max_pause`, so bulk work can't stall forever)
+    """
+    if live_requests is None or live_requests.value <= 0:
+        return 0.0
+    t0 = time.time()
+    deadline = t0 + max_pause
+    while live_requests.value > 0 and time.time() < deadline:
+        time.sleep(poll)
+    return time.time() - t0
@@ -0,0 +1,153 @@
+"""
+Production launcher for the Waste Detection API.
+
+Loads the YOLO model once in a parent process, then forks N uvicorn workers
+that all accept on the same listening socket. The model weights are shared
+between workers copy-on-write, and each worker is pinned to its own slice of
+CPU cores with matching torch thread counts so workers don't oversubscribe.
+
+Usage:
+    python serve.py --workers 4 --port 8008
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+parser = argparse.ArgumentParser(description="Multi-worker Waste Detection API launcher")
+parser.add_argument('--host', default=os.getenv("HOST", "0.0.0.0"))
+parser.add_argument('--port', type=int, default=int(os.getenv("PORT", "8008")))
+parser.add_argument('--workers', type=int, default=int(os.getenv("API_WORKERS", "0")),
+                    help='Number of worker processes (default: one per 2 available cores)')
+parser.add_argument('--threads', type=int, default=0,
+                    help='torch intra-op threads per worker (default: cores per worker)')
+parser.add_argument('--no-affinity', action='store_true',
+                    help='Do not pin workers to disjoint CPU sets')
+
+
+def split_cores(cores, workers):
+    """Split the available CPU ids into `workers` contiguous, near-equal chunks."""
+    cores = sorted(cores)
+    chunks = []
+    base, extra = divmod(len(cores), workers)
+    start = 0
+    for i in range(workers):
+        size = base + (1 if i < extra else 0)
+        chunks.append(cores[start:start + size] or cores)
+        start += size
+    return chunks
+
+
+def configure_worker(cores, threads, pin):
+    """Pin the current process to `cores` and size torch's thread pools to match."""
+    if pin and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    intra_threads = threads or max(1, len(cores))
+    # torch is already imported by the parent, so OMP_NUM_THREADS/MKL_NUM_THREADS
+    # would be ignored here; size the pools through torch instead
+    import torch
+    torch.set_num_threads(intra_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Can only be set once per process, before any parallel work
+        pass
+    return intra_threads
+
+
+def run_worker(app_module, sock, index, cores, args):
+    intra_threads = configure_worker(cores, args.threads, not args.no_affinity)
+    print(f"Worker {index} (pid {os.getpid()}): cores={cores} torch_threads={intra_threads}")
+
+    config = uvicorn.Config(app_module.app, host=args.host, port=args.port, log_level="info")
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    os._exit(0)
+
+
+def main():
+    args = parser.parse_args()
+
+    # The API resolves model paths relative to its own directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+
+    if hasattr(os, "sched_getaffinity"):
+        available = list(os.sched_getaffinity(0))
+    else:
+        available = list(range(os.cpu_count() or 1))
+    workers = args.workers or max(1, len(available) // 2)
+    core_sets = split_cores(available, workers)
+
+    # Load the weights once, before forking. The parent must not run parallel
+    # torch ops (libgomp is not fork-safe), so inference and the TORCH_FAST_PATH
+    # fuse/channels_last step are left to the workers' startup.
+    import main as app_module
+    print(f"Loading model in parent (pid {os.getpid()})...")
+    app_module.load_model(optimize=False)
+
+    # Move everything allocated so far out of the GC's reach, so collections
+    # in the workers don't touch (and un-share) the parent's pages
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = {}
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            run_worker(app_module, sock, index, core_sets[index], args)
+        children[pid] = index
+
+    print(f"Starting {workers} workers on {args.host}:{args.port}")
+    for index in range(workers):
+        spawn(index)
+
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"Worker {index} (pid {pid}) exited with status {status}; restarting")
+        time.sleep(1)
+        spawn(index)
+
+    sock.close()
+    print("All workers stopped")
+
+
+if __name__ == "__main__":
+    main()
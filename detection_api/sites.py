@@ -0,0 +1,326 @@
+"""
+Per-site bin layouts and detection settings for the detection API.
+
+One deployment serves several sites (depots, buildings), each with its own
+bins. Requests pick a site with `site_id`; without one they use the default
+site. The site config (SITES_CONFIG) is JSON:
+
+    {
+      "default": "depot-north",
+      "sites": {
+        "depot-north": {
+          "resolution": [1280, 720],
+          "confidence_threshold": 0.5,
+          "model": "waste:v2",
+          "class_mapping": {"cardboard box": "paper", "can": "metal"},
+          "bins": {
+            "left": {"box": [0, 0, 426, 720], "accepts": ["paper", "cardboard"],
+                     "label": "Paper/Cardboard", "color": [0, 0, 255]},
+            "right": {"box": [854, 0, 1280, 720], "accepts": ["plastic", "metal", "glass"]}
+          }
+        }
+      }
+    }
+
+Bin boxes are in pixels of the site's `resolution` and are scaled to each
+frame size. A detection belongs to the first bin (in file order) it
+overlaps; it is correct if its waste type is in the bin's `accepts`.
+`class_mapping` overrides the waste type of model classes by name, `model`
+is the registry model used when a request doesn't name one, and
+`confidence_threshold` replaces CONFIDENCE_THRESHOLD. All keys but `bins`
+are optional. The built-in "default" site (the preset left/right zones)
+is always available unless the file defines a site of that name.
+
+The whole file is validated and compiled when it is loaded; a bad file is
+rejected and the sites already loaded stay in use. Scaled bin layouts and
+class mappings are cached per site, per frame size and per model.
+
+The file is re-read when its modification time changes (checked at most
+every `check_interval` seconds, by whichever request comes first) or on
+demand. Each site has its own lock and counters, so requests for different
+sites don't contend; counters carry over across reloads.
+"""
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class SiteStats:
+    """Request and disposal counters for one site."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.detections = 0
+        self.correct = 0
+        self.incorrect = 0
+        self.zones: Dict[str, int] = {}
+        self.waste_types: Dict[str, int] = {}
+
+    def record(self, detections: int, waste_type: Optional[str], is_correct: bool, zone: Optional[str]):
+        with self.lock:
+            self.requests += 1
+            self.detections += detections
+            if zone is None:
+                return
+            if is_correct:
+                self.correct += 1
+            else:
+                self.incorrect += 1
+            self.zones[zone] = self.zones.get(zone, 0) + 1
+            if waste_type:
+                self.waste_types[waste_type] = self.waste_types.get(waste_type, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            disposals = self.correct + self.incorrect
+            return {
+                "requests": self.requests,
+                "detections": self.detections,
+                "correct": self.correct,
+                "incorrect": self.incorrect,
+                "accuracy": self.correct / disposals if disposals else None,
+                "zones": dict(self.zones),
+                "waste_types": dict(self.waste_types),
+            }
+
+
+class Site:
+    """A validated site config, with its bin layouts and class mappings compiled on first use."""
+
+    def __init__(self, site_id: str, spec: Dict, stats: SiteStats, default_threshold: float,
+                 base_mapping: Callable[[Dict[int, str]], Dict[int, str]]):
+        """
+        Args:
+            spec: The site's entry in the config file
+            stats: Counters for this site id (shared with its previous versions)
+            default_threshold: Confidence threshold when the site doesn't set one
+            base_mapping: Maps a model's class names to waste types before the site's overrides
+        """
+        if not isinstance(spec, dict):
+            raise ValueError(f"site {site_id}: expected an object")
+        self.site_id = site_id
+        self.stats = stats
+        self.model: Optional[str] = spec.get("model")
+        self.confidence_threshold = float(spec.get("confidence_threshold", default_threshold))
+        if not 0 <= self.confidence_threshold <= 1:
+            raise ValueError(f"site {site_id}: confidence_threshold must be between 0 and 1")
+        resolution = spec.get("resolution", [1280, 720])
+        if len(resolution) != 2 or min(resolution) <= 0:
+            raise ValueError(f"site {site_id}: resolution must be [width, height]")
+        self.width, self.height = int(resolution[0]), int(resolution[1])
+        self.class_overrides = {str(k).lower(): str(v).lower() for k, v in spec.get("class_mapping", {}).items()}
+        self._base_mapping = base_mapping
+
+        bins = spec.get("bins")
+        if not isinstance(bins, dict) or not bins:
+            raise ValueError(f"site {site_id}: needs at least one bin")
+        self.bins: Dict[str, Dict] = {}
+        for name, bin_spec in bins.items():
+            if not isinstance(bin_spec, dict):
+                raise ValueError(f"site {site_id}, bin {name}: expected an object")
+            box = bin_spec.get("box")
+            if not isinstance(box, list) or len(box) != 4:
+                raise ValueError(f"site {site_id}, bin {name}: box must be [x1, y1, x2, y2]")
+            x1, y1, x2, y2 = (int(v) for v in box)
+            if x1 >= x2 or y1 >= y2:
+                raise ValueError(f"site {site_id}, bin {name}: box is empty")
+            color = tuple(int(c) for c in bin_spec.get("color", (255, 0, 0)))
+            if len(color) != 3:
+                raise ValueError(f"site {site_id}, bin {name}: color must be [b, g, r]")
+            accepts = bin_spec.get("accepts", [])
+            if not isinstance(accepts, list) or not all(isinstance(t, str) for t in accepts):
+                raise ValueError(f"site {site_id}, bin {name}: accepts must be a list of waste types")
+            self.bins[name] = {
+                "box": (x1, y1, x2, y2),
+                "correct_types": frozenset(t.lower() for t in accepts),
+                "label": str(bin_spec.get("label", name)),
+                "color": color,
+            }
+
+        self._layouts: Dict[Tuple[int, int], Tuple[Dict, tuple]] = {}
+        self._mappings: Dict[int, Tuple[Dict[int, str], Dict[int, str]]] = {}
+
+    def layout(self, width: int, height: int) -> Tuple[Dict, tuple]:
+        """
+        The site's bins scaled to a frame size (cached per size).
+
+        Returns:
+            (zones as {name: {"coordinates": [(x1, y1), (x2, y2)], "correct_types"}},
+             overlay zones for OverlayRenderer.draw_zones)
+        """
+        key = (width, height)
+        layout = self._layouts.get(key)
+        if layout is not None:
+            return layout
+        sx, sy = width / self.width, height / self.height
+        zones = {}
+        overlay = []
+        for name, b in self.bins.items():
+            x1, y1, x2, y2 = b["box"]
+            p1, p2 = (int(x1 * sx), int(y1 * sy)), (int(x2 * sx), int(y2 * sy))
+            zones[name] = {"coordinates": [p1, p2], "correct_types": b["correct_types"]}
+            overlay.append((p1, p2, b["color"], b["label"]))
+        if len(self._layouts) >= 16:
+            self._layouts.clear()
+        layout = self._layouts[key] = (zones, tuple(overlay))
+        return layout
+
+    def class_mapping(self, names: Dict[int, str]) -> Dict[int, str]:
+        """Waste type per class id of a model, with the site's overrides (cached per model)."""
+        cached = self._mappings.get(id(names))
+        if cached is not None and cached[0] is names:
+            return cached[1]
+        mapping = dict(self._base_mapping(names))
+        for idx, class_name in names.items():
+            override = self.class_overrides.get(class_name.lower())
+            if override:
+                mapping[idx] = override
+        if len(self._mappings) >= 16:
+            self._mappings.clear()
+        self._mappings[id(names)] = (names, mapping)
+        return mapping
+
+    def describe(self) -> Dict:
+        return {
+            "model": self.model,
+            "confidence_threshold": self.confidence_threshold,
+            "resolution": [self.width, self.height],
+            "class_mapping": self.class_overrides,
+            "bins": {
+                name: {"box": list(b["box"]), "accepts": sorted(b["correct_types"]), "label": b["label"]}
+                for name, b in self.bins.items()
+            },
+            "stats": self.stats.snapshot(),
+        }
+
+
+class SiteRegistry:
+    def __init__(self, default_spec: Dict, path: Optional[str] = None, check_interval: float = 5.0,
+                 default_threshold: float = 0.5,
+                 base_mapping: Callable[[Dict[int, str]], Dict[int, str]] = lambda names: {},
+                 validate_model: Optional[Callable[[str], object]] = None):
+        """
+        Args:
+            default_spec: Config of the built-in "default" site
+            path: Site config file (None: only the default site)
+            check_interval: Seconds between checks of the file's modification time (0: never)
+            default_threshold: Confidence threshold for sites that don't set one
+            base_mapping: Class id -> waste type mapping for a model's names, before site overrides
+            validate_model: Raises KeyError for an unknown model ref; sites naming one are rejected
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.default_threshold = default_threshold
+        self.base_mapping = base_mapping
+        self.validate_model = validate_model
+        self.default_spec = default_spec
+        self._stats: Dict[str, SiteStats] = {}
+        self._stats_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self.loaded_at = None
+        self.last_error = None
+        self.reloads = 0
+        # Replaced as a whole on reload; requests read it without locking
+        self._sites, self.default = self._compile({"sites": {}}), "default"
+
+    def _site_stats(self, site_id: str) -> SiteStats:
+        with self._stats_lock:
+            stats = self._stats.get(site_id)
+            if stats is None:
+                stats = self._stats[site_id] = SiteStats()
+            return stats
+
+    def _compile(self, config: Dict) -> Dict[str, Site]:
+        specs = config.get("sites")
+        if not isinstance(specs, dict):
+            raise ValueError("sites must be an object of site id -> site")
+        specs = {"default": self.default_spec, **specs}
+        sites = {}
+        for site_id, spec in specs.items():
+            site = Site(site_id, spec, self._site_stats(site_id), self.default_threshold, self.base_mapping)
+            if site.model and self.validate_model is not None:
+                try:
+                    self.validate_model(site.model)
+                except KeyError as e:
+                    raise ValueError(f"site {site_id}: {e.args[0] if e.args else e}")
+            sites[site_id] = site
+        return sites
+
+    def load(self) -> Dict:
+        """(Re)load the config file. Raises on a bad file, keeping the current sites."""
+        with self._reload_lock:
+            return self._load()
+
+    def _load(self) -> Dict:
+        if not self.path:
+            return self.describe()
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path) as f:
+                config = json.load(f)
+            sites = self._compile(config)
+            default = config.get("default", "default")
+            if default not in sites:
+                raise ValueError(f"default site {default} is not defined")
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            self.last_error = f"{self.path}: {e}"
+            raise ValueError(self.last_error)
+        self._sites, self.default = sites, default
+        self._mtime = mtime
+        self.loaded_at = time.time()
+        self.last_error = None
+        self.reloads += 1
+        print(f"Site config loaded: {self.path} ({len(sites)} sites)")
+        return self.describe()
+
+    def maybe_reload(self):
+        """Reload the file if it changed. Cheap; only one caller at a time looks at the file."""
+        if not self.path or not self.check_interval or time.monotonic() < self._next_check:
+            return
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        previous_error = self.last_error
+        try:
+            self._next_check = time.monotonic() + self.check_interval
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return
+            # A bad file is tried once, not on every check, until it changes again
+            self._mtime = mtime
+            self._load()
+        except OSError as e:
+            self.last_error = f"{self.path}: {e}"
+        except ValueError:
+            pass
+        finally:
+            self._reload_lock.release()
+        if self.last_error and self.last_error != previous_error:
+            print(f"Error reloading site config, keeping the current sites: {self.last_error}")
+
+    def get(self, site_id: Optional[str] = None) -> Site:
+        """A site by id (the default site for None). Raises KeyError for an unknown site."""
+        self.maybe_reload()
+        sites = self._sites
+        site = sites.get(site_id or self.default)
+        if site is None:
+            raise KeyError(f"Unknown site: {site_id}")
+        return site
+
+    def ids(self) -> List[str]:
+        return list(self._sites)
+
+    def describe(self) -> Dict:
+        sites = self._sites
+        return {
+            "path": self.path,
+            "default": self.default,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+            "sites": {site_id: site.describe() for site_id, site in sites.items()},
+        }
@@ -0,0 +1,151 @@
+"""
+Soak test for memory growth in a running API.
+
+Drives /detect with a steady load for hours, samples the server's RSS from
+/metrics, and exits non-zero if memory grew more than --max-growth-mb after
+the warm-up period. Growth is measured between the median of the first and
+last few post-warm-up samples, so single spikes don't fail the run. Run it
+against a single-worker server so every /metrics sample comes from the same
+process.
+
+Usage:
+    python soak_test.py --url http://localhost:8008 --images ../data/frames \
+        --duration 4 --max-growth-mb 100 --csv soak.csv
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import requests
+
+parser = argparse.ArgumentParser(description="Run /detect for hours and fail on memory growth")
+parser.add_argument('--url', default='http://localhost:8008')
+parser.add_argument('--images', default=None, help='Folder of images to cycle through (default: synthetic frames)')
+parser.add_argument('--duration', type=float, default=1.0, help='Hours to run')
+parser.add_argument('--clients', type=int, default=2, help='Concurrent clients')
+parser.add_argument('--rate', type=float, default=0.0, help='Total requests/s to aim for (0: as fast as possible)')
+parser.add_argument('--warmup', type=float, default=5.0, help='Minutes before the baseline is taken')
+parser.add_argument('--sample-interval', type=float, default=30.0, help='Seconds between memory samples')
+parser.add_argument('--max-growth-mb', type=float, default=100.0, help='Allowed RSS growth after warm-up')
+parser.add_argument('--csv', default=None, help='Write memory samples to this CSV file')
+
+IMG_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+WINDOW = 5  # Samples in the baseline/final medians
+
+
+def load_payloads(folder):
+    if folder:
+        paths = sorted(p for p in glob.glob(os.path.join(folder, '*')) if p.lower().endswith(IMG_EXTS))
+        payloads = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                payloads.append(f.read())
+        if payloads:
+            return payloads
+        print(f"No images found in {folder}, using synthetic frames")
+    rng = np.random.default_rng(0)
+    payloads = []
+    for width, height in ((1280, 720), (640, 480), (1920, 1080)):
+        frame = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        payloads.append(cv2.imencode('.jpg', frame)[1].tobytes())
+    return payloads
+
+
+def sample_memory(url):
+    metrics = requests.get(f"{url}/metrics", timeout=10).json()
+    return metrics["memory"]["rss_bytes"], metrics["stages"].get("total", {}).get("count", 0)
+
+
+def main():
+    args = parser.parse_args()
+    payloads = load_payloads(args.images)
+    stop_at = time.time() + args.duration * 3600
+    warm_until = time.time() + args.warmup * 60
+    counts = {"ok": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+    interval = args.clients / args.rate if args.rate > 0 else 0.0
+
+    def client(index):
+        session = requests.Session()
+        i = index
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                response = session.post(f"{args.url}/detect",
+                                         files={'file': ('frame.jpg', payloads[i % len(payloads)], 'image/jpeg')},
+                                         timeout=60)
+                ok = response.ok
+            except requests.RequestException:
+                ok = False
+            with lock:
+                counts["ok" if ok else "errors"] += 1
+            i += args.clients
+            if interval:
+                stop.wait(max(0.0, interval - (time.perf_counter() - t0)))
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(args.clients)]
+    for t in threads:
+        t.start()
+
+    samples = []
+    writer = None
+    csv_file = open(args.csv, 'w', newline='') if args.csv else None
+    if csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["elapsed_s", "rss_mb", "server_requests", "client_ok", "client_errors", "warm"])
+    started = time.time()
+    try:
+        while time.time() < stop_at:
+            try:
+                rss, served = sample_memory(args.url)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                print(f"Could not read /metrics: {e}")
+                rss = None
+            if rss is not None:
+                warm = time.time() >= warm_until
+                elapsed = time.time() - started
+                if warm:
+                    samples.append((elapsed, rss))
+                print(f"[{elapsed/60:7.1f} min] RSS {rss/1e6:8.1f} MB  requests ok {counts['ok']} "
+                      f"errors {counts['errors']}{'' if warm else '  (warming up)'}")
+                if writer:
+                    writer.writerow([f"{elapsed:.0f}", f"{rss/1e6:.1f}", served, counts["ok"], counts["errors"], int(warm)])
+                    csv_file.flush()
+            time.sleep(min(args.sample_interval, max(0.0, stop_at - time.time())))
+    except KeyboardInterrupt:
+        print("Interrupted; evaluating the samples so far")
+    finally:
+        stop.set()
+        if csv_file:
+            csv_file.close()
+
+    if len(samples) < 2 * WINDOW:
+        print(f"Only {len(samples)} post-warm-up samples; run longer or sample more often")
+        sys.exit(2)
+
+    baseline = float(np.median([rss for _, rss in samples[:WINDOW]]))
+    final = float(np.median([rss for _, rss in samples[-WINDOW:]]))
+    growth_mb = (final - baseline) / 1e6
+    t, rss = np.array(samples).T
+    slope_mb_per_hour = float(np.polyfit(t / 3600, rss / 1e6, 1)[0])
+
+    print("\n===== SOAK TEST =====")
+    print(f"Requests: {counts['ok']} ok, {counts['errors']} errors")
+    print(f"Baseline RSS: {baseline/1e6:.1f} MB  final RSS: {final/1e6:.1f} MB")
+    print(f"Growth: {growth_mb:+.1f} MB (limit {args.max_growth_mb:.0f} MB), trend {slope_mb_per_hour:+.1f} MB/hour")
+    if growth_mb > args.max_growth_mb:
+        print("FAIL: memory grew past the threshold. Run the server with MEMORY_TRACKING=1 and "
+              "check /admin/memory for the allocations that keep growing.")
+        sys.exit(1)
+    print("PASS")
+
+
+if __name__ == "__main__":
+    main()
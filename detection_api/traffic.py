@@ -0,0 +1,142 @@
+"""
+Capture of sampled /detect traffic for replay (see replay.py).
+
+Each captured request is appended to a single archive file as a small binary
+record: a fixed header (arrival time, metadata length, image length), the
+request metadata as JSON (detection zone, session, priority, model, site) and the
+uploaded image bytes unchanged, so the archive is about as large as the
+images themselves.
+
+Requests are sampled at CAPTURE_SAMPLE_RATE. Frames of a camera session are
+sampled together (all or none, by a hash of the session id), so replay keeps
+the bursts and pacing of the sessions it does include. Writing happens on a
+background thread; if the disk can't keep up, frames are dropped rather than
+delaying requests. Capture stops once the archive reaches its size limit.
+"""
+import json
+import os
+import queue
+import random
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, Optional, Tuple
+
+MAGIC = b"RCAP1\n"
+_HEADER = struct.Struct("<dII")  # arrival time, metadata length, image length
+
+
+class TrafficCapture:
+    def __init__(self, path: str, sample_rate: float = 1.0, max_bytes: int = 0, queue_size: int = 64):
+        """
+        Args:
+            path: Archive file; a new one is started if it doesn't exist, otherwise appended to
+            sample_rate: Fraction of requests (or sessions) to capture
+            max_bytes: Stop capturing once the archive is this large (0 for no limit)
+            queue_size: Requests buffered for the writer before new ones are dropped
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.captured = 0
+        self.dropped = 0
+        self._random = random.Random()
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self.bytes_written = self._file.tell()
+        self._thread = threading.Thread(target=self._write_loop, name="traffic-capture", daemon=True)
+        self._thread.start()
+
+    def _sampled(self, session_id: Optional[str]) -> bool:
+        if self.sample_rate >= 1:
+            return True
+        if session_id:
+            return zlib.crc32(session_id.encode()) % 10000 < self.sample_rate * 10000
+        return self._random.random() < self.sample_rate
+
+    @property
+    def full(self) -> bool:
+        return bool(self.max_bytes) and self.bytes_written >= self.max_bytes
+
+    def offer(self, arrival: float, contents: bytes, detection_zone: Optional[str] = None,
+              session_id: Optional[str] = None, priority: Optional[str] = None,
+              model_ref: Optional[str] = None, site_id: Optional[str] = None):
+        """Queue one request for capture if it is sampled. Never blocks."""
+        if self.full or not self._sampled(session_id):
+            return
+        meta = {"detection_zone": detection_zone, "session_id": session_id,
+                "priority": priority, "model": model_ref, "site_id": site_id}
+        try:
+            self._queue.put_nowait((arrival, meta, contents))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            arrival, meta, contents = item
+            if self.full:
+                continue
+            meta = json.dumps({k: v for k, v in meta.items() if v is not None}).encode()
+            try:
+                self._file.write(_HEADER.pack(arrival, len(meta), len(contents)))
+                self._file.write(meta)
+                self._file.write(contents)
+                self._file.flush()
+            except OSError as e:
+                print(f"Error writing traffic capture: {e}")
+                self.dropped += 1
+                continue
+            self.bytes_written += _HEADER.size + len(meta) + len(contents)
+            self.captured += 1
+            if self.full:
+                print(f"Traffic capture reached its size limit: {self.path}")
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._file.close()
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "sample_rate": self.sample_rate,
+            "captured": self.captured,
+            "dropped": self.dropped,
+            "bytes": self.bytes_written,
+            "full": self.full,
+        }
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, Dict, bytes]]:
+    """
+    Iterate over a capture archive in recording order.
+
+    Yields:
+        (arrival time, metadata, image bytes); a record cut off at the end of the
+        file (e.g. the server was killed mid-write) is ignored
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a traffic capture")
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            arrival, meta_len, data_len = _HEADER.unpack(header)
+            meta = f.read(meta_len)
+            data = f.read(data_len)
+            if len(meta) < meta_len or len(data) < data_len:
+                return
+            yield arrival, json.loads(meta), data
+
+
+def default_capture_path(folder: str) -> str:
+    """A new archive name in `folder`, stamped with the server start time and pid."""
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.rcap")
@@ -0,0 +1,107 @@
+"""
+Latency-budget-driven choice of inference resolution and model variant.
+
+The controller walks a ladder of operating points, from the most expensive
+(main model at the largest input size) to the cheapest (fallback model at the
+smallest size). It steps down when the smoothed inference latency goes over
+the budget and back up when there is clear headroom. Separate up/down
+thresholds plus a minimum number of samples between changes provide
+hysteresis, so it doesn't oscillate between two neighbouring points.
+"""
+import threading
+
+from telemetry import Ewma
+
+
+class OperatingPoint:
+    __slots__ = ("model", "imgsz")
+
+    def __init__(self, model, imgsz):
+        self.model = model
+        self.imgsz = imgsz
+
+    def to_dict(self):
+        return {"model": self.model, "imgsz": self.imgsz}
+
+    def __repr__(self):
+        return f"{self.model}@{self.imgsz}"
+
+
+def parse_sizes(value, default=(640, 480, 320)):
+    """Parse "640,480,320" into a tuple of ints, largest first."""
+    if not value:
+        return tuple(default)
+    return tuple(sorted((int(v) for v in str(value).split(',') if v.strip()), reverse=True))
+
+
+class AdaptiveController:
+    def __init__(self, budget_ms, sizes=(640, 480, 320), models=("main",),
+                 step_down=1.0, step_up=0.6, min_samples=15, alpha=0.2):
+        """
+        Args:
+            budget_ms: Inference latency budget in milliseconds (0 disables adaptation)
+            sizes: Input sizes to use, largest first
+            models: Model variant names, most accurate first (e.g. ("main", "fallback"))
+            step_down: Step to a cheaper point when latency > budget * step_down
+            step_up: Step to a more expensive point when latency < budget * step_up
+            min_samples: Samples to observe at a point before it can change again
+            alpha: EWMA smoothing factor for the latency estimate
+        """
+        self.budget = budget_ms / 1000.0
+        self.ladder = [OperatingPoint(m, s) for m in models for s in sizes]
+        self.step_down = step_down
+        self.step_up = step_up
+        self.min_samples = min_samples
+        self.alpha = alpha
+
+        self._index = 0
+        self._latency = Ewma(alpha)
+        self._samples = 0
+        self._lock = threading.Lock()
+        self.changes = 0
+
+    @property
+    def enabled(self):
+        return self.budget > 0
+
+    @property
+    def current(self):
+        return self.ladder[self._index]
+
+    def observe(self, latency):
+        """
+        Feed one inference latency (seconds) measured at the current point.
+
+        Returns:
+            The operating point to use next
+        """
+        with self._lock:
+            if not self.enabled:
+                return self.ladder[self._index]
+            self._latency.add(latency)
+            self._samples += 1
+            if self._samples >= self.min_samples:
+                smoothed = self._latency.value
+                if smoothed > self.budget * self.step_down and self._index < len(self.ladder) - 1:
+                    self._move(1)
+                elif smoothed < self.budget * self.step_up and self._index > 0:
+                    self._move(-1)
+            return self.ladder[self._index]
+
+    def _move(self, step):
+        previous = self.ladder[self._index]
+        self._index += step
+        self._latency = Ewma(self.alpha)
+        self._samples = 0
+        self.changes += 1
+        print(f"Adaptive inference: {previous} -> {self.ladder[self._index]} "
+              f"(budget {self.budget*1000:.0f} ms)")
+
+    def describe(self):
+        return {
+            "enabled": self.enabled,
+            "budget_ms": self.budget * 1000,
+            "operating_point": self.current.to_dict(),
+            "smoothed_latency_ms": (self._latency.value or 0.0) * 1000,
+            "changes": self.changes,
+        }
@@ -0,0 +1,89 @@
+"""
+Two-stage model cascade: a cheap detector on every frame, the heavy model only when needed.
+
+Stage 1 (a small model) runs on every frame. Its result is used as-is when it
+finds nothing, or when every detection is clearly above or below the
+confidence threshold. The heavy model (stage 2) runs only when a stage-1
+detection falls in the ambiguous band around the threshold, or when the
+caller's conflict check flags the stage-1 result (e.g. the top waste type
+doesn't belong in the zone it was seen in).
+
+Stage-1 results are returned as-is, so both models must be trained on the
+same classes (e.g. a nano and a medium variant of the same waste model); a
+COCO model as stage 1 would report COCO classes as waste types.
+"""
+import threading
+
+import numpy as np
+
+
+class ModelCascade:
+    def __init__(self, fast_model, heavy_model, threshold=0.5, band=0.15, min_conf=0.25):
+        """
+        Args:
+            fast_model: Stage-1 model run on every frame
+            heavy_model: Default stage-2 model
+            threshold: The confidence threshold decisions are made at
+            band: Stage-1 confidences within threshold +/- band are ambiguous
+            min_conf: Stage-1 detections below this are ignored
+        """
+        self.fast_model = fast_model
+        self.heavy_model = heavy_model
+        self.threshold = threshold
+        self.band = band
+        self.min_conf = min_conf
+        self._lock = threading.Lock()
+        self.counts = {"empty": 0, "confident": 0, "ambiguous": 0, "conflict": 0}
+
+    def compatible(self, model):
+        """True if `model` predicts the same classes as stage 1, so their results are interchangeable."""
+        return dict(model.names) == dict(self.fast_model.names)
+
+    def predict(self, img, imgsz=None, heavy_model=None, conflict_check=None, threshold=None):
+        """
+        Run the cascade on one image.
+
+        Args:
+            img: BGR image
+            imgsz: Optional model input size, used for both stages
+            heavy_model: Overrides the default stage-2 model for this call
+            conflict_check: Optional callable(result, names) -> bool; True escalates to stage 2
+            threshold: Overrides the confidence threshold for this call (e.g. a site's)
+
+        Returns:
+            (result, model that produced it, {"stage": 1 or 2, "reason": str})
+        """
+        kwargs = {"imgsz": imgsz} if imgsz else {}
+        first = self.fast_model(img, conf=self.min_conf, verbose=False, **kwargs)[0]
+        confs = first.boxes.conf.cpu().numpy() if len(first.boxes) else np.empty(0)
+
+        if confs.size == 0:
+            reason = "empty"
+        elif np.any(np.abs(confs - (self.threshold if threshold is None else threshold)) <= self.band):
+            reason = "ambiguous"
+        elif conflict_check is not None and conflict_check(first, self.fast_model.names):
+            reason = "conflict"
+        else:
+            reason = "confident"
+
+        with self._lock:
+            self.counts[reason] += 1
+
+        if reason in ("empty", "confident"):
+            return first, self.fast_model, {"stage": 1, "reason": reason}
+
+        heavy = heavy_model or self.heavy_model
+        second = heavy(img, **kwargs)[0]
+        return second, heavy, {"stage": 2, "reason": reason}
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        stage1 = counts["empty"] + counts["confident"]
+        return {
+            "frames": total,
+            "counts": counts,
+            "stage1_hit_rate": stage1 / total if total else 0.0,
+            "stage2_rate": (total - stage1) / total if total else 0.0,
+        }
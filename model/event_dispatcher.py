@@ -0,0 +1,189 @@
+"""
+Non-blocking dispatcher for disposal-event side effects (sounds, webhooks, logs).
+
+The frame loop calls `dispatch()`, which only does a debounce/rate-limit check
+and a non-blocking queue put. A fixed pool of worker threads runs the sinks,
+so bursts of detections never create extra threads or stall inference; when
+the queue is full, events are dropped.
+"""
+import json
+import queue
+import threading
+import time
+
+try:
+    import simpleaudio
+except ImportError:
+    simpleaudio = None
+    try:
+        from playsound import playsound
+    except ImportError:
+        playsound = None
+
+
+class DisposalEvent:
+    __slots__ = ("kind", "zone", "class_name", "confidence", "timestamp")
+
+    def __init__(self, kind, zone, class_name, confidence, timestamp):
+        self.kind = kind
+        self.zone = zone
+        self.class_name = class_name
+        self.confidence = confidence
+        self.timestamp = timestamp
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "zone": self.zone,
+            "class_name": self.class_name,
+            "confidence": round(float(self.confidence), 4),
+            "timestamp": self.timestamp,
+        }
+
+
+class SoundSink:
+    """Plays one preloaded sound per event kind, e.g. {"correct": "sounds/correct_answer.wav"}."""
+
+    def __init__(self, sound_files):
+        self.sounds = {}
+        for kind, path in sound_files.items():
+            if simpleaudio is not None:
+                # Decode once; playback reuses the in-memory buffer
+                self.sounds[kind] = simpleaudio.WaveObject.from_wave_file(path)
+            else:
+                self.sounds[kind] = path
+        if simpleaudio is None:
+            if playsound is None:
+                print("Neither simpleaudio nor playsound is installed; sounds are disabled.")
+                self.sounds = {}
+            else:
+                print("simpleaudio not installed (pip install simpleaudio). "
+                      "Falling back to playsound, which reads the file on every event.")
+
+    def __call__(self, event):
+        sound = self.sounds.get(event.kind)
+        if sound is None:
+            return
+        if simpleaudio is not None:
+            sound.play()
+        else:
+            playsound(sound)
+
+
+class WebhookSink:
+    """POSTs each event as JSON to a URL."""
+
+    def __init__(self, url, timeout=2.0):
+        import requests
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def __call__(self, event):
+        self.session.post(self.url, json=event.to_dict(), timeout=self.timeout)
+
+
+class LogSink:
+    """Appends each event as a JSON line to a local file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event.to_dict()) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+
+
+class EventDispatcher:
+    def __init__(self, workers=2, max_queue=64, debounce=2.0, max_per_minute=None):
+        """
+        Args:
+            workers: Number of threads running the sinks
+            max_queue: Events allowed to wait for a worker before dropping
+            debounce: Minimum seconds between events with the same (kind, zone, class)
+            max_per_minute: Optional cap on events per (kind, zone, class) per minute
+        """
+        self.debounce = debounce
+        self.max_per_minute = max_per_minute
+        self._sinks = []
+        self._last_sent = {}
+        self._window = {}  # key -> (window_start, count)
+        self._queue = queue.Queue(maxsize=max_queue)
+
+        self.dispatched = 0
+        self.suppressed = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._workers = [
+            threading.Thread(target=self._worker_loop, name=f"event-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def add_sink(self, sink, kinds=None):
+        """Register a callable run for every event, or only for the given kinds."""
+        self._sinks.append((sink, set(kinds) if kinds else None))
+
+    def dispatch(self, kind, zone, class_name, confidence=0.0):
+        """
+        Queue an event for the sinks without blocking.
+
+        Returns:
+            True if the event was queued, False if it was debounced, rate
+            limited or dropped because the workers are behind.
+        """
+        now = time.time()
+        key = (kind, zone, class_name)
+
+        if now - self._last_sent.get(key, 0.0) < self.debounce:
+            self.suppressed += 1
+            return False
+
+        if self.max_per_minute:
+            window_start, count = self._window.get(key, (now, 0))
+            if now - window_start >= 60:
+                window_start, count = now, 0
+            if count >= self.max_per_minute:
+                self.suppressed += 1
+                return False
+            self._window[key] = (window_start, count + 1)
+
+        event = DisposalEvent(kind, zone, class_name, confidence, now)
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        self._last_sent[key] = now
+        self.dispatched += 1
+        return True
+
+    def close(self, timeout=2.0):
+        """Stop the workers once the queued events have been handled."""
+        for _ in self._workers:
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                break
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _worker_loop(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            for sink, kinds in self._sinks:
+                if kinds is not None and event.kind not in kinds:
+                    continue
+                try:
+                    sink(event)
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Event sink {type(sink).__name__} failed: {e}")
@@ -0,0 +1,131 @@
+"""
+Event-triggered clip recorder for the detection scripts.
+
+Keeps the last few seconds of frames in memory and only writes a clip to disk
+when a detection event fires: the pre-roll from the ring buffer, then frames
+until the post-roll runs out (extended by further events, up to a maximum clip
+length so an item left in view cannot grow one clip forever). Writing happens on
+a background thread fed by a bounded queue; if the disk falls behind, frames
+are dropped instead of stalling the inference loop.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+
+_OPEN, _FRAME, _CLOSE, _STOP = range(4)
+
+
+class EventClipRecorder:
+    def __init__(self, output_dir, fps, size, pre_seconds=3.0, post_seconds=3.0,
+                 max_seconds=30.0, max_queue=120, fourcc='MJPG'):
+        """
+        Args:
+            output_dir: Folder the clips are written to
+            fps: Frame rate written into the clip files
+            size: (width, height) of the frames being recorded
+            pre_seconds: Seconds of footage kept before an event
+            post_seconds: Seconds recorded after the last event of a clip
+            max_seconds: Longest clip written; the clip is closed once it
+                reaches this length, even if events keep extending it
+            max_queue: Frames allowed to wait for the writer before dropping
+            fourcc: Codec for cv2.VideoWriter
+        """
+        self.output_dir = output_dir
+        self.fps = fps
+        self.size = size
+        self.max_queue = max_queue
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+
+        self._ring = deque(maxlen=max(1, int(pre_seconds * fps)))
+        self._post_frames = max(1, int(post_seconds * fps))
+        self._max_frames = max(self._ring.maxlen + 1, int(max_seconds * fps))
+        self._frames_left = 0  # > 0 while a clip is open
+        self._clip_frames = 0  # frames queued for the open clip
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+        self.clips_written = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+
+        os.makedirs(output_dir, exist_ok=True)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer_loop, name="clip-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def recording(self):
+        return self._frames_left > 0
+
+    def add_frame(self, frame):
+        """Feed the newest frame. Cheap unless a clip is currently open."""
+        if self._frames_left > 0:
+            self._enqueue_frame(frame)
+            self._clip_frames += 1
+            self._frames_left -= 1
+            if self._clip_frames >= self._max_frames:
+                self._frames_left = 0
+            if self._frames_left == 0:
+                self._queue.put((_CLOSE, None))
+        else:
+            self._ring.append(frame)
+
+    def trigger(self, event_name):
+        """Start a clip (pre-roll included) or extend the one already open."""
+        if self._frames_left == 0:
+            stamp = time.strftime('%Y%m%d_%H%M%S')
+            path = os.path.join(self.output_dir, f'{stamp}_{event_name}.avi')
+            self._queue.put((_OPEN, path))
+            self._clip_frames = 0
+            while self._ring:
+                self._enqueue_frame(self._ring.popleft())
+                self._clip_frames += 1
+        self._frames_left = min(self._post_frames, self._max_frames - self._clip_frames)
+
+    def close(self):
+        """Finish any open clip and wait for the writer to drain."""
+        if self._frames_left > 0:
+            self._frames_left = 0
+            self._queue.put((_CLOSE, None))
+        self._queue.put((_STOP, None))
+        self._thread.join()
+
+    def _enqueue_frame(self, frame):
+        with self._pending_lock:
+            if self._pending >= self.max_queue:
+                self.frames_dropped += 1
+                return
+            self._pending += 1
+        self._queue.put((_FRAME, frame))
+
+    def _writer_loop(self):
+        writer = None
+        while True:
+            kind, item = self._queue.get()
+            if kind == _FRAME:
+                with self._pending_lock:
+                    self._pending -= 1
+                if writer is not None:
+                    if (item.shape[1], item.shape[0]) != self.size:
+                        item = cv2.resize(item, self.size)
+                    writer.write(item)
+                    self.frames_written += 1
+            elif kind == _OPEN:
+                if writer is not None:
+                    writer.release()
+                writer = cv2.VideoWriter(item, self.fourcc, self.fps, self.size)
+                print(f'Recording clip: {item}')
+            elif kind == _CLOSE:
+                if writer is not None:
+                    writer.release()
+                    writer = None
+                    self.clips_written += 1
+            elif kind == _STOP:
+                if writer is not None:
+                    writer.release()
+                    self.clips_written += 1
+                return
@@ -0,0 +1,176 @@
+"""
+Memory gauges and optional allocation tracking for long-running detectors.
+
+Gauges (always cheap): current and peak RSS, and torch allocator usage when a
+CUDA device is in use. With tracking enabled, MemoryMonitor also runs
+tracemalloc to measure the peak Python allocation of each request and to take
+periodic snapshots on a background thread (a snapshot and its diffs take long
+enough that no request should wait for one); each snapshot is diffed against
+the previous one and the first one, so the lines whose allocations keep
+growing stand out.
+
+tracemalloc slows allocation-heavy code down noticeably, so tracking is
+opt-in. Per-request peaks use tracemalloc's process-wide peak counter and are
+approximate when requests overlap.
+"""
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from telemetry import StageMeter
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes():
+    """Current resident set size in bytes, or None if it can't be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def torch_gauges():
+    """Torch allocator usage, if torch is loaded (it is never imported just for this)."""
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return None
+    gauges = {"num_threads": torch.get_num_threads()}
+    if torch.cuda.is_available():
+        gauges["cuda_allocated_bytes"] = torch.cuda.memory_allocated()
+        gauges["cuda_reserved_bytes"] = torch.cuda.memory_reserved()
+        gauges["cuda_peak_allocated_bytes"] = torch.cuda.max_memory_allocated()
+    return gauges
+
+
+def gauges():
+    return {
+        "rss_bytes": rss_bytes(),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "torch": torch_gauges(),
+    }
+
+
+def _diff(new, old, top):
+    stats = new.compare_to(old, "lineno")
+    return [
+        {
+            "location": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+            "size_bytes": s.size,
+            "size_diff_bytes": s.size_diff,
+            "count": s.count,
+            "count_diff": s.count_diff,
+        }
+        for s in stats[:top]
+    ]
+
+
+class MemoryMonitor:
+    def __init__(self, enabled=False, frames=10, snapshot_interval=300.0, top=20):
+        """
+        Args:
+            enabled: Run tracemalloc (per-request peaks and snapshot diffs)
+            frames: Traceback depth stored per allocation
+            snapshot_interval: Seconds between automatic snapshots
+            top: Lines reported per snapshot diff
+        """
+        self.enabled = enabled
+        self.frames = frames
+        self.snapshot_interval = snapshot_interval
+        self.top = top
+        self.request_peak = StageMeter()
+        self._lock = threading.Lock()
+        self._baseline = None
+        self._previous = None
+        self._diffs = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.snapshots = 0
+
+    def start(self):
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._baseline = self._previous = self._take()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._snapshot_loop, name="memory-snapshots", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextmanager
+    def track(self):
+        """Record the peak traced allocation above the starting level while the block runs."""
+        if not (self.enabled and tracemalloc.is_tracing()):
+            yield
+            return
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            with self._lock:
+                self.request_peak.add(max(0, peak - start))
+
+    def _take(self):
+        snapshot = tracemalloc.take_snapshot()
+        # Leave out tracemalloc's own bookkeeping
+        return snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def snapshot(self):
+        """Take a snapshot now and diff it against the previous and the first one."""
+        if not (self.enabled and tracemalloc.is_tracing()):
+            return None
+        current = self._take()
+        with self._lock:
+            self._diffs = {
+                "taken": time.time(),
+                "since_previous": _diff(current, self._previous, self.top),
+                "since_start": _diff(current, self._baseline, self.top),
+            }
+            self._previous = current
+            self.snapshots += 1
+            return self._diffs
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.snapshot_interval):
+            self.snapshot()
+
+    def report(self):
+        report = {"gauges": gauges(), "tracking": self.enabled and tracemalloc.is_tracing()}
+        if report["tracking"]:
+            current, peak = tracemalloc.get_traced_memory()
+            with self._lock:
+                report.update({
+                    "traced_bytes": current,
+                    "request_peak_bytes": self.request_peak.snapshot(),
+                    "snapshots": self.snapshots,
+                    "diffs": self._diffs,
+                })
+        return report
@@ -0,0 +1,207 @@
+"""
+Overlay rendering for detection results with cached zone layers and label layouts.
+
+Zone overlays (outlines plus their captions) don't change between frames of
+the same resolution, so they are rendered once per resolution into a layer
+and a mask, and composited onto each frame with a single masked cv2.copyTo.
+Where OpenCV antialiases text (5.x), a mask can't reproduce the caption
+edges, so only the outlines are cached and the captions are drawn per frame.
+
+Formatting each label and measuring it with cv2.getTextSize is repeated work
+for every box on every frame, even though the set of distinct labels is small.
+The renderer keeps one layout per (class, confidence bucket) - the label text,
+its size and the tag geometry - and draws boxes and labels with cv2 itself,
+so the output is identical to plain cv2 drawing.
+
+Labels are deliberately not cached as pixel sprites: compositing a sprite per
+box measured barely faster than cv2's own text drawing (about 1.1x for 50
+boxes) and did not reproduce its pixels exactly.
+
+Run this file directly for a micro-benchmark against plain cv2 drawing:
+    python overlay.py --boxes 50
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+class LabelLayout:
+    __slots__ = ("text", "width", "height", "baseline")
+
+    def __init__(self, text, width, height, baseline):
+        self.text = text
+        self.width = width
+        self.height = height
+        self.baseline = baseline
+
+
+class OverlayRenderer:
+    """
+    Draws detection boxes, labels and zone overlays with cached label layouts.
+
+    Args:
+        style: "filled" draws black text on a box-colored tag above the box (the
+            detection scripts' look); "text" draws colored text only (the API's look)
+        font_scale: Label font scale
+        thickness: Label text thickness
+        conf_step: Confidence bucket size in percent; labels show the bucket value
+        max_labels: Layout cache size before it is cleared
+    """
+
+    def __init__(self, style="filled", font_scale=0.5, thickness=1, conf_step=1, max_labels=4096):
+        self.style = style
+        self.font_scale = font_scale
+        self.thickness = thickness
+        self.conf_step = conf_step
+        self.max_labels = max_labels
+        self._layouts = {}
+        self._zone_layers = {}
+
+    def label_layout(self, class_name, conf):
+        pct = int(conf * 100) // self.conf_step * self.conf_step
+        key = (class_name, pct)
+        layout = self._layouts.get(key)
+        if layout is None:
+            if len(self._layouts) >= self.max_labels:
+                self._layouts.clear()
+            text = f'{class_name}: {pct}%'
+            (w, h), baseline = cv2.getTextSize(text, FONT, self.font_scale, self.thickness)
+            layout = self._layouts[key] = LabelLayout(text, w, h, baseline)
+        return layout
+
+    def draw_detection(self, frame, xyxy, class_name, conf, color):
+        """Draw one box and its label."""
+        xmin, ymin, xmax, ymax = [int(v) for v in xyxy]
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, 2)
+        layout = self.label_layout(class_name, conf)
+        if self.style == "filled":
+            # Same geometry as the scripts' tag, kept inside the frame like label_ymin
+            label_ymin = max(ymin, layout.height + 10)
+            cv2.rectangle(frame, (xmin, label_ymin - layout.height - 10),
+                          (xmin + layout.width, label_ymin + layout.baseline - 10), color, cv2.FILLED)
+            cv2.putText(frame, layout.text, (xmin, label_ymin - 7), FONT,
+                        self.font_scale, (0, 0, 0), self.thickness)
+        else:
+            cv2.putText(frame, layout.text, (xmin, ymin - 10), FONT,
+                        self.font_scale, color, self.thickness)
+
+    def zone_layer(self, width, height, zones):
+        """
+        Pre-rendered zone overlay for one resolution.
+
+        Args:
+            zones: Tuple of ((x1, y1), (x2, y2), color, caption) entries
+
+        Returns:
+            (BGR layer, mask of the pixels it covers, captions to draw per frame as
+             (origin, color, caption) - empty unless text is antialiased)
+        """
+        key = (width, height, zones)
+        layer = self._zone_layers.get(key)
+        if layer is None:
+            captions = tuple(((x1 + 10, y1 + 30), color, caption)
+                             for (x1, y1), _, color, caption in zones if caption)
+            coverage = np.zeros((height, width), dtype=np.uint8)
+            for origin, _, caption in captions:
+                cv2.putText(coverage, caption, origin, FONT, 1, 255, 2)
+            bake_captions = not ((coverage > 0) & (coverage < 255)).any()
+
+            canvas = np.zeros((height, width, 3), dtype=np.uint8)
+            mask = np.zeros((height, width), dtype=np.uint8)
+            for (x1, y1), (x2, y2), color, caption in zones:
+                for target, value in ((canvas, color), (mask, 255)):
+                    cv2.rectangle(target, (x1, y1), (x2, y2), value, 2)
+                    if caption and bake_captions:
+                        cv2.putText(target, caption, (x1 + 10, y1 + 30), FONT, 1, value, 2)
+            if len(self._zone_layers) >= 16:
+                self._zone_layers.clear()
+            layer = self._zone_layers[key] = (canvas, mask, () if bake_captions else captions)
+        return layer
+
+    def draw_zones(self, frame, zones):
+        """Composite the cached zone overlay for this frame's resolution with one masked copy."""
+        height, width = frame.shape[:2]
+        canvas, mask, captions = self.zone_layer(width, height, zones)
+        cv2.copyTo(canvas, mask, frame)
+        for origin, color, caption in captions:
+            cv2.putText(frame, caption, origin, FONT, 1, color, 2)
+
+
+def _draw_zones_uncached(frame, zones):
+    for (x1, y1), (x2, y2), color, caption in zones:
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, caption, (x1 + 10, y1 + 30), FONT, 1, color, 2)
+
+
+def _draw_uncached(frame, boxes):
+    for xyxy, class_name, conf, color in boxes:
+        xmin, ymin, xmax, ymax = xyxy
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, 2)
+        label = f'{class_name}: {int(conf*100)}%'
+        labelSize, baseLine = cv2.getTextSize(label, FONT, 0.5, 1)
+        label_ymin = max(ymin, labelSize[1] + 10)
+        cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), color, cv2.FILLED)
+        cv2.putText(frame, label, (xmin, label_ymin-7), FONT, 0.5, (0, 0, 0), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cached vs. uncached overlay rendering")
+    parser.add_argument('--boxes', type=int, default=50)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--resolution', default='1280x720')
+    args = parser.parse_args()
+
+    width, height = [int(v) for v in args.resolution.split('x')]
+    rng = np.random.default_rng(0)
+    names = ['glass', 'metal', 'paper', 'plastic']
+    colors = [(164,120,87), (68,148,228), (93,97,209), (178,182,133)]
+    frames_boxes = []
+    for _ in range(args.frames):
+        boxes = []
+        for _ in range(args.boxes):
+            x, y = int(rng.integers(0, width - 100)), int(rng.integers(0, height - 100))
+            cls = int(rng.integers(0, 4))
+            boxes.append(((x, y, x + 80, y + 80), names[cls], float(rng.uniform(0.5, 1.0)), colors[cls]))
+        frames_boxes.append(boxes)
+    base = np.zeros((height, width, 3), dtype=np.uint8)
+
+    t0 = time.perf_counter()
+    for boxes in frames_boxes:
+        _draw_uncached(base.copy(), boxes)
+    uncached = (time.perf_counter() - t0) / args.frames
+
+    renderer = OverlayRenderer()
+    t0 = time.perf_counter()
+    for boxes in frames_boxes:
+        frame = base.copy()
+        for xyxy, class_name, conf, color in boxes:
+            renderer.draw_detection(frame, xyxy, class_name, conf, color)
+    cached = (time.perf_counter() - t0) / args.frames
+
+    print(f"{args.boxes} boxes at {width}x{height}, {args.frames} frames")
+    print(f"cv2 getTextSize/putText: {uncached*1000:.3f} ms/frame")
+    print(f"Cached layouts:          {cached*1000:.3f} ms/frame ({uncached/cached:.2f}x)")
+
+    third = width // 3
+    zones = (((0, 0), (third, height), (0, 0, 255), "Paper/Cardboard"),
+             ((width - third, 0), (width, height), (255, 0, 0), "Plastic/Metal/Glass"))
+    frame = base.copy()
+    t0 = time.perf_counter()
+    for _ in range(args.frames):
+        _draw_zones_uncached(frame, zones)
+    uncached = (time.perf_counter() - t0) / args.frames
+    renderer.draw_zones(frame, zones)
+    t0 = time.perf_counter()
+    for _ in range(args.frames):
+        renderer.draw_zones(frame, zones)
+    cached = (time.perf_counter() - t0) / args.frames
+    print(f"Zones, cv2 drawing:      {uncached*1000:.3f} ms/frame")
+    print(f"Zones, cached layer:     {cached*1000:.3f} ms/frame ({uncached/cached:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
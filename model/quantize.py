@@ -0,0 +1,391 @@
+"""
+INT8 post-training quantization of a YOLO .pt model, with an accuracy gate.
+
+Calibrates on a folder of our own captured frames (the same images the
+`folder` source of yolo_detect.py reads), writes an INT8 OpenVINO or ONNX
+model, and validates it against the FP32 model on held-out frames:
+
+- fidelity: mAP50 and mAP50-95 of the INT8 detections, scored against the
+  FP32 detections as if they were labels (no annotation needed)
+- per-class agreement at the serving confidence threshold: how many boxes of
+  each class both models find (F1 of matched boxes, IoU >= 0.5)
+- mAP against real labels for both models, when a YOLO-format label folder
+  is given
+- latency of the FP32 .pt model and of the INT8 model, and the speedup
+
+The report is saved next to the artifact. The API only serves the artifact
+(QUANTIZED_MODEL_PATH) if its report passed the gate and was made from the
+current MODEL_PATH file.
+
+Usage:
+    python quantize.py --model my_model.pt --frames ../data/frames --format openvino
+    python quantize.py --model my_model.pt --frames ../data/frames --holdout ../data/val \
+        --labels ../data/val_labels --format onnx
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+IMG_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz  # Renamed in NumPy 2
+
+
+def list_frames(folder):
+    """Images in a folder, in name order."""
+    return sorted(p for p in glob.glob(os.path.join(folder, '*')) if p.lower().endswith(IMG_EXTS))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def report_path(artifact):
+    """Where the report of an artifact (OpenVINO folder or .onnx file) is kept."""
+    artifact = artifact.rstrip('/\\')
+    if os.path.isdir(artifact):
+        return os.path.join(artifact, 'quantization_report.json')
+    return os.path.splitext(artifact)[0] + '.quantization.json'
+
+
+def check_gate(artifact, source_model=None):
+    """
+    Whether an INT8 artifact may be served.
+
+    Args:
+        source_model: The FP32 model it must have been quantized from (checked by hash)
+
+    Returns:
+        (ok, reason)
+    """
+    path = report_path(artifact)
+    if not os.path.exists(artifact) or not os.path.exists(path):
+        return False, f"no quantization report for {artifact}"
+    with open(path) as f:
+        report = json.load(f)
+    if not report.get("passed"):
+        return False, "failed the accuracy gate: " + "; ".join(report.get("gate", {}).get("failures", []))
+    if source_model and os.path.exists(source_model) and report["source"]["sha256"] != file_sha256(source_model):
+        return False, f"quantized from a different model than {source_model}"
+    return True, f"passed the accuracy gate, {report['speedup']:.2f}x faster than FP32"
+
+
+def letterbox(img, imgsz):
+    """Square letterbox like Ultralytics' non-PyTorch predictors: (1, 3, S, S) float32 RGB in 0..1."""
+    h, w = img.shape[:2]
+    r = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    top, left = int(round((imgsz - new_h) / 2 - 0.1)), int(round((imgsz - new_w) / 2 - 0.1))
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    canvas[top:top + new_h, left:left + new_w] = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(canvas[..., ::-1].transpose(2, 0, 1))[None].astype(np.float32) / 255
+
+
+def head_name(yolo):
+    """Module path of the detection head, e.g. "model.22"."""
+    return f"model.{len(yolo.model.model) - 1}"
+
+
+def quantize_openvino(yolo, calib_paths, imgsz, out_dir):
+    """Export FP32 OpenVINO, then quantize it with NNCF (same preset and head exclusions as Ultralytics)."""
+    import nncf
+    import openvino as ov
+
+    fp32_dir = yolo.export(format="openvino", imgsz=imgsz, dynamic=True, half=False)
+    xml = glob.glob(os.path.join(fp32_dir, "*.xml"))[0]
+    ov_model = ov.Core().read_model(xml)
+    head = head_name(yolo)
+    # The box decoding in the head loses too much accuracy in INT8
+    ignored_scope = nncf.IgnoredScope(
+        patterns=[f".*{head}/.*/Add", f".*{head}/.*/Sub*", f".*{head}/.*/Mul*",
+                  f".*{head}/.*/Div*", f".*{head}\\.dfl.*"],
+        types=["Sigmoid"],
+        validate=False,
+    )
+    quantized = nncf.quantize(
+        ov_model,
+        nncf.Dataset(calib_paths, lambda path: letterbox(cv2.imread(path), imgsz)),
+        preset=nncf.QuantizationPreset.MIXED,
+        subset_size=len(calib_paths),
+        ignored_scope=ignored_scope,
+    )
+    os.makedirs(out_dir, exist_ok=True)
+    ov.save_model(quantized, os.path.join(out_dir, os.path.basename(xml)), compress_to_fp16=False)
+    # Ultralytics reads names, stride and imgsz from here
+    shutil.copy(os.path.join(fp32_dir, "metadata.yaml"), out_dir)
+    return out_dir
+
+
+def quantize_onnx(yolo, calib_paths, imgsz, out_path):
+    """Export FP32 ONNX, then quantize it statically (QDQ, per-channel weights) with ONNX Runtime."""
+    import onnx
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                          quantize_static)
+
+    fp32_path = yolo.export(format="onnx", imgsz=imgsz, dynamic=True, half=False)
+    fp32 = onnx.load(fp32_path)
+    input_name = fp32.graph.input[0].name
+    # The box decoding in the head loses too much accuracy in INT8 (as excluded by Ultralytics for OpenVINO)
+    head = f"/{head_name(yolo)}/"
+    excluded = [node.name for node in fp32.graph.node
+                if head in node.name and (node.op_type in ("Add", "Sub", "Mul", "Div", "Sigmoid") or "/dfl/" in node.name)]
+
+    class Frames(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(calib_paths)
+
+        def get_next(self):
+            path = next(self.paths, None)
+            return None if path is None else {input_name: letterbox(cv2.imread(path), imgsz)}
+
+    quantize_static(
+        fp32_path, out_path, Frames(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        calibrate_method=CalibrationMethod.MinMax,
+        nodes_to_exclude=excluded,
+    )
+    # Keep the Ultralytics metadata (names, stride, imgsz) so YOLO() can load the result
+    quantized = onnx.load(out_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(fp32.metadata_props)
+    onnx.save(quantized, out_path)
+    return out_path
+
+
+def predict_all(model, paths, imgsz, warmup=3):
+    """Run a model on every frame at a low threshold. Returns ([N x 6 arrays], seconds per frame)."""
+    for path in paths[:warmup]:
+        model(cv2.imread(path), imgsz=imgsz, conf=0.001, verbose=False)
+    detections, times = [], []
+    for path in paths:
+        img = cv2.imread(path)
+        t0 = time.perf_counter()
+        result = model(img, imgsz=imgsz, conf=0.001, verbose=False)[0]
+        times.append(time.perf_counter() - t0)
+        detections.append(result.boxes.data.cpu().numpy()[:, :6])  # x1, y1, x2, y2, conf, class
+    return detections, times
+
+
+def load_labels(label_dir, path, shape):
+    """YOLO-format labels of a frame (class cx cy w h, normalized) as N x 5 [x1, y1, x2, y2, class]."""
+    label_path = os.path.join(label_dir, os.path.splitext(os.path.basename(path))[0] + '.txt')
+    if not os.path.exists(label_path):
+        return np.zeros((0, 5))
+    rows = np.loadtxt(label_path, ndmin=2)
+    if not rows.size:
+        return np.zeros((0, 5))
+    h, w = shape[:2]
+    cx, cy, bw, bh = rows[:, 1] * w, rows[:, 2] * h, rows[:, 3] * w, rows[:, 4] * h
+    return np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2, rows[:, 0]], axis=1)
+
+
+def box_iou(a, b):
+    """Pairwise IoU of N x 4 and M x 4 xyxy boxes."""
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    inter = np.clip(br - tl, 0, None).prod(axis=2)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-7)
+
+
+def match(pred, truth):
+    """Correct matrix (predictions x IoU thresholds), matched greedily by IoU like Ultralytics' validator."""
+    correct = np.zeros((len(pred), len(IOU_THRESHOLDS)), dtype=bool)
+    if not len(pred) or not len(truth):
+        return correct
+    iou = box_iou(truth[:, :4], pred[:, :4]) * (truth[:, 4][:, None] == pred[:, 5][None, :])
+    for i, threshold in enumerate(IOU_THRESHOLDS):
+        matches = np.argwhere(iou >= threshold)
+        if not len(matches):
+            continue
+        matches = matches[iou[matches[:, 0], matches[:, 1]].argsort()[::-1]]
+        matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+        matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+        correct[matches[:, 1], i] = True
+    return correct
+
+
+def compute_ap(recall, precision):
+    """Area under the precision envelope, COCO 101-point interpolation."""
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return float(_trapezoid(np.interp(x, mrec, mpre), x))
+
+
+def mean_ap(preds, truths):
+    """mAP50 and mAP50-95 of predictions (N x 6) against truths (M x 5) over all frames."""
+    correct = np.concatenate([match(p, t) for p, t in zip(preds, truths)]) if preds else np.zeros((0, 10), bool)
+    conf = np.concatenate([p[:, 4] for p in preds]) if preds else np.zeros(0)
+    pred_cls = np.concatenate([p[:, 5] for p in preds]) if preds else np.zeros(0)
+    target_cls = np.concatenate([t[:, 4] for t in truths]) if truths else np.zeros(0)
+    order = np.argsort(-conf)
+    correct, pred_cls = correct[order], pred_cls[order]
+    ap = []
+    for c in np.unique(target_cls):
+        n_labels = int((target_cls == c).sum())
+        tp = correct[pred_cls == c]
+        if not len(tp):
+            ap.append(np.zeros(len(IOU_THRESHOLDS)))
+            continue
+        tpc = tp.cumsum(0)
+        fpc = (1 - tp).cumsum(0)
+        recall = tpc / n_labels
+        precision = tpc / (tpc + fpc)
+        ap.append([compute_ap(recall[:, j], precision[:, j]) for j in range(len(IOU_THRESHOLDS))])
+    ap = np.array(ap) if ap else np.zeros((1, len(IOU_THRESHOLDS)))
+    return {"map50": float(ap[:, 0].mean()), "map50_95": float(ap.mean())}
+
+
+def class_agreement(reference, candidate, names, conf):
+    """Per class, boxes above `conf` found by each model and by both (same class, IoU >= 0.5)."""
+    stats = {}
+    for ref, cand in zip(reference, candidate):
+        ref, cand = ref[ref[:, 4] >= conf], cand[cand[:, 4] >= conf]
+        matched = match(cand, ref[:, [0, 1, 2, 3, 5]])[:, 0]
+        for cls in np.unique(np.concatenate([ref[:, 5], cand[:, 5]])):
+            s = stats.setdefault(names[int(cls)], {"fp32": 0, "int8": 0, "matched": 0})
+            s["fp32"] += int((ref[:, 5] == cls).sum())
+            s["int8"] += int((cand[:, 5] == cls).sum())
+            s["matched"] += int(matched[cand[:, 5] == cls].sum())
+    for s in stats.values():
+        s["agreement"] = 2 * s["matched"] / (s["fp32"] + s["int8"]) if s["fp32"] + s["int8"] else 1.0
+    return stats
+
+
+def latency(times):
+    return {"mean_ms": float(np.mean(times) * 1000), "p95_ms": float(np.percentile(times, 95) * 1000)}
+
+
+def main():
+    from ultralytics import YOLO
+
+    parser = argparse.ArgumentParser(description="Quantize a YOLO .pt model to INT8 and validate it")
+    parser.add_argument('--model', required=True, help='FP32 YOLO .pt model')
+    parser.add_argument('--frames', required=True, help='Folder of captured frames for calibration')
+    parser.add_argument('--holdout', default=None,
+                        help='Folder of held-out frames for validation (default: every --holdout-every-th frame of --frames)')
+    parser.add_argument('--holdout-every', type=int, default=5)
+    parser.add_argument('--labels', default=None, help='YOLO-format labels of the held-out frames, to also report true mAP')
+    parser.add_argument('--format', choices=('openvino', 'onnx'), default='openvino')
+    parser.add_argument('--out', default=None, help='Artifact path (default: next to the model)')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--calib-frames', type=int, default=300, help='Most frames used for calibration')
+    parser.add_argument('--conf', type=float, default=0.5, help='Serving confidence threshold for per-class agreement')
+    parser.add_argument('--min-fidelity', type=float, default=0.95, help='Minimum mAP50 of INT8 scored against FP32')
+    parser.add_argument('--min-class-agreement', type=float, default=0.9)
+    parser.add_argument('--min-class-support', type=int, default=10,
+                        help='Classes with fewer FP32 boxes than this are reported but not gated')
+    parser.add_argument('--max-map-drop', type=float, default=0.01, help='Largest allowed mAP50-95 drop vs. labels')
+    args = parser.parse_args()
+
+    frames = list_frames(args.frames)
+    if args.holdout:
+        calib, holdout = frames, list_frames(args.holdout)
+    else:
+        holdout = frames[::args.holdout_every]
+        calib = [p for i, p in enumerate(frames) if i % args.holdout_every]
+    if not calib or not holdout:
+        print(f"Need calibration and held-out frames; found {len(calib)} and {len(holdout)}")
+        sys.exit(2)
+    # Spread the calibration subset over the whole folder, not just its first frames
+    step = max(1, len(calib) // args.calib_frames)
+    calib = calib[::step][:args.calib_frames]
+
+    stem = os.path.splitext(args.model)[0]
+    print(f"Quantizing {args.model} to INT8 {args.format} with {len(calib)} calibration frames")
+    fp32 = YOLO(args.model)
+    if args.format == 'openvino':
+        artifact = quantize_openvino(YOLO(args.model), calib, args.imgsz, args.out or f"{stem}_int8_openvino_model")
+    else:
+        artifact = quantize_onnx(YOLO(args.model), calib, args.imgsz, args.out or f"{stem}_int8.onnx")
+    int8 = YOLO(artifact, task="detect")
+
+    print(f"Validating on {len(holdout)} held-out frames")
+    ref, fp32_times = predict_all(fp32, holdout, args.imgsz)
+    cand, int8_times = predict_all(int8, holdout, args.imgsz)
+    names = fp32.names
+
+    # FP32 detections above the serving threshold stand in for labels
+    pseudo = [r[r[:, 4] >= args.conf][:, [0, 1, 2, 3, 5]] for r in ref]
+    fidelity = mean_ap(cand, pseudo)
+    agreement = class_agreement(ref, cand, names, args.conf)
+    ground_truth = None
+    if args.labels:
+        truths = [load_labels(args.labels, p, cv2.imread(p).shape) for p in holdout]
+        ground_truth = {"fp32": mean_ap(ref, truths), "int8": mean_ap(cand, truths)}
+    speedup = float(np.mean(fp32_times) / np.mean(int8_times))
+
+    failures = []
+    if fidelity["map50"] < args.min_fidelity:
+        failures.append(f"mAP50 vs FP32 {fidelity['map50']:.3f} < {args.min_fidelity}")
+    for name, s in agreement.items():
+        if s["fp32"] >= args.min_class_support and s["agreement"] < args.min_class_agreement:
+            failures.append(f"{name} agreement {s['agreement']:.3f} < {args.min_class_agreement}")
+    if ground_truth:
+        drop = ground_truth["fp32"]["map50_95"] - ground_truth["int8"]["map50_95"]
+        if drop > args.max_map_drop:
+            failures.append(f"mAP50-95 drop {drop:.3f} > {args.max_map_drop}")
+
+    report = {
+        "created": datetime.now().isoformat(),
+        "source": {"path": os.path.abspath(args.model), "sha256": file_sha256(args.model)},
+        "artifact": os.path.abspath(artifact),
+        "format": args.format,
+        "imgsz": args.imgsz,
+        "calibration_frames": len(calib),
+        "holdout_frames": len(holdout),
+        "fidelity": fidelity,
+        "ground_truth": ground_truth,
+        "class_agreement": agreement,
+        "latency": {"fp32": latency(fp32_times), "int8": latency(int8_times)},
+        "speedup": speedup,
+        "gate": {
+            "min_fidelity": args.min_fidelity,
+            "min_class_agreement": args.min_class_agreement,
+            "min_class_support": args.min_class_support,
+            "max_map_drop": args.max_map_drop if args.labels else None,
+            "failures": failures,
+        },
+        "passed": not failures,
+    }
+    with open(report_path(artifact), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print("\n===== INT8 QUANTIZATION =====")
+    print(f"Artifact: {artifact}")
+    print(f"Fidelity vs FP32: mAP50 {fidelity['map50']:.3f}  mAP50-95 {fidelity['map50_95']:.3f}")
+    if ground_truth:
+        print(f"mAP50-95 vs labels: FP32 {ground_truth['fp32']['map50_95']:.3f}  "
+              f"INT8 {ground_truth['int8']['map50_95']:.3f}")
+    for name, s in sorted(agreement.items()):
+        print(f"  {name:<16} FP32 {s['fp32']:5d}  INT8 {s['int8']:5d}  matched {s['matched']:5d}  "
+              f"agreement {s['agreement']:.3f}")
+    print(f"Latency: FP32 {report['latency']['fp32']['mean_ms']:.1f} ms  "
+          f"INT8 {report['latency']['int8']['mean_ms']:.1f} ms  speedup {speedup:.2f}x")
+    if failures:
+        print("FAILED the accuracy gate: " + "; ".join(failures))
+        sys.exit(1)
+    print(f"PASSED the accuracy gate. Serve it with QUANTIZED_MODEL_PATH={artifact}")
+
+
+if __name__ == "__main__":
+    main()
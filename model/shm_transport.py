@@ -0,0 +1,210 @@
+"""
+Shared-memory ring buffer of raw BGR frames for co-located capture and detection.
+
+A capture process (`yolo_detect.py --shm_publish NAME`) writes frames into a
+`multiprocessing.shared_memory` block and the detection API reads them back as
+NumPy views, with no JPEG encode/decode, HTTP or copy in between.
+
+Layout of the block:
+    header   int64[8]         magic, slots, max_height, max_width, latest_seq,
+                              writer_pid, closed, reserved
+    meta     int64[slots, 4]  seq, height, width, timestamp_ns per slot
+    data     uint8[slots, max_height * max_width * 3]
+
+The writer fills slot `seq % slots`, then publishes the slot's metadata and
+finally `latest_seq`. Readers take the newest slot as a view and call
+`still_valid()` after using it: if the writer has lapped the ring and reused
+the slot in the meantime, the frame must be discarded. When no new frame is
+waiting, readers also check that the writer is still there (not closed, same
+pid, process alive) and raise `WriterGoneError` otherwise, so they can
+reattach to the block a restarted writer creates.
+"""
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+MAGIC = 0x57415354455348  # "WASTESH"
+HEADER_WORDS = 8
+META_WORDS = 4
+_LATEST, _PID, _CLOSED = 4, 5, 6
+
+
+class WriterGoneError(RuntimeError):
+    """The writer closed the ring, or its process died or was replaced."""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        pass
+    return True
+
+
+def _layout(slots, max_height, max_width):
+    header_bytes = HEADER_WORDS * 8
+    meta_bytes = slots * META_WORDS * 8
+    slot_bytes = max_height * max_width * 3
+    return header_bytes, meta_bytes, slot_bytes, header_bytes + meta_bytes + slots * slot_bytes
+
+
+class SharedFrameRing:
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        if header[0] != MAGIC:
+            raise ValueError(f"Shared memory block {shm.name} is not a frame ring")
+        self.slots = int(header[1])
+        self.max_height = int(header[2])
+        self.max_width = int(header[3])
+        header_bytes, meta_bytes, slot_bytes, _ = _layout(self.slots, self.max_height, self.max_width)
+        self._header = header
+        self._meta = np.ndarray((self.slots, META_WORDS), dtype=np.int64, buffer=shm.buf, offset=header_bytes)
+        self._data = np.ndarray((self.slots, slot_bytes), dtype=np.uint8, buffer=shm.buf,
+                                offset=header_bytes + meta_bytes)
+        self._seq = int(header[_LATEST])
+        self.writer_pid = int(header[_PID])
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @classmethod
+    def create(cls, name, max_width, max_height, slots=4):
+        """
+        Create a ring (writer side). Replaces a stale block left by a crashed writer.
+
+        Raises:
+            FileExistsError: Another live writer is publishing under this name
+        """
+        size = _layout(slots, max_height, max_width)[3]
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            owner = 0
+            if stale.size >= HEADER_WORDS * 8:
+                header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=stale.buf)
+                if header[0] == MAGIC and not header[_CLOSED]:
+                    owner = int(header[_PID])
+                del header
+            if owner and owner != os.getpid() and _pid_alive(owner):
+                # Opening it registered the block with our resource tracker; don't let
+                # it unlink the live writer's block when this process exits
+                try:
+                    resource_tracker.unregister(stale._name, "shared_memory")
+                except Exception:
+                    pass
+                stale.close()
+                raise FileExistsError(f"Shared memory block {name} is in use by writer pid {owner}")
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[1:4] = (slots, max_height, max_width)
+        header[_PID] = os.getpid()
+        header[0] = MAGIC
+        ring = cls(shm, owner=True)
+        ring._meta[:] = -1
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to an existing ring (reader side)."""
+        shm = shared_memory.SharedMemory(name=name)
+        # Readers must not unlink the writer's block when they exit
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return cls(shm, owner=False)
+
+    def write(self, frame):
+        """Publish a BGR frame. Returns its sequence number."""
+        height, width = frame.shape[:2]
+        if height > self.max_height or width > self.max_width or frame.ndim != 3:
+            raise ValueError(f"Frame {width}x{height} does not fit the {self.max_width}x{self.max_height} ring")
+        seq = self._seq + 1
+        slot = seq % self.slots
+        meta = self._meta[slot]
+        meta[0] = -1  # Mark the slot as being written
+        n = height * width * 3
+        np.copyto(self._data[slot, :n].reshape(height, width, 3), frame)
+        meta[1], meta[2], meta[3] = height, width, time.time_ns()
+        meta[0] = seq
+        self._header[_LATEST] = seq
+        self._seq = seq
+        return seq
+
+    @property
+    def latest_seq(self):
+        return int(self._header[_LATEST])
+
+    @property
+    def closed(self):
+        return bool(self._header[_CLOSED])
+
+    def check_writer(self):
+        """Raise WriterGoneError if the writer closed the ring, or its process died or changed."""
+        if self.closed:
+            raise WriterGoneError(f"closed {self.name}")
+        pid = int(self._header[_PID])
+        if pid != self.writer_pid:
+            raise WriterGoneError(f"of {self.name} changed from pid {self.writer_pid} to {pid}")
+        if not _pid_alive(pid):
+            raise WriterGoneError(f"of {self.name} (pid {pid}) is gone")
+
+    def read_latest(self, after_seq=0):
+        """
+        Newest frame as a read-only view, if one newer than `after_seq` exists.
+
+        Returns:
+            (seq, frame view, timestamp_ns) or None
+
+        Raises:
+            WriterGoneError: No newer frame and the writer is gone (readers only)
+        """
+        seq = self.latest_seq
+        if seq <= after_seq:
+            if not self._owner:
+                self.check_writer()
+            return None
+        slot = seq % self.slots
+        meta = self._meta[slot]
+        if meta[0] != seq:
+            return None
+        height, width, ts = int(meta[1]), int(meta[2]), int(meta[3])
+        view = self._data[slot, :height * width * 3].reshape(height, width, 3)
+        view.flags.writeable = False
+        return seq, view, ts
+
+    def still_valid(self, seq):
+        """True if the slot holding `seq` has not been overwritten since it was read."""
+        return int(self._meta[seq % self.slots][0]) == seq
+
+    def wait_for_frame(self, after_seq, timeout=1.0, poll=0.001):
+        """Poll until a frame newer than `after_seq` arrives, or return None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            frame = self.read_latest(after_seq)
+            if frame is not None:
+                return frame
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+    def close(self):
+        """Detach; the writer also marks the ring closed and removes the block."""
+        if self._owner:
+            self._header[_CLOSED] = 1
+        del self._header, self._meta, self._data
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
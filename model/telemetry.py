@@ -0,0 +1,224 @@
+"""
+Constant-cost performance telemetry shared by the detection scripts and the API.
+
+Every stage (decode, inference, frame, ...) keeps a ring-buffer rolling mean,
+an EWMA and P-square streaming percentile estimates. Recording a sample is
+O(1) regardless of window size, and snapshots can be served by the API or
+appended to a JSONL file.
+"""
+import json
+import threading
+import time
+
+
+class RollingMean:
+    """Mean of the last `window` samples, kept with a ring buffer and running sum."""
+
+    def __init__(self, window):
+        self.window = window
+        self._buf = [0.0] * window
+        self._idx = 0
+        self._count = 0
+        self._sum = 0.0
+
+    def add(self, x):
+        if self._count == self.window:
+            self._sum -= self._buf[self._idx]
+        else:
+            self._count += 1
+        self._buf[self._idx] = x
+        self._sum += x
+        self._idx += 1
+        if self._idx == self.window:
+            self._idx = 0
+            # Re-sum once per lap so floating point error can't accumulate
+            self._sum = sum(self._buf[:self._count])
+
+    @property
+    def value(self):
+        return self._sum / self._count if self._count else 0.0
+
+
+class Ewma:
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.value = None
+
+    def add(self, x):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+
+
+class P2Quantile:
+    """
+    P-square streaming quantile estimate (Jain & Chlamtac, 1985).
+
+    Tracks a single quantile with five markers: O(1) memory and time per sample.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.n = 0
+        self._q = []
+        self._pos = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self._inc = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self._q
+        if self.n < 5:
+            q.append(x)
+            self.n += 1
+            if self.n == 5:
+                q.sort()
+            return
+        self.n += 1
+
+        # Find the cell containing x, stretching the extremes if needed
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        pos = self._pos
+        for i in range(k + 1, 5):
+            pos[i] += 1
+        for i in range(5):
+            self._desired[i] += self._inc[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self._desired[i] - pos[i]
+            if (d >= 1 and pos[i + 1] - pos[i] > 1) or (d <= -1 and pos[i - 1] - pos[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = self._parabolic(i, d)
+                if q[i - 1] < candidate < q[i + 1]:
+                    q[i] = candidate
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (pos[i + d] - pos[i])
+                pos[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self._q, self._pos
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    @property
+    def value(self):
+        if self.n == 0:
+            return 0.0
+        if self.n < 5:
+            ordered = sorted(self._q)
+            return ordered[int(round(self.p * (self.n - 1)))]
+        return self._q[2]
+
+
+class StageMeter:
+    """All the rolling statistics kept for one pipeline stage."""
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window=200, alpha=0.1):
+        self.count = 0
+        self.last = 0.0
+        self.rolling = RollingMean(window)
+        self.ewma = Ewma(alpha)
+        self.quantiles = [P2Quantile(p) for p in self.QUANTILES]
+
+    def add(self, x):
+        self.count += 1
+        self.last = x
+        self.rolling.add(x)
+        self.ewma.add(x)
+        for quantile in self.quantiles:
+            quantile.add(x)
+
+    @property
+    def mean(self):
+        return self.rolling.value
+
+    def snapshot(self):
+        snap = {
+            "count": self.count,
+            "last": self.last,
+            "mean": self.rolling.value,
+            "ewma": self.ewma.value or 0.0,
+        }
+        for p, quantile in zip(self.QUANTILES, self.quantiles):
+            snap[f"p{int(p * 100)}"] = quantile.value
+        return snap
+
+
+class PerfMeter:
+    """
+    Per-stage timing statistics.
+
+    Args:
+        window: Number of samples in each stage's rolling mean
+        alpha: EWMA smoothing factor
+    """
+
+    def __init__(self, window=200, alpha=0.1):
+        self.window = window
+        self.alpha = alpha
+        self.started = time.time()
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._last_export = 0.0
+
+    def record(self, stage, seconds):
+        with self._lock:
+            meter = self._stages.get(stage)
+            if meter is None:
+                meter = self._stages[stage] = StageMeter(self.window, self.alpha)
+            meter.add(seconds)
+
+    def __getitem__(self, stage):
+        return self._stages[stage]
+
+    def __contains__(self, stage):
+        return stage in self._stages
+
+    def mean(self, stage):
+        meter = self._stages.get(stage)
+        return meter.mean if meter else 0.0
+
+    def rate(self, stage):
+        """Events per second implied by the rolling mean duration of `stage`."""
+        mean = self.mean(stage)
+        return 1.0 / mean if mean > 0 else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "uptime": time.time() - self.started,
+                "stages": {name: meter.snapshot() for name, meter in self._stages.items()},
+            }
+
+    def export_jsonl(self, path):
+        """Append the current snapshot to a JSON lines file."""
+        line = json.dumps(self.snapshot()) + "\n"
+        with open(path, "a") as f:
+            f.write(line)
+
+    def maybe_export(self, path, interval):
+        """Export to `path` if at least `interval` seconds passed since the last export."""
+        if not path:
+            return False
+        now = time.time()
+        if now - self._last_export < interval:
+            return False
+        self._last_export = now
+        self.export_jsonl(path)
+        return True
@@ -0,0 +1,162 @@
+"""
+Tiled inference for wide-angle and high-resolution frames.
+
+Shrinking a 2560x1440 frame to a 640 model input makes small items vanish.
+TiledDetector instead cuts the frame into overlapping model-sized tiles, runs
+them (plus, optionally, the whole frame for items larger than a tile) through
+the model as one batch, shifts each tile's boxes back to frame coordinates
+and merges duplicates across tiles with class-aware NMS.
+
+The tile grid depends only on the frame size, so it is computed once per
+resolution and cached, as is the subset of tiles that intersect the
+configured zones: tiles outside every zone are never run, so the cost grows
+with the area that matters rather than with the camera resolution.
+
+Boxes cut by a tile edge overlap the full box from the neighbouring tile far
+more than they overlap it by IoU, so duplicates are found by intersection
+over the smaller box (IoS), as in SAHI.
+"""
+import threading
+
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+
+def tile_grid(width, height, tile, overlap):
+    """Overlapping tile x tile windows covering a frame, as a K x 4 array of x1, y1, x2, y2."""
+    def starts(length):
+        if length <= tile:
+            return [0]
+        step = max(1, int(tile * (1 - overlap)))
+        positions = list(range(0, length - tile, step))
+        return positions + [length - tile]  # The last tile is flush with the edge
+
+    return np.array([(x, y, min(x + tile, width), min(y + tile, height))
+                     for y in starts(height) for x in starts(width)], dtype=np.int32)
+
+
+def merge_detections(dets, threshold):
+    """
+    Class-aware greedy NMS by intersection over the smaller box.
+
+    Args:
+        dets: N x 6 array of x1, y1, x2, y2, conf, class
+    """
+    if len(dets) < 2:
+        return dets
+    dets = dets[np.argsort(-dets[:, 4])]
+    area = (dets[:, 2] - dets[:, 0]) * (dets[:, 3] - dets[:, 1])
+    keep = np.ones(len(dets), dtype=bool)
+    for i in range(len(dets)):
+        if not keep[i]:
+            continue
+        rest = np.nonzero(keep[i + 1:] & (dets[i + 1:, 5] == dets[i, 5]))[0] + i + 1
+        if not len(rest):
+            continue
+        w = np.clip(np.minimum(dets[i, 2], dets[rest, 2]) - np.maximum(dets[i, 0], dets[rest, 0]), 0, None)
+        h = np.clip(np.minimum(dets[i, 3], dets[rest, 3]) - np.maximum(dets[i, 1], dets[rest, 1]), 0, None)
+        ios = w * h / np.maximum(np.minimum(area[i], area[rest]), 1e-7)
+        keep[rest[ios >= threshold]] = False
+    return dets[keep]
+
+
+class TiledDetector:
+    def __init__(self, tile_size=640, overlap=0.2, min_size=1600, full_frame=True, merge_threshold=0.5):
+        """
+        Args:
+            tile_size: Tile width and height in frame pixels
+            overlap: Fraction of a tile shared with its neighbour
+            min_size: Frames whose longer side is below this are run whole, without tiling
+            full_frame: Also run the whole (downscaled) frame in the batch, for items larger than a tile
+            merge_threshold: Same-class boxes overlapping by at least this IoS are duplicates
+        """
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.min_size = min_size
+        self.full_frame = full_frame
+        self.merge_threshold = merge_threshold
+        self._grids = {}
+        self._selected = {}
+        self._lock = threading.Lock()
+        self.counts = {"frames": 0, "tiles": 0, "tiles_skipped": 0}
+
+    def applies(self, img):
+        return max(img.shape[:2]) >= self.min_size
+
+    def tiles(self, width, height, zones=None):
+        """
+        Tiles to run for a frame size: the cached grid, minus tiles outside every zone.
+
+        Returns:
+            (tiles to run, number of tiles in the grid)
+        """
+        zones = tuple(tuple(int(v) for v in zone) for zone in zones) if zones else None
+        key = (width, height, zones)
+        with self._lock:
+            selected = self._selected.get(key)
+            if selected is not None:
+                return selected
+            grid = self._grids.get((width, height))
+            if grid is None:
+                if len(self._grids) >= 16:
+                    self._grids.clear()
+                grid = self._grids[(width, height)] = tile_grid(width, height, self.tile_size, self.overlap)
+            if zones:
+                z = np.array(zones)
+                inside = ((grid[:, None, 0] < z[None, :, 2]) & (grid[:, None, 2] > z[None, :, 0]) &
+                          (grid[:, None, 1] < z[None, :, 3]) & (grid[:, None, 3] > z[None, :, 1])).any(axis=1)
+                tiles = grid[inside]
+            else:
+                tiles = grid
+            if len(self._selected) >= 64:
+                self._selected.clear()
+            selected = self._selected[key] = (tiles, len(grid))
+            return selected
+
+    def predict(self, model, img, zones=None, imgsz=None, **kwargs):
+        """
+        Detect objects in a large BGR frame.
+
+        Args:
+            model: YOLO model (or FastTorchPredictor); called once with all tiles as a batch
+            zones: Optional (x1, y1, x2, y2) regions in frame pixels; tiles outside all of them are skipped
+            imgsz: Model input size for each tile (default: the tile size)
+
+        Returns:
+            Results for the whole frame, like a single model call
+        """
+        h, w = img.shape[:2]
+        tiles, total = self.tiles(w, h, zones)
+        # Tiles are views into the frame, not copies
+        inputs = [img[y1:y2, x1:x2] for x1, y1, x2, y2 in tiles]
+        if self.full_frame or not inputs:
+            inputs.append(img)
+        results = model(inputs, imgsz=imgsz or self.tile_size, verbose=False, **kwargs)
+
+        dets = []
+        for i, result in enumerate(results):
+            d = result.boxes.data.cpu().numpy()[:, :6].copy()
+            if i < len(tiles):
+                d[:, [0, 2]] += tiles[i][0]
+                d[:, [1, 3]] += tiles[i][1]
+            dets.append(d)
+        merged = merge_detections(np.concatenate(dets) if dets else np.zeros((0, 6), np.float32), self.merge_threshold)
+
+        with self._lock:
+            self.counts["frames"] += 1
+            self.counts["tiles"] += len(tiles)
+            self.counts["tiles_skipped"] += total - len(tiles)
+        return Results(img, path="", names=model.names, boxes=torch.from_numpy(np.ascontiguousarray(merged)))
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        frames = counts["frames"]
+        considered = counts["tiles"] + counts["tiles_skipped"]
+        return {
+            **counts,
+            "tiles_per_frame": counts["tiles"] / frames if frames else 0.0,
+            "skip_rate": counts["tiles_skipped"] / considered if considered else 0.0,
+            "cached_resolutions": len(self._grids),
+        }
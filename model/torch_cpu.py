@@ -0,0 +1,231 @@
+"""
+Tuned PyTorch CPU inference for YOLO .pt models.
+
+Calling an Ultralytics YOLO object goes through its generic predictor: it
+re-reads arguments, builds a LetterBox, stacks/transposes/copies the image
+and allocates a fresh input tensor on every call. FastTorchPredictor keeps
+everything that doesn't change between frames:
+
+- the network, with Conv+BN fused, in eval mode and channels_last layout,
+  optionally wrapped in torch.compile
+- one preallocated input tensor (and padded letterbox canvas) per input shape,
+  refilled in place for each frame; a list of frames runs as one batch
+- inference under torch.inference_mode
+
+Preprocessing and postprocessing match Ultralytics (same letterbox geometry,
+NMS and box scaling), and results are returned as Ultralytics Results, so it
+is a drop-in replacement for `model(img, imgsz=...)` and `model([img, ...], imgsz=...)`.
+
+Run this file directly to compare it with the plain call on the same frames:
+    python torch_cpu.py --model my_model.pt --images ../data/frames
+"""
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+
+try:
+    from ultralytics.utils.nms import non_max_suppression
+except ImportError:
+    from ultralytics.utils.ops import non_max_suppression
+from ultralytics.engine.results import Results
+from ultralytics.utils import ops
+
+
+class _InputBuffer:
+    """Letterbox geometry plus reusable RGB canvas and tensor for one (frame shape, imgsz)."""
+
+    def __init__(self, frame_shape, imgsz, stride, channels_last, auto=True):
+        h, w = frame_shape[:2]
+        r = min(imgsz / h, imgsz / w)
+        self.new_w, self.new_h = int(round(w * r)), int(round(h * r))
+        dw, dh = imgsz - self.new_w, imgsz - self.new_h
+        if auto:
+            # Minimum rectangle padded to the stride, like LetterBox(auto=True)
+            dw, dh = dw % stride, dh % stride
+        dw, dh = dw / 2, dh / 2
+        self.top, self.left = int(round(dh - 0.1)), int(round(dw - 0.1))
+        bottom, right = int(round(dh + 0.1)), int(round(dw + 0.1))
+        self.height = self.new_h + self.top + bottom
+        self.width = self.new_w + self.left + right
+        self.canvas = np.full((self.height, self.width, 3), 114, dtype=np.uint8)
+        self.tensor = torch.zeros((1, 3, self.height, self.width), dtype=torch.float32)
+        if channels_last:
+            self.tensor = self.tensor.contiguous(memory_format=torch.channels_last)
+
+    def fill(self, frame, out=None):
+        """
+        Letterbox a BGR frame into the canvas and copy it into the input tensor as RGB 0..1.
+
+        Args:
+            out: (3, H, W) tensor to write to instead, e.g. one image of a batch
+        """
+        if (frame.shape[1], frame.shape[0]) != (self.new_w, self.new_h):
+            frame = cv2.resize(frame, (self.new_w, self.new_h), interpolation=cv2.INTER_LINEAR)
+        # BGR -> RGB while writing into the canvas, so no extra copy is needed for it
+        self.canvas[self.top:self.top + self.new_h, self.left:self.left + self.new_w] = frame[..., ::-1]
+        # HWC uint8 -> CHW float in place; channels_last makes this a straight strided copy
+        target = self.tensor[0] if out is None else out
+        target.copy_(torch.from_numpy(self.canvas).permute(2, 0, 1))
+        target.mul_(1 / 255)
+        return self.tensor if out is None else out
+
+
+class FastTorchPredictor:
+    def __init__(self, yolo, imgsz=640, conf=0.25, iou=0.7, max_det=300,
+                 channels_last=True, compile=False):
+        """
+        Args:
+            yolo: Loaded Ultralytics YOLO object backed by a PyTorch (.pt) model
+            imgsz: Default input size
+            conf, iou, max_det: NMS settings (Ultralytics predict defaults)
+            channels_last: Run the network in channels_last memory format
+            compile: Wrap the network with torch.compile (slow first calls per input shape)
+        """
+        if not self.supported(yolo):
+            raise ValueError("FastTorchPredictor needs a PyTorch detection model")
+        self.yolo = yolo
+        self.names = yolo.names
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+        self.channels_last = channels_last
+
+        net = yolo.model
+        net = net.fuse(verbose=False) if hasattr(net, "fuse") else net
+        net = net.float().eval()
+        for p in net.parameters():
+            p.requires_grad_(False)
+        if channels_last:
+            net = net.to(memory_format=torch.channels_last)
+        self.model = net  # Unwrapped network, e.g. for measuring parameter memory
+        self.stride = max(int(net.stride.max()), 32) if hasattr(net, "stride") else 32
+        self._forward = net
+        if compile:
+            try:
+                self._forward = torch.compile(net)
+            except Exception as e:
+                print(f"torch.compile unavailable, running eagerly: {e}")
+        self._buffers = {}
+        self._batch = None  # Input tensor reused across batches of the same size
+
+    @staticmethod
+    def supported(yolo):
+        net = getattr(yolo, "model", None)
+        # End-to-end heads (no NMS) produce a different output layout
+        return isinstance(net, torch.nn.Module) and getattr(yolo, "task", "detect") == "detect" \
+            and not getattr(net, "end2end", False)
+
+    def _buffer(self, frame_shape, imgsz, auto=True):
+        key = (frame_shape[:2], imgsz, auto)
+        buf = self._buffers.get(key)
+        if buf is None:
+            if len(self._buffers) >= 8:
+                self._buffers.clear()
+            buf = self._buffers[key] = _InputBuffer(frame_shape, imgsz, self.stride, self.channels_last, auto)
+        return buf
+
+    def _batch_tensor(self, n, height, width):
+        if self._batch is None or tuple(self._batch.shape) != (n, 3, height, width):
+            self._batch = torch.zeros((n, 3, height, width), dtype=torch.float32)
+            if self.channels_last:
+                self._batch = self._batch.contiguous(memory_format=torch.channels_last)
+        return self._batch
+
+    def __call__(self, img, imgsz=None, conf=None, verbose=False, **kwargs):
+        """
+        Detect objects in a BGR image, or a list of them as one batch. Not thread-safe:
+        input buffers are reused.
+
+        Returns:
+            [Results] (one per image), like calling the YOLO object
+        """
+        size = imgsz or self.imgsz
+        # Same rounding as Ultralytics' check_imgsz
+        size = max(int(np.ceil(size / self.stride) * self.stride), self.stride)
+        imgs = img if isinstance(img, (list, tuple)) else [img]
+        if not imgs:
+            return []
+        # Like Ultralytics, only same-shape batches get the minimum-rectangle letterbox
+        auto = len({im.shape for im in imgs}) == 1
+        bufs = [self._buffer(im.shape, size, auto) for im in imgs]
+        with torch.inference_mode():
+            if len(imgs) == 1:
+                x = bufs[0].fill(imgs[0])
+            else:
+                x = self._batch_tensor(len(imgs), bufs[0].height, bufs[0].width)
+                for i, (buf, im) in enumerate(zip(bufs, imgs)):
+                    buf.fill(im, out=x[i])
+            preds = self._forward(x)
+            preds = preds[0] if isinstance(preds, (list, tuple)) else preds
+            dets = non_max_suppression(preds, conf if conf is not None else self.conf, self.iou,
+                                       max_det=self.max_det)
+            for det, buf, im in zip(dets, bufs, imgs):
+                det[:, :4] = ops.scale_boxes((buf.height, buf.width), det[:, :4], im.shape)
+        return [Results(im, path="", names=self.names, boxes=det) for det, im in zip(dets, imgs)]
+
+
+IMG_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def main():
+    from ultralytics import YOLO
+
+    parser = argparse.ArgumentParser(description="Compare the tuned torch CPU path with the plain YOLO call")
+    parser.add_argument('--model', required=True, help='YOLO .pt model')
+    parser.add_argument('--images', required=True, help='Folder of frames to run on')
+    parser.add_argument('--frames', type=int, default=100, help='Frames to time (cycles through the folder)')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--compile', action='store_true', help='Also time the torch.compile variant')
+    args = parser.parse_args()
+
+    paths = sorted(p for p in glob.glob(os.path.join(args.images, '*')) if p.lower().endswith(IMG_EXTS))
+    if not paths:
+        print(f"No images found in {args.images}")
+        return
+    frames = [cv2.imread(paths[i % len(paths)]) for i in range(args.frames)]
+
+    plain = YOLO(args.model)
+    variants = [("plain YOLO call", lambda im: plain(im, imgsz=args.imgsz, verbose=False))]
+    fast = FastTorchPredictor(YOLO(args.model), imgsz=args.imgsz)
+    variants.append(("fast path", fast))
+    if args.compile:
+        compiled = FastTorchPredictor(YOLO(args.model), imgsz=args.imgsz, compile=True)
+        variants.append(("fast path + compile", compiled))
+
+    print(f"{len(frames)} frames, imgsz {args.imgsz}, torch {torch.__version__}, {torch.get_num_threads()} threads")
+    baseline = None
+    outputs = {}
+    for name, predict in variants:
+        # Warm-up (and compilation) outside the timed loop
+        for im in frames[:3]:
+            predict(im)
+        times = []
+        outputs[name] = []
+        for im in frames:
+            t0 = time.perf_counter()
+            result = predict(im)[0]
+            times.append(time.perf_counter() - t0)
+            outputs[name].append(result.boxes.data.cpu().numpy())
+        mean = float(np.mean(times))
+        baseline = baseline or mean
+        print(f"{name:<22} mean {mean*1000:8.2f} ms  p95 {np.percentile(times, 95)*1000:8.2f} ms  "
+              f"speedup {baseline/mean:.2f}x")
+
+    # Check the fast path finds the same boxes
+    reference = outputs["plain YOLO call"]
+    for name in list(outputs)[1:]:
+        same_count = sum(len(a) == len(b) for a, b in zip(reference, outputs[name]))
+        max_diff = max((np.abs(a[:, :4] - b[:, :4]).max() for a, b in zip(reference, outputs[name])
+                        if len(a) == len(b) and len(a)), default=0.0)
+        print(f"{name}: same detection count on {same_count}/{len(frames)} frames, "
+              f"max box difference {max_diff:.2f} px")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,22 +10,15 @@ import cv2
 import numpy as np
 from ultralytics import YOLO
 
-# For new sound processes
-import threading
+from event_recorder import EventClipRecorder
+from telemetry import PerfMeter
+from overlay import OverlayRenderer
+from adaptive import AdaptiveController, parse_sizes
+from event_dispatcher import EventDispatcher, SoundSink, WebhookSink, LogSink
 
-# Import playsound for audio playback
-from playsound import playsound  
-
-# Timestamp of the last time the sound was played
-last_played_time_right = 0
-last_played_time_wrong = 0
+# Minimum seconds between repeated alerts for the same zone and class
 sound_delay = 2 
 
-# For threads
-def play_sound(sound_file):
-    """Plays a sound in a separate thread."""
-    playsound(sound_file)
-    
 # Define the preset zone (top-left and bottom-right coordinates)
 preset_zone_left = [(0, 0), (1280/3, 720)]  # Example coordinates
 preset_zone_right = [(2*1280/3, 0), (1280, 720)]  # Example coordinates
@@ -43,8 +36,28 @@ parser.add_argument('--thresh', help='Minimum confidence threshold for displayin
 parser.add_argument('--resolution', help='Resolution in WxH to display inference results at (example: "640x480"), \
                     otherwise, match source resolution',
                     default=None)
-parser.add_argument('--record', help='Record results from video or webcam and save it as "demo1.avi". Must specify --resolution argument to record.',
+parser.add_argument('--record', help='Record clips of disposal events from video or webcam into --record_dir. Must specify --resolution argument to record.',
                     action='store_true')
+parser.add_argument('--record_dir', help='Folder to save event clips in (default: "clips")',
+                    default='clips')
+parser.add_argument('--pre_roll', help='Seconds of footage to keep before an event (default: 3)',
+                    default=3.0, type=float)
+parser.add_argument('--post_roll', help='Seconds of footage to record after an event (default: 3)',
+                    default=3.0, type=float)
+parser.add_argument('--max_clip', help='Longest clip to write, in seconds (default: 30)',
+                    default=30.0, type=float)
+parser.add_argument('--webhook', help='URL to POST correct/incorrect disposal events to as JSON',
+                    default=None)
+parser.add_argument('--event_log', help='File to append correct/incorrect disposal events to as JSON lines',
+                    default=None)
+parser.add_argument('--metrics_log', help='Append per-stage performance snapshots to this JSONL file',
+                    default=None)
+parser.add_argument('--latency_budget', help='Inference latency budget in ms; steps the input size down/up to stay within it (default: 0, disabled)',
+                    default=0, type=float)
+parser.add_argument('--imgsz', help='Input sizes the latency budget may choose from, largest first (default: "640,480,320")',
+                    default='640,480,320')
+parser.add_argument('--fallback_model', help='Smaller model variant to switch to when the smallest input size is still over budget',
+                    default=None)
 
 args = parser.parse_args()
 
@@ -64,6 +77,19 @@ if (not os.path.exists(model_path)):
 # Load the model into memory and get labemap
 model = YOLO(model_path, task='detect')
 labels = model.names
+fallback_model = YOLO(args.fallback_model, task='detect') if args.fallback_model else None
+
+# Set up side effects for disposal events. Sounds are loaded once here and all
+# sinks run on a small fixed worker pool, off the frame loop.
+dispatcher = EventDispatcher(workers=2, debounce=sound_delay)
+dispatcher.add_sink(SoundSink({
+    'correct': "sounds/correct_answer.wav",
+    'incorrect': "sounds/wrong_answer.wav"
+}))
+if args.webhook:
+    dispatcher.add_sink(WebhookSink(args.webhook))
+if args.event_log:
+    dispatcher.add_sink(LogSink(args.event_log))
 
 # Parse input to determine if image source is a file, folder, video, or USB camera
 img_ext_list = ['.jpg','.JPG','.jpeg','.JPEG','.png','.PNG','.bmp','.BMP']
@@ -106,9 +132,11 @@ if record:
         sys.exit(0)
     
     # Set up recording
-    record_name = 'demo1.avi'
+    # Frames are kept in a ring buffer and only written (on a background thread) around events
     record_fps = 30
-    recorder = cv2.VideoWriter(record_name, cv2.VideoWriter_fourcc(*'MJPG'), record_fps, (resW,resH))
+    recorder = EventClipRecorder(args.record_dir, record_fps, (resW,resH),
+                                 pre_seconds=args.pre_roll, post_seconds=args.post_roll,
+                                 max_seconds=args.max_clip)
 
 # Load or initialize image source
 if source_type == 'image':
@@ -141,11 +169,19 @@ elif source_type == 'picamera':
 bbox_colors = [(164,120,87), (68,148,228), (93,97,209), (178,182,133), (88,159,106), 
               (96,202,231), (159,124,168), (169,162,241), (98,118,150), (172,176,184)]
 
+# Label text and its measured size are cached per (class, confidence); boxes and tags are still drawn each frame
+renderer = OverlayRenderer()
+
 # Initialize control and status variables
 avg_frame_rate = 0
-frame_rate_buffer = []
 fps_avg_len = 200
+perf = PerfMeter(window=fps_avg_len)  # Rolling per-stage timings, O(1) per frame
+
+# Steps the input size (then the fallback model) down/up to stay within --latency_budget
+controller = AdaptiveController(args.latency_budget, sizes=parse_sizes(args.imgsz),
+                                models=('main', 'fallback') if args.fallback_model else ('main',))
 img_count = 0
+previous_zone_events = set()  # (verdict, class) pairs in zone last frame; clips start on new ones
 
 # Begin inference loop
 while True:
@@ -185,13 +221,21 @@ while True:
         frame = cv2.resize(frame,(resW,resH))
 
     # Run inference on frame
-    results = model(frame, verbose=False)
+    operating_point = controller.current
+    active_model = fallback_model if (operating_point.model == 'fallback' and fallback_model) else model
+    labels = active_model.names
+    inference_start = time.perf_counter()
+    results = active_model(frame, verbose=False, imgsz=operating_point.imgsz)
+    inference_time = time.perf_counter() - inference_start
+    perf.record('inference', inference_time)
+    controller.observe(inference_time)
 
     # Extract results
     detections = results[0].boxes
 
     # Initialize variable for basic object counting example
     object_count = 0
+    zone_events = set()
 
     # Go through each detection and get bbox coords, confidence, and class
     for i in range(len(detections)):
@@ -213,13 +257,7 @@ while True:
         if conf > 0.5:
 
             color = bbox_colors[classidx % 10]
-            cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), color, 2)
-
-            label = f'{classname}: {int(conf*100)}%'
-            labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1) # Get font size
-            label_ymin = max(ymin, labelSize[1] + 10) # Make sure not to draw label too close to top of window
-            cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), color, cv2.FILLED) # Draw white box to put label text in
-            cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1) # Draw label text
+            renderer.draw_detection(frame, (xmin,ymin,xmax,ymax), classname, conf, color) # Draw box and label tag (cached layout)
 
             # Basic example: count the number of objects in the image
             object_count = object_count + 1
@@ -230,14 +268,11 @@ while True:
                 ymin < preset_zone_left[1][1] and ymax > preset_zone_left[0][1]
             ):
                 print(f"{classname} detected in preset zone! CORRECT")
+                zone_events.add(('correct', classname))
 
                 # Play sound if specific item is detected
                 if classname == "paper" or classname == "plastic" or classname == "metal":  # Replace with actual class name
-                    current_time = time.time()
-                    if (current_time - last_played_time_right) > sound_delay:
-                        sound_file = "sounds/correct_answer.wav"  # Replace with your sound file
-                        threading.Thread(target=play_sound, args=(sound_file,), daemon=True).start()
-                        last_played_time_right = time.time()
+                    dispatcher.dispatch('correct', 'left', classname, conf)
                         
             # Check if bounding box overlaps with preset zone - FOR WRONG OBJECTS
             if (
@@ -245,23 +280,25 @@ while True:
                 ymin < preset_zone_right[1][1] and ymax > preset_zone_right[0][1]
             ):
                 print(f"{classname} detected in preset zone! WRONG")
+                zone_events.add(('incorrect', classname))
 
                 # Play sound if specific item is detected
                 if classname == "paper" or classname == "plastic" or classname == "metal":  # Replace with actual class name
-                    current_time = time.time()
-                    if (current_time - last_played_time_wrong) > sound_delay:
-                        sound_file = "sounds/wrong_answer.wav"  # Replace with your sound file
-                        threading.Thread(target=play_sound, args=(sound_file,), daemon=True).start()
-                        last_played_time_wrong = time.time()
+                    dispatcher.dispatch('incorrect', 'right', classname, conf)
 
     # Calculate and draw framerate (if using video, USB, or Picamera source)
     if source_type == 'video' or source_type == 'usb' or source_type == 'picamera':
-        cv2.putText(frame, f'FPS: {avg_frame_rate:0.2f}', (10,20), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw framerate
+        cv2.putText(frame, f'FPS: {avg_frame_rate:0.2f} ({operating_point})', (10,20), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw framerate and operating point
     
     # Display detection results
     cv2.putText(frame, f'Number of objects: {object_count}', (10,40), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw total number of detected objects
     cv2.imshow('YOLO detection results',frame) # Display image
-    if record: recorder.write(frame)
+    if record:
+        # Only start/extend a clip when an item newly enters a zone, not for every frame it stays there
+        for verdict, _ in zone_events - previous_zone_events:
+            recorder.trigger(verdict)
+        recorder.add_frame(frame)
+    previous_zone_events = zone_events
 
     # If inferencing on individual images, wait for user keypress before moving to next image. Otherwise, wait 5ms before moving to next frame.
     if source_type == 'image' or source_type == 'folder':
@@ -276,26 +313,23 @@ while True:
     elif key == ord('p') or key == ord('P'): # Press 'p' to save a picture of results on this frame
         cv2.imwrite('capture.png',frame)
     
-    # Calculate FPS for this frame
+    # Calculate average FPS over the past fps_avg_len frames
     t_stop = time.perf_counter()
-    frame_rate_calc = float(1/(t_stop - t_start))
-
-    # Append FPS result to frame_rate_buffer (for finding average FPS over multiple frames)
-    if len(frame_rate_buffer) >= fps_avg_len:
-        temp = frame_rate_buffer.pop(0)
-        frame_rate_buffer.append(frame_rate_calc)
-    else:
-        frame_rate_buffer.append(frame_rate_calc)
-
-    # Calculate average FPS for past frames
-    avg_frame_rate = np.mean(frame_rate_buffer)
+    perf.record('frame', t_stop - t_start)
+    avg_frame_rate = perf.rate('frame')
+    perf.maybe_export(args.metrics_log, 10)
 
 
 # Clean up
 print(f'Average pipeline FPS: {avg_frame_rate:.2f}')
+if args.metrics_log:
+    perf.export_jsonl(args.metrics_log)
+dispatcher.close()
 if source_type == 'video' or source_type == 'usb':
     cap.release()
 elif source_type == 'picamera':
     cap.stop()
-if record: recorder.release()
+if record:
+    recorder.close()
+    print(f'Recorded {recorder.clips_written} clips ({recorder.frames_dropped} frames dropped)')
 cv2.destroyAllWindows()
@@ -1,23 +1,40 @@
 import os
 import sys
 import argparse
+import signal
 import glob
 import time
 import cv2
 import numpy as np
 from ultralytics import YOLO
 
+from event_recorder import EventClipRecorder
+from telemetry import PerfMeter
+from overlay import OverlayRenderer
+from adaptive import AdaptiveController, parse_sizes
+from shm_transport import SharedFrameRing
+
 # Define and parse user input arguments
 parser = argparse.ArgumentParser()
-parser.add_argument('--model', help='Path to YOLO model file (example: "runs/detect/train/weights/best.pt")', required=True)
+parser.add_argument('--model', help='Path to YOLO model file (example: "runs/detect/train/weights/best.pt"). Not needed with --shm_publish', default=None)
 parser.add_argument('--source', help='Image source, can be image file ("test.jpg"), \
 image folder ("test_dir"), video file ("testvid.mp4"), or index of USB camera ("usb0")', required=True)
 parser.add_argument('--thresh', help='Minimum confidence threshold for displaying detected objects (example: "0.4")', default=0.5)
 parser.add_argument('--resolution', help='Resolution in WxH to display inference results at (example: "640x480"), \
 otherwise, match source resolution', default=None)
-parser.add_argument('--record', help='Record results from video or webcam and save it as "demo1.avi". Must specify --resolution argument to record.', action='store_true')
+parser.add_argument('--record', help='Record clips of detection events from video or webcam into --record_dir. Must specify --resolution argument to record.', action='store_true')
+parser.add_argument('--record_dir', help='Folder to save event clips in (default: "clips")', default='clips')
+parser.add_argument('--pre_roll', help='Seconds of footage to keep before an event (default: 3)', default=3.0, type=float)
+parser.add_argument('--post_roll', help='Seconds of footage to record after an event (default: 3)', default=3.0, type=float)
+parser.add_argument('--max_clip', help='Longest clip to write, in seconds (default: 30)', default=30.0, type=float)
 parser.add_argument('--benchmark', help='Run benchmarking mode to measure inference speed over multiple frames', action='store_true')
 parser.add_argument('--num_frames', help='Number of frames to use for benchmarking (default: 100)', default=100, type=int)
+parser.add_argument('--metrics_log', help='Append per-stage performance snapshots to this JSONL file', default=None)
+parser.add_argument('--latency_budget', help='Inference latency budget in ms; steps the input size down/up to stay within it (default: 0, disabled)', default=0, type=float)
+parser.add_argument('--imgsz', help='Input sizes the latency budget may choose from, largest first (default: "640,480,320")', default='640,480,320')
+parser.add_argument('--shm_publish', help='Capture-only mode: publish raw frames to this shared-memory ring for the detection API (SHM_FRAME_SOURCE) instead of running inference', default=None)
+parser.add_argument('--shm_slots', help='Number of frame slots in the shared-memory ring (default: 8)', default=8, type=int)
+parser.add_argument('--fallback_model', help='Smaller model variant to switch to when the smallest input size is still over budget', default=None)
 args = parser.parse_args()
 
 # Parse user inputs
@@ -28,25 +45,31 @@ user_res = args.resolution
 record = args.record
 benchmark = args.benchmark
 num_frames = args.num_frames
+shm_name = args.shm_publish
 
-print(f'Starting YOLOv11 detection with model: {model_path}')
+if shm_name:
+    # Capture-only mode: frames go to the detection API through shared memory, no model needed
+    print(f'Publishing frames to shared memory: {shm_name}')
+else:
+    print(f'Starting YOLOv11 detection with model: {model_path}')
 
-# Check if model file exists and is valid
-if (not os.path.exists(model_path)):
-    print('ERROR: Model path is invalid or model was not found. Make sure the model filename was entered correctly.')
-    sys.exit(0)
+    # Check if model file exists and is valid
+    if (not model_path) or (not os.path.exists(model_path)):
+        print('ERROR: Model path is invalid or model was not found. Make sure the model filename was entered correctly.')
+        sys.exit(0)
 
-# Load the model into memory and get labemap
-try:
-    print("Loading model...")
-    model = YOLO(model_path, task='detect')
-    print(f"Model loaded successfully: {model_path}")
-    print(f"Model version: {model.info()['version']}")
-    print(f"Classes: {list(model.names.values())}")
-    labels = model.names
-except Exception as e:
-    print(f"Error loading model: {e}")
-    sys.exit(0)
+    # Load the model into memory and get labemap
+    try:
+        print("Loading model...")
+        model = YOLO(model_path, task='detect')
+        print(f"Model loaded successfully: {model_path}")
+        print(f"Model version: {model.info()['version']}")
+        print(f"Classes: {list(model.names.values())}")
+        labels = model.names
+        fallback_model = YOLO(args.fallback_model, task='detect') if args.fallback_model else None
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        sys.exit(0)
 
 # Parse input to determine if image source is a file, folder, video, or USB camera
 img_ext_list = ['.jpg','.JPG','.jpeg','.JPEG','.png','.PNG','.bmp','.BMP']
@@ -88,9 +111,11 @@ if record:
         print('Please specify resolution to record video at.')
         sys.exit(0)
     # Set up recording
-    record_name = 'demo1.avi'
+    # Frames are kept in a ring buffer and only written (on a background thread) around events
     record_fps = 30
-    recorder = cv2.VideoWriter(record_name, cv2.VideoWriter_fourcc(*'MJPG'), record_fps, (resW,resH))
+    recorder = EventClipRecorder(args.record_dir, record_fps, (resW,resH),
+                                 pre_seconds=args.pre_roll, post_seconds=args.post_roll,
+                                 max_seconds=args.max_clip)
 
 # Load or initialize image source
 if source_type == 'image':
@@ -121,14 +146,34 @@ elif source_type == 'picamera':
 # Set bounding box colors (using the Tableu 10 color scheme)
 bbox_colors = [(164,120,87), (68,148,228), (93,97,209), (178,182,133), (88,159,106), (96,202,231), (159,124,168), (169,162,241), (98,118,150), (172,176,184)]
 
+# Label text and its measured size are cached per (class, confidence); boxes and tags are still drawn each frame
+renderer = OverlayRenderer()
+
 # Initialize control and status variables
 avg_frame_rate = 0
-frame_rate_buffer = []
 fps_avg_len = 200
+perf = PerfMeter(window=fps_avg_len)  # Rolling per-stage timings, O(1) per frame
+
+# Steps the input size (then the fallback model) down/up to stay within --latency_budget
+controller = AdaptiveController(args.latency_budget, sizes=parse_sizes(args.imgsz),
+                                models=('main', 'fallback') if args.fallback_model else ('main',))
 img_count = 0
 
+# Shared-memory ring for --shm_publish, created once the frame size is known
+shm_ring = None
+capture_running = True
+
+def stop_capture(signum, stack):
+    global capture_running
+    capture_running = False
+
+if shm_name:
+    # There is no display window to press 'q' in, so stop cleanly on Ctrl+C
+    signal.signal(signal.SIGINT, stop_capture)
+
 # For waste classification stats
 waste_categories = {"glass": 0, "metal": 0, "paper": 0, "plastic": 0, "other": 0}
+previous_frame_waste = set()  # A clip is only triggered when a new waste type appears
 
 # For benchmarking
 if benchmark:
@@ -175,14 +220,35 @@ while True:
     if resize == True:
         frame = cv2.resize(frame,(resW,resH))
     
+    # In capture-only mode, hand the raw frame to the detection API and skip local inference
+    if shm_name:
+        if not capture_running:
+            break
+        if shm_ring is None:
+            try:
+                shm_ring = SharedFrameRing.create(shm_name, frame.shape[1], frame.shape[0], slots=args.shm_slots)
+            except FileExistsError as e:
+                print(f'{e}. Stop that writer or pick another --shm_publish name.')
+                sys.exit(0)
+        shm_ring.write(frame)
+        perf.record('frame', time.perf_counter() - t_start)
+        avg_frame_rate = perf.rate('frame')
+        continue
+    
     preprocess_end = time.perf_counter()
     preprocess_time = preprocess_end - preprocess_start
     
     # Run inference on frame
     inference_start = time.perf_counter()
-    results = model(frame, verbose=False, conf=min_thresh)
+    operating_point = controller.current
+    active_model = fallback_model if (operating_point.model == 'fallback' and fallback_model) else model
+    labels = active_model.names
+    results = active_model(frame, verbose=False, conf=min_thresh, imgsz=operating_point.imgsz)
     inference_end = time.perf_counter()
     inference_time = inference_end - inference_start
+    controller.observe(inference_time)
+    perf.record('preprocess', preprocess_time)
+    perf.record('inference', inference_time)
     
     # If in benchmark mode, record times
     if benchmark:
@@ -193,14 +259,19 @@ while True:
         if len(inference_times) >= num_frames:
             avg_inference = sum(inference_times) / len(inference_times)
             avg_preprocess = sum(preprocess_times) / len(preprocess_times)
+            avg_postprocess = sum(postprocess_times) / len(postprocess_times) if postprocess_times else 0
             
             print("\n===== BENCHMARK RESULTS =====")
             print(f"Model: {model_path}")
             print(f"Number of frames: {num_frames}")
             print(f"Average preprocessing time: {avg_preprocess*1000:.2f} ms")
             print(f"Average inference time: {avg_inference*1000:.2f} ms")
+            inference_stats = perf['inference'].snapshot()
+            print(f"Inference p50/p95/p99: {inference_stats['p50']*1000:.2f} / "
+                  f"{inference_stats['p95']*1000:.2f} / {inference_stats['p99']*1000:.2f} ms")
             print(f"Average FPS: {1.0/avg_inference:.2f}")
-            print(f"Total pipeline time: {(avg_preprocess + avg_inference)*1000:.2f} ms")
+            print(f"Average postprocessing (results + overlay) time: {avg_postprocess*1000:.2f} ms")
+            print(f"Total pipeline time: {(avg_preprocess + avg_inference + avg_postprocess)*1000:.2f} ms")
             print("=============================\n")
             break
     
@@ -241,18 +312,14 @@ while True:
         # Draw box if confidence threshold is high enough
         if conf > min_thresh:
             color = bbox_colors[classidx % 10]
-            cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), color, 2)
-            label = f'{classname}: {int(conf*100)}%'
-            labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1) # Get font size
-            label_ymin = max(ymin, labelSize[1] + 10) # Make sure not to draw label too close to top of window
-            cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), color, cv2.FILLED) # Draw white box to put label text in
-            cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1) # Draw label text
+            renderer.draw_detection(frame, (xmin,ymin,xmax,ymax), classname, conf, color) # Draw box and label tag (cached layout)
 
             # Basic example: count the number of objects in the image
             object_count = object_count + 1
     
     postprocess_end = time.perf_counter()
     postprocess_time = postprocess_end - postprocess_start
+    perf.record('postprocess', postprocess_time)
     
     if benchmark:
         postprocess_times.append(postprocess_time)
@@ -260,7 +327,7 @@ while True:
     # Calculate and draw framerate and inference time
     if source_type == 'video' or source_type == 'usb' or source_type == 'picamera':
         cv2.putText(frame, f'FPS: {avg_frame_rate:0.2f}', (10,20), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw framerate
-        cv2.putText(frame, f'Inference: {inference_time*1000:0.2f} ms', (10,50), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw inference time
+        cv2.putText(frame, f'Inference: {inference_time*1000:0.2f} ms ({operating_point})', (10,50), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw inference time and operating point
 
     # Display detection results
     cv2.putText(frame, f'Number of objects: {object_count}', (10,80), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw total number of detected objects
@@ -274,7 +341,10 @@ while True:
     cv2.imshow('YOLO detection results',frame) # Display image
 
     if record:
-        recorder.write(frame)
+        if current_frame_waste - previous_frame_waste:
+            recorder.trigger('disposal')
+        recorder.add_frame(frame)
+    previous_frame_waste = current_frame_waste
 
     # If inferencing on individual images, wait for user keypress before moving to next image. Otherwise, wait 5ms before moving to next frame.
     if source_type == 'image' or source_type == 'folder':
@@ -289,22 +359,16 @@ while True:
     elif key == ord('p') or key == ord('P'): # Press 'p' to save a picture of results on this frame
         cv2.imwrite('capture.png',frame)
 
-    # Calculate FPS for this frame
+    # Calculate average FPS over the past fps_avg_len frames
     t_stop = time.perf_counter()
-    frame_rate_calc = float(1/(t_stop - t_start))
-
-    # Append FPS result to frame_rate_buffer (for finding average FPS over multiple frames)
-    if len(frame_rate_buffer) >= fps_avg_len:
-        temp = frame_rate_buffer.pop(0)
-        frame_rate_buffer.append(frame_rate_calc)
-    else:
-        frame_rate_buffer.append(frame_rate_calc)
-
-    # Calculate average FPS for past frames
-    avg_frame_rate = np.mean(frame_rate_buffer)
+    perf.record('frame', t_stop - t_start)
+    avg_frame_rate = perf.rate('frame')
+    perf.maybe_export(args.metrics_log, 10)
 
 # Clean up
 print(f'Average pipeline FPS: {avg_frame_rate:.2f}')
+if args.metrics_log:
+    perf.export_jsonl(args.metrics_log)
 print("\nWaste Detection Summary:")
 for waste_type, count in waste_categories.items():
     if count > 0:
@@ -315,7 +379,11 @@ if source_type == 'video' or source_type == 'usb':
 elif source_type == 'picamera':
     cap.stop()
 
+if shm_ring is not None:
+    shm_ring.close()
+
 if record:
-    recorder.release()
+    recorder.close()
+    print(f'Recorded {recorder.clips_written} clips ({recorder.frames_dropped} frames dropped)')
 
 cv2.destroyAllWindows()